@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_benchmark.py                                                SCRIPT  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Tool for timing the hpRNA scripts on the shipped examples and on          ##
+##  synthetic cages of increasing size. Records wall time, paths per second,  ##
+##  peak memory and output size of each case, and compares them against a    ##
+##  stored baseline so that regressions are flagged.                          ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import sys
+import argparse
+import subprocess
+import random
+import shutil
+import string
+import tempfile
+import time
+
+### CONSTANTS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Single character position labels, as in geometry_guide.png.
+LABELS = string.ascii_lowercase + string.ascii_uppercase + string.digits
+
+FIELDS = ['wall', 'rate', 'memory', 'size']
+FORMATS = ['%.6g', '%.6g', '%i', '%i']
+
+# Seconds of wall time allowed on top of the tolerance, for start-up noise.
+SLACK = 0.1
+
+# Modules timed on import, and the slow modules they must leave to the code
+# paths that need them.
+IMPORTS = ['hpRNA_generate', 'hpRNA_constrain', 'hpRNA_ms2_draw']
+LAZY = ['numpy', 'cairo', 'matplotlib', 'subprocess', 'multiprocessing']
+
+### FUNCTION DEFINITIONS
+
+def icosahedron():
+    '''
+    Connectivity of the icosahedron: 12 positions, 5 neighbors each. Vertices
+    are the cyclic permutations of (0, +-1, +-phi), joined at distance 2.
+
+    '''
+    phi = (1 + 5 ** 0.5) / 2
+    points = []
+    for a in (-1, 1):
+        for b in (-phi, phi):
+            points += [(0, a, b), (a, b, 0), (b, 0, a)]
+    connectivity = {}
+    for n, p in enumerate(points):
+        connectivity[LABELS[n]] = [LABELS[m] for m, q in enumerate(points) if m != n and abs(sum((x - y) ** 2 for x, y in zip(p, q)) - 4) < 1e-6]
+    return connectivity
+
+def random_cubic(size, seed):
+    '''
+    Connectivity of a random connected cubic graph on size positions, by
+    pairing three stubs per position and rejecting loops, repeated edges and
+    disconnected graphs.
+
+    '''
+    rng = random.Random(seed)
+    while True:
+        stubs = [p for p in LABELS[:size] for k in range(3)]
+        rng.shuffle(stubs)
+        edges = set(tuple(sorted(e)) for e in zip(stubs[::2], stubs[1::2]))
+        if len(edges) < len(stubs) // 2 or any(a == b for a, b in edges):
+            continue
+        connectivity = dict((p, []) for p in LABELS[:size])
+        for a, b in sorted(edges):
+            connectivity[a].append(b)
+            connectivity[b].append(a)
+        reached = ['a']
+        for p in reached:
+            reached += [q for q in connectivity[p] if q not in reached]
+        if len(reached) == size:
+            return connectivity
+
+def write_lines(name, lines):
+    outfile = open(name, 'w')
+    for line in lines:
+        outfile.write(line + '\n')
+    outfile.close()
+    return name
+
+def make_cases(workdir):
+    '''
+    Benchmark cases as (name, script, arguments, output file counted for the
+    rate), run from the repository directory. Synthetic cages are written to
+    workdir. Level-by-level generation of full ms2 paths (example_1 and
+    example_4) takes far too long, so those are capped at shorter lengths.
+
+    '''
+    ex = lambda *p: os.path.join(HERE, *p)
+    out = lambda name, *p: os.path.join(workdir, name, *p)
+    start_a = write_lines(os.path.join(workdir, 'start_a.txt'), ['a'])
+    cases = []
+
+    cases.append(('generate_example_1', 'hpRNA_generate.py',
+                  ['-c', ex('example_1', 'connectivity.txt'), '-s', ex('example_1', 'start.txt'),
+                   '-l', write_lines(os.path.join(workdir, 'length_20.txt'), ['20']), '-o', out('generate_example_1')],
+                  out('generate_example_1', 'paths_out.txt')))
+    cases.append(('generate_example_1_numpy', 'hpRNA_generate.py',
+                  ['-c', ex('example_1', 'connectivity.txt'), '-s', ex('example_1', 'start.txt'),
+                   '-l', os.path.join(workdir, 'length_20.txt'), '--engine', 'numpy', '-o', out('generate_example_1_numpy')],
+                  out('generate_example_1_numpy', 'paths_out.txt')))
+    cases.append(('generate_example_2', 'hpRNA_generate.py',
+                  ['-c', ex('example_2', 'connectivity.txt'), '-s', ex('example_2', 'start.txt'),
+                   '-l', ex('example_2', 'length.txt'), '-b', '-d', ex('example_2', 'degeneracy.txt'),
+                   '-r', ex('example_2', 'require.txt'), '-o', out('generate_example_2')],
+                  out('generate_example_2', 'paths_out.txt')))
+    cases.append(('generate_example_3', 'hpRNA_generate.py',
+                  ['-c', ex('example_3', 'connectivity.txt'), '-s', ex('example_3', 'start.txt'), '-o', out('generate_example_3')],
+                  out('generate_example_3', 'paths_out.txt')))
+    cases.append(('generate_example_4', 'hpRNA_generate.py',
+                  ['-c', ex('example_4', 'connectivity.txt'), '-s', ex('example_4', 'start.txt'),
+                   '-l', write_lines(os.path.join(workdir, 'length_22.txt'), ['22']), '-o', out('generate_example_4')],
+                  out('generate_example_4', 'paths_out.txt')))
+    cases.append(('realize_example_5', 'hpRNA_constrain.py',
+                  ['-p', ex('example_5', 'paths_out.txt'), '-r', ex('example_5', 'realize.txt'),
+                   '-d', ex('example_5', 'degeneracy.txt'), '-b', '-m', '-c', ex('example_1', 'connectivity.txt'),
+                   '-o', out('realize_example_5')],
+                  out('realize_example_5', 'paths_out_realized.txt')))
+    cases.append(('constrain_example_6', 'hpRNA_constrain.py',
+                  ['-p', ex('example_6', 'paths_out_realized.txt'), '-x', ex('example_6', 'constrain.txt'),
+                   '-m', '-c', ex('example_6', 'connectivity.txt'), '-o', out('constrain_example_6')],
+                  ex('example_6', 'paths_out_realized.txt')))
+    cases.append(('draw_example_6', 'hpRNA_constrain.py',
+                  ['-p', ex('example_6', 'paths_out_realized.txt'), '--ms2', '-x', ex('example_6', 'constrain.txt'),
+                   '-c', ex('example_6', 'connectivity.txt'), '-o', out('draw_example_6')],
+                  ex('example_6', 'paths_out_realized.txt')))
+
+    cages = [('icosahedron', icosahedron())]
+    cages += [('cubic_%02i' % (size,), random_cubic(size, size)) for size in (16, 20, 24, 28)]
+    for name, connectivity in cages:
+        connfile = write_lines(os.path.join(workdir, name + '.txt'), [p + ' ' + ' '.join(connectivity[p]) for p in sorted(connectivity)])
+        cases.append(('generate_' + name, 'hpRNA_generate.py',
+                      ['-c', connfile, '-s', start_a, '-o', out('generate_' + name)],
+                      out('generate_' + name, 'paths_out.txt')))
+
+    return cases
+
+def can_draw():
+    '''
+    Whether hpRNA_ms2_draw can draw, i.e. cairo exists.
+
+    '''
+    return subprocess.call([sys.executable, '-c', 'import cairo'], cwd=HERE, stderr=open(os.devnull, 'w')) == 0
+
+def import_case(module):
+    '''
+    Import module in a child process. Returns the seconds taken, beyond
+    starting the interpreter, and the LAZY modules the import loaded.
+
+    '''
+    code = 'import sys, time\nt = time.time()\nimport %s\nprint time.time() - t\nprint " ".join(m for m in %r if m in sys.modules)' % (module, LAZY)
+    child = subprocess.Popen([sys.executable, '-c', code], cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = child.communicate()
+    if child.returncode:
+        raise Exception("importing %s failed: %s" % (module, err.strip().split('\n')[-1]))
+    seconds, loaded = (out.split('\n') + [''])[:2]
+    return float(seconds), loaded.split()
+
+def run_case(script, arguments, counted):
+    '''
+    Run one case in a child process. Returns wall time, paths per second,
+    peak memory of the child in kB and total output size in bytes.
+
+    '''
+    outdir = arguments[arguments.index('-o') + 1]
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    os.makedirs(outdir)
+
+    devnull = open(os.devnull, 'w')
+    errfile = tempfile.TemporaryFile()
+    began = time.time()
+    child = subprocess.Popen([sys.executable, os.path.join(HERE, script)] + arguments, cwd=HERE, stdout=devnull, stderr=errfile)
+    pid, status, usage = os.wait4(child.pid, 0)
+    wall = time.time() - began
+    if status:
+        errfile.seek(0)
+        raise Exception("%s failed: %s" % (script, errfile.read().strip().split('\n')[-1]))
+
+    paths = sum(1 for line in open(counted)) if os.path.exists(counted) else 0
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, ds, fs in os.walk(outdir) for f in fs)
+    return wall, paths / wall, usage.ru_maxrss, size
+
+def read_results(name):
+    '''
+    Read a results file written by write_results, into a dictionary of field
+    dictionaries by case.
+
+    '''
+    results = {}
+    infile = open(name)
+    for line in infile:
+        line = line.strip().split()
+        if line and line[0] != 'case':
+            results[line[0]] = dict(zip(FIELDS, [float(a) for a in line[1:]]))
+    infile.close()
+    return results
+
+def write_results(name, results):
+    outfile = open(name, 'w')
+    outfile.write('case\t' + '\t'.join(FIELDS) + '\n')
+    for case in sorted(results):
+        outfile.write(case + '\t' + '\t'.join(form % (results[case][f],) for f, form in zip(FIELDS, FORMATS)) + '\n')
+    outfile.close()
+
+def regressions(results, baseline, tolerance):
+    '''
+    Cases slower, or using more memory, than the baseline by more than the
+    tolerance fraction, or writing a different amount of output. Wall time
+    is also allowed SLACK seconds.
+
+    '''
+    flagged = []
+    for case in sorted(results):
+        if case not in baseline:
+            continue
+        now, then = results[case], baseline[case]
+        if now['wall'] > then['wall'] * (1 + tolerance) + SLACK:
+            flagged.append('%s: wall %.3g s, baseline %.3g s' % (case, now['wall'], then['wall']))
+        if now['memory'] > then['memory'] * (1 + tolerance):
+            flagged.append('%s: memory %i kB, baseline %i kB' % (case, now['memory'], then['memory']))
+        if now['size'] != then['size']:
+            flagged.append('%s: output %i bytes, baseline %i bytes' % (case, now['size'], then['size']))
+    return flagged
+
+def benchmark(args):
+    '''
+    Run every selected case args.repeat times, keeping the fastest run, and
+    compare with the baseline.
+
+    '''
+    workdir = os.path.abspath(os.path.join(args.output, 'runs'))
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+
+    cases = make_cases(workdir)
+    if args.cases:
+        cases = [c for c in cases if any(c[0].startswith(a) for a in args.cases)]
+    drawing = can_draw()
+
+    results = {}
+    eager = []
+    print '%-28s %10s %12s %10s %12s' % ('case', 'wall (s)', 'paths/s', 'memory kB', 'output B')
+    for module in IMPORTS:
+        name = 'import_' + module
+        if args.cases and not any(name.startswith(a) for a in args.cases):
+            continue
+        runs = [import_case(module) for r in range(args.repeat)]
+        wall = min(r[0] for r in runs)
+        loaded = runs[0][1]
+        results[name] = dict(zip(FIELDS, (wall, 0, 0, 0)))
+        print '%-28s %10.3f %12s %10s %12s%s' % (name, wall, '-', '-', '-', '   loads ' + ' '.join(loaded) if loaded else '')
+        eager += ['%s: loads %s at import' % (name, m) for m in loaded]
+    for name, script, arguments, counted in cases:
+        if name.startswith('draw') and not drawing:
+            print '%-28s skipped, cairo cannot be imported' % (name,)
+            continue
+        runs = [run_case(script, arguments, counted) for r in range(args.repeat)]
+        wall, rate, memory, size = min(runs)
+        results[name] = dict(zip(FIELDS, (wall, rate, memory, size)))
+        print '%-28s %10.3f %12.0f %10i %12i' % (name, wall, rate, memory, size)
+        sys.stdout.flush()
+
+    write_results(os.path.join(args.output, 'benchmark_out.txt'), results)
+    if not args.keep:
+        shutil.rmtree(workdir)
+
+    if args.save:
+        write_results(args.baseline, results)
+        print '\nBaseline saved to %s' % (args.baseline,)
+    elif os.path.exists(args.baseline) or eager:
+        flagged = eager
+        if os.path.exists(args.baseline):
+            flagged += regressions(results, read_results(args.baseline), args.tolerance)
+        if flagged:
+            print '\nREGRESSIONS'
+            for line in flagged:
+                print '  ' + line
+            sys.exit(1)
+        print '\nNo regressions against %s' % (args.baseline,)
+
+### MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark hpRNA on the examples and on synthetic cages")
+    parser.add_argument("-o", "--output", help='Directory OUTPUT. Choose output directory, for benchmark_out.txt and the runs. Default \'benchmark\'.', default='benchmark')
+    parser.add_argument("-c", "--cases", help='Names CASES. Only run cases whose names start with one of CASES, e.g. generate_example_3 or realize.', nargs='+')
+    parser.add_argument("-n", "--repeat", help='Int REPEAT. Run each case REPEAT times and keep the fastest. Default 3.', type=int, default=3)
+    parser.add_argument("--baseline", help='File BASELINE. Results to compare against, as written by --save. Default benchmark_baseline.txt in OUTPUT.')
+    parser.add_argument("--save", help='Option. Save these results as the BASELINE instead of comparing with it.', action='store_true')
+    parser.add_argument("--tolerance", help='Float TOLERANCE. Fraction by which wall time or memory may exceed the baseline before a case is flagged. Default 0.25.', type=float, default=0.25)
+    parser.add_argument("--keep", help='Option. Keep the outputs of every case in OUTPUT/runs.', action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.output):
+        try:
+            os.makedirs(args.output)
+        except:
+            parser.error("--output directory error.")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1.")
+    if args.baseline is None:
+        args.baseline = os.path.join(args.output, 'benchmark_baseline.txt')
+
+    benchmark(args)
+
+### ENDS
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_cache.py                                                    MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for caching the results of constraining a path library             ##
+##  (hpRNA_constrain.py --cache). A result is the set of paths passing a      ##
+##  constraint set, held as a bitmap over the lines of the library, so that   ##
+##  a tighter or looser constraint set only tests the paths whose outcome     ##
+##  can change. Results are evicted least recently used first.                ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import time
+import hashlib
+import numpy as np
+
+### CONSTANTS
+
+# Bytes of a library hashed at once.
+READ = 1 << 24
+
+### FUNCTION DEFINITIONS
+
+def constraint_set(constraints):
+    '''
+    Canonical form of constraints, as from hpRNA_constrain.make_constraints:
+    a frozenset of (edge, occupied) pairs, with each edge written with its
+    positions in order.
+
+    '''
+    constrain_occ, constrain_unocc = constraints
+    return frozenset([(min(e), 1) for e in constrain_occ] + [(min(e), 0) for e in constrain_unocc])
+
+def set_text(cset):
+    return ','.join('%s:%i' % e for e in sorted(cset)) or '-'
+
+def text_set(text):
+    if text == '-':
+        return frozenset()
+    return frozenset((e[:-2], int(e[-1])) for e in text.split(','))
+
+
+class ResultCache(object):
+    '''
+    Cache of constraint results in directory path, of at most budget bytes.
+    manifest.txt holds one line per result: library hash, last use, number
+    of paths passing, bytes, bitmap file and constraint set. libraries.txt
+    remembers the hash, path count and total weight of each library file by
+    its name, size, modification time, inode and change time, so a library
+    is read in full only once.
+
+    '''
+
+    def __init__(self, path, budget):
+        self.path = path
+        self.budget = budget
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.entries = []
+        name = os.path.join(path, 'manifest.txt')
+        if os.path.exists(name):
+            for line in open(name):
+                lib, used, count, size, bits, cset = line.split()
+                if os.path.exists(os.path.join(path, bits)):
+                    self.entries.append([lib, float(used), int(count), int(size), bits, text_set(cset)])
+
+    def library(self, name, lines):
+        '''
+        Hash, number of paths and total weight of library file name, whose
+        lines are given by the function lines when they need reading.
+
+        '''
+        # Whole-second times would miss a file rewritten at the same size
+        # within the second, so the inode and change time are taken too.
+        stat = os.stat(name)
+        key = '%s\t%i\t%r\t%i\t%r' % (os.path.abspath(name), stat.st_size, stat.st_mtime, stat.st_ino, stat.st_ctime)
+        memo = os.path.join(self.path, 'libraries.txt')
+        known = {}
+        if os.path.exists(memo):
+            for line in open(memo):
+                fields = line.rstrip('\n').split('\t')
+                lib, count, weight = fields[-3:]
+                known['\t'.join(fields[:-3])] = (lib, int(count), float(weight))
+        if key not in known:
+            digest = hashlib.sha1()
+            infile = open(name, 'rb')
+            for block in iter(lambda: infile.read(READ), ''):
+                digest.update(block)
+            infile.close()
+            count = 0
+            weight = 0.0
+            for line in lines():
+                count += 1
+                weight += float((line.split() + ['1'])[1])
+            known[key] = (digest.hexdigest(), count, weight)
+            outfile = open(memo + '.tmp', 'w')
+            for k, (lib, count, weight) in sorted(known.items()):
+                outfile.write('%s\t%s\t%i\t%r\n' % (k, lib, count, weight))
+            outfile.close()
+            os.rename(memo + '.tmp', memo)
+        return known[key]
+
+    def lookup(self, lib, cset, total):
+        '''
+        Best cached result to start from for constraint set cset on library
+        lib of total paths: the result for cset itself, or the one leaving
+        fewest paths to test. A result for a subset of cset leaves its
+        passing paths to test, as only they can pass cset; a result for a
+        superset leaves the rest, as its passing paths pass cset too. Returns
+        the entry and its bitmap, or None.
+
+        '''
+        best = None
+        tests = total
+        for entry in self.entries:
+            if entry[0] != lib:
+                continue
+            if entry[5] == cset:
+                best = entry
+                break
+            if entry[5] <= cset and entry[2] < tests:
+                best, tests = entry, entry[2]
+            elif entry[5] >= cset and total - entry[2] < tests:
+                best, tests = entry, total - entry[2]
+        if best is None:
+            return None
+        best[1] = time.time()
+        bits = np.unpackbits(np.fromfile(os.path.join(self.path, best[4]), dtype=np.uint8))[:total].astype(bool)
+        self.evict(best)
+        return best, bits
+
+    def store(self, lib, cset, bits):
+        '''
+        Add the bitmap of paths passing cset on library lib, then evict the
+        least recently used results until the cache is within budget.
+
+        '''
+        name = '%s.bits' % (hashlib.sha1(lib + set_text(cset)).hexdigest()[:20],)
+        np.packbits(bits.astype(np.uint8)).tofile(os.path.join(self.path, name))
+        self.entries = [e for e in self.entries if e[4] != name]
+        entry = [lib, time.time(), int(bits.sum()), os.path.getsize(os.path.join(self.path, name)), name, cset]
+        self.entries.append(entry)
+        self.evict(entry)
+
+    def evict(self, entry):
+        '''
+        Remove the least recently used results, other than entry, until the
+        cache is within budget, and save the manifest.
+
+        '''
+        self.entries.sort(key=lambda e: e[1])
+        while sum(e[3] for e in self.entries) > self.budget and self.entries[0] is not entry:
+            os.remove(os.path.join(self.path, self.entries.pop(0)[4]))
+        self.save()
+
+    def save(self):
+        outfile = open(os.path.join(self.path, 'manifest.txt.tmp'), 'w')
+        for lib, used, count, size, bits, cset in self.entries:
+            outfile.write('%s %r %i %i %s %s\n' % (lib, used, count, size, bits, set_text(cset)))
+        outfile.close()
+        os.rename(os.path.join(self.path, 'manifest.txt.tmp'), os.path.join(self.path, 'manifest.txt'))
+
+### END OF MODULE
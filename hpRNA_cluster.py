@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_cluster.py                                                  MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for clustering paths by the cage edges they use (hpRNA_constrain   ##
+##  .py --cluster). Each path is held as a bitset of edges. Small sets of     ##
+##  paths are compared in full with bitwise operations; large ones are first  ##
+##  bucketed by MinHash signatures (locality sensitive hashing), so only      ##
+##  paths sharing a bucket are compared.                                      ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import numpy as np
+
+### CONSTANTS
+
+# Paths read and indexed at once.
+BLOCK = 1 << 16
+
+# Set bits in each byte value.
+POPCOUNT = np.array([bin(b).count('1') for b in range(256)], dtype=np.int64)
+
+# Most paths compared in full; more are bucketed by MinHash first.
+EXACT = 1 << 12
+
+# MinHash values per path, split into bands, and the chance that a path
+# within the distance shares a band with its representative.
+HASHES = 64
+RECALL = 0.99
+
+### FUNCTION DEFINITIONS
+
+def edge_codes(text):
+    '''
+    Cage edge stepped along at each step of the paths in text, one path to a
+    line, as the two character codes in order in one int, with the line of
+    each step.
+
+    '''
+    t = np.frombuffer(text, dtype=np.uint8).astype(np.int64)
+    ends = t == 10
+    inside = ~(ends[:-1] | ends[1:])
+    a, b = t[:-1][inside], t[1:][inside]
+    line = (np.cumsum(ends) - ends)[:-1][inside]
+    return np.minimum(a, b) << 8 | np.maximum(a, b), line
+
+def edge_sets(paths):
+    '''
+    Edges used by each of paths, as a (edges, paths) boolean array, and the
+    code of each edge as from edge_codes.
+
+    '''
+    present = np.zeros(1 << 16, dtype=bool)
+    for lo in range(0, len(paths), BLOCK):
+        present[edge_codes('\n'.join(paths[lo:lo+BLOCK]) + '\n')[0]] = True
+    codes = np.flatnonzero(present)
+    table = np.zeros(1 << 16, dtype=np.int64)
+    table[codes] = np.arange(len(codes))
+    columns = np.zeros((len(codes), len(paths)), dtype=bool)
+    for lo in range(0, len(paths), BLOCK):
+        step, line = edge_codes('\n'.join(paths[lo:lo+BLOCK]) + '\n')
+        columns[table[step], line + lo] = True
+    return columns, codes
+
+def distance(packed, sizes, k, others, hamming=False):
+    '''
+    Distance from path k to each of others, given each path's packed edge
+    bitset and number of edges: the number of edges used by only one of the
+    two if hamming, otherwise the Jaccard distance, the fraction of the edges
+    used by either that only one uses.
+
+    '''
+    shared = POPCOUNT[packed[others] & packed[k]].sum(axis=1)
+    differ = sizes[others] + sizes[k] - 2 * shared
+    if hamming:
+        return differ
+    return differ / np.maximum(differ + shared, 1).astype(float)
+
+def minhash(columns, rows, random):
+    '''
+    MinHash signatures of the edge sets in columns under rows random orders
+    of the edges: for each order, the place in it of the first edge each
+    path uses. Paths share each value with probability their Jaccard
+    similarity. Paths use a good fraction of the edges, so the first few
+    edges of an order settle nearly every path.
+
+    '''
+    edges, count = columns.shape
+    signature = np.empty((rows, count), dtype=np.int64)
+    for r in range(rows):
+        signature[r] = edges
+        left = np.arange(count)
+        for place, edge in enumerate(random.permutation(edges)):
+            hit = columns[edge, left]
+            signature[r, left[hit]] = place
+            left = left[~hit]
+            if not len(left):
+                break
+    return signature
+
+def bands(similarity):
+    '''
+    Number of bands, and MinHash values in each, of the HASHES values of a
+    path, for paths of the given Jaccard similarity to share a band with
+    chance RECALL. Longer bands give smaller buckets.
+
+    '''
+    for rows in range(HASHES, 0, -1):
+        if 1 - (1 - similarity ** rows) ** (HASHES // rows) >= RECALL:
+            return HASHES // rows, rows
+    return HASHES, 1
+
+def buckets(columns, similarity, seed=0):
+    '''
+    Paths sharing each band of MinHash signature, as a list of [bucket of
+    each path, start and size of each bucket, paths in bucket order], one
+    entry per band.
+
+    '''
+    random = np.random.RandomState(seed)
+    count = columns.shape[1]
+    number, rows = bands(similarity)
+    found = []
+    for b in range(number):
+        key = np.zeros(count, dtype=np.uint64)
+        for value in minhash(columns, rows, random):
+            key = key * np.uint64(columns.shape[0] + 1) + value.astype(np.uint64)
+        keys, bucket, size = np.unique(key, return_inverse=True, return_counts=True)
+        start = np.cumsum(size) - size
+        found.append([bucket, start, size, np.argsort(bucket, kind='mergesort')])
+    return found
+
+def drop(found, done):
+    '''
+    Remove the paths done from the buckets of found, in place.
+
+    '''
+    for band in found:
+        bucket, start, size, members = band
+        members = members[~done[members]]
+        size = np.bincount(bucket[members], minlength=len(size))
+        band[1:] = [np.cumsum(size) - size, size, members]
+
+def cluster(paths, limit, hamming=False, seed=0):
+    '''
+    Cluster paths, a list of position strings, so that every path is within
+    distance limit of its cluster's representative. Paths are taken in
+    order, each not yet clustered becoming the representative of a new
+    cluster of itself and every unclustered path within limit. Returns
+    (representative, members) pairs, as indices into paths.
+
+    Up to EXACT paths, each representative is compared with every
+    unclustered path. Beyond, it is compared only with the paths sharing a
+    MinHash bucket with it, so a path within limit may, rarely, be missed
+    and left to another cluster.
+
+    '''
+    columns, codes = edge_sets(paths)
+    sizes = columns.sum(axis=0)
+    packed = np.packbits(columns.T, axis=1)
+    clusters = []
+
+    if len(paths) <= EXACT:
+        left = np.arange(len(paths))
+        while len(left):
+            near = distance(packed, sizes, left[0], left, hamming) <= limit
+            clusters.append((left[0], left[near]))
+            left = left[~near]
+        return clusters
+
+    if hamming:
+        # Least Jaccard similarity of paths of the fewest edges this far apart.
+        least = sizes.min()
+        similarity = max(least - limit / 2.0, 0) / (least + limit / 2.0) if least else 0
+    else:
+        similarity = 1 - limit
+    found = buckets(columns, similarity, seed)
+    done = np.zeros(len(paths), dtype=bool)
+    # Paths alone in every bucket share none with another path.
+    alone = np.all([size[bucket] == 1 for bucket, start, size, members in found], axis=0)
+    done |= alone
+    dropped = clustered = int(alone.sum())
+    place = np.zeros(len(paths), dtype=np.int64)
+    for k in xrange(len(paths)):
+        if done[k]:
+            continue
+        others = np.concatenate([members[start[bucket[k]]:start[bucket[k]] + size[bucket[k]]]
+                                 for bucket, start, size, members in found])
+        others = others[~done[others]]
+        # Keep one of each, without sorting: the last place each was put in.
+        place[others] = np.arange(len(others))
+        others = others[place[others] == np.arange(len(others))]
+        near = np.sort(others[distance(packed, sizes, k, others, hamming) <= limit])
+        done[near] = True
+        clusters.append((k, near))
+        clustered += len(near)
+        # Clustered paths are dropped from the buckets once they are a good
+        # part of those left, so buckets are not scanned for them again.
+        if 4 * (clustered - dropped) > len(paths) - dropped:
+            drop(found, done)
+            dropped = clustered
+    clusters.extend((k, np.array([k])) for k in np.flatnonzero(alone))
+    clusters.sort(key=lambda c: c[0])
+    return clusters
+
+### END OF MODULE
@@ -22,9 +22,23 @@
 
 import os
 import sys
+import gzip
+import mmap
 import argparse
-import numpy as np
 import string
+import random
+import itertools
+from hpRNA_generate import read_connectivity, read_moves, read_symmetries
+from hpRNA_profile import stage, profiling
+from hpRNA_io import BLOCK, compressed, open_paths, read_file
+
+### CONSTANTS
+
+# Most bytes of PATHS filtered by one task of --workers.
+CHUNK = 1 << 24
+
+# Largest clusters printed by --cluster.
+CLUSTERS = 10
 
 ### FUNCTION DEFINITIONS
 
@@ -79,6 +93,66 @@ def notation(path, connectivity):
     '''
     return ''.join(str(connectivity[a].index(b) + 1) for a, b in zip(path[:-1], path[1:]))
         
+def positions(moves, start, connectivity):
+    '''
+    Change from move notation back to positions, starting at start. Returns
+    None if the moves revisit a position, or take a column a position does
+    not have.
+    
+    '''
+    path = start
+    for m in moves:
+        if int(m) > len(connectivity[path[-1]]):
+            return None
+        path += connectivity[path[-1]][int(m) - 1]
+    if len(set(path)) != len(path):
+        return None
+    return path
+
+def read_paths(infile, connectivity=None):
+    '''
+    Iterate over the lines of a PATHS file, decompressing it if it is named
+    .gz, or rebuilding it from the levels below if it is a level written by
+    hpRNA_generate.py --trie (.trie). Move files written by hpRNA_generate.py
+    --moves (.bin) hold one word per mirror/reverse class; every word of each
+    class that is a path from the stored start is given, in positions.
+    
+    '''
+    if infile.name.endswith('.trie'):
+        import hpRNA_trie
+        trie = hpRNA_trie.Trie(os.path.dirname(infile.name), int(os.path.basename(infile.name)[6:-5]))
+        infile.close()
+        for block in trie.blocks():
+            for line in block.splitlines(True):
+                yield line
+        return
+    if compressed(infile.name):
+        infile = gzip.GzipFile(infile.name, 'rb', fileobj=infile)
+    if not infile.name.endswith('.bin'):
+        for line in infile:
+            yield line
+        return
+    start, words = read_moves(infile)
+    for word in words:
+        for w in sorted(set(permute_path(word))):
+            path = positions(w, start, connectivity)
+            if path:
+                yield path + '\n'
+
+def path_file_name(args):
+    '''
+    Name and extension of PATHS, for naming outputs. Move and trie files give
+    text, and compressed files give compressed outputs, e.g. paths_out.txt.gz
+    gives paths_out_constrained.txt.gz.
+    
+    '''
+    hpath_input_name = os.path.basename(args.paths.name)
+    gz = '.gz' if compressed(hpath_input_name) else ''
+    hpath_input_name, hpath_input_extension = os.path.splitext(hpath_input_name[:len(hpath_input_name)-len(gz)])
+    if hpath_input_extension in ('.bin', '.trie'):
+        hpath_input_extension = '.txt'
+    return hpath_input_name, hpath_input_extension + gz
+
 def comparison(input_paths, output_paths):
     '''
     Print a little comparison before and after constraints
@@ -101,98 +175,318 @@ def comparison(input_paths, output_paths):
     print '**                          **'
     print '******************************\n'
 
-def constrain(args):
+def read_constraints(constraintfile):
     '''
-    Function for constraining paths. A constraint file is loaded containing
-    components of the paths, with specifiers to whether the components are
-    present or not present. These paths are filtered against these constraints:
-    only paths that pass all constraints are output. If ms2 is selected,
-    special analysis will be run (including drawing of output paths).
+    Load a constraint file into lists of occupied and unoccupied edges, each
+    edge given in both directions.
+    
+    '''
+    edges = [line.strip().split() for line in constraintfile if line.strip()]
+    constraintfile.close()
+    return make_constraints((edge, int(boolean)) for edge, boolean in edges)
+
+def make_constraints(edges):
+    '''
+    Lists of occupied and unoccupied edges, each edge given in both
+    directions, from (edge, occupied) pairs such as ('ab', 1) or a dictionary
+    of them.
     
     '''
+    if isinstance(edges, dict):
+        edges = edges.items()
     
     constrain_occ = []
     constrain_unocc = []
     
-    for line in args.constraints:
-        (edgeA, edgeB), boolean = line.strip().split()
-        if int(boolean):
+    for (edgeA, edgeB), boolean in edges:
+        if boolean:
             constrain_occ.append((edgeA+edgeB, edgeB+edgeA))
         else:
             constrain_unocc.append((edgeA+edgeB, edgeB+edgeA))
-    args.constraints.close()
+    
+    return constrain_occ, constrain_unocc
+
+def passes(path, constraints):
+    '''
+    Whether a path uses every occupied edge and no unoccupied edge of
+    constraints, as from make_constraints.
+    
+    '''
+    constrain_occ, constrain_unocc = constraints
+    for opt1, opt2 in constrain_occ:
+        if (opt1 not in path) and (opt2 not in path):
+            return False
+    for opt1, opt2 in constrain_unocc:
+        if (opt1 in path) or (opt2 in path):
+            return False
+    return True
+
+def filter_paths(paths, constraints):
+    '''
+    Iterate over the paths passing constraints, as from make_constraints.
+    Paths may be lines of a PATHS file, which are given back unchanged. For
+    example,
+    
+        constraints = make_constraints({'cd': 1, 'lm': 0})
+        for path in filter_paths(iter_paths(connectivity, ['ab']), constraints):
+            ...
+    
+    '''
+    for path in paths:
+        if path.strip() and passes(path.split()[0], constraints):
+            yield path
+
+def constrain_zdd(args):
+    '''
+    Constrain a path library held as a decision diagram (written by
+    hpRNA_generate.py --zdd). Constraints are applied to the diagram itself,
+    so the cost follows the size of the diagram rather than the number of
+    paths. The constrained diagram is saved, and --sample paths are drawn
+    uniformly from it.
+    
+    '''
+    import hpRNA_zdd
+    
+    with stage('load'):
+        zdd = hpRNA_zdd.load(args.paths)
+    incount = zdd.total()
+    
+    with stage('constrain'):
+        if args.constraints:
+            constrain_occ, constrain_unocc = read_constraints(args.constraints)
+            for edge in constrain_occ + constrain_unocc:
+                if edge[0] not in zdd.index:
+                    raise Exception("Constraint %s is not an edge of the cage" % (edge[0],))
+            zdd.constrain(constrain_occ, constrain_unocc)
+    outcount = zdd.total()
+    
+    hpath_input_name, hpath_input_extension = os.path.splitext(os.path.basename(args.paths.name))
+    with stage('save'):
+        zdd.save(os.path.join(args.output, hpath_input_name + '_constrained' + hpath_input_extension))
+    
+    print 'original:  ' + str(incount)
+    print 'processed: ' + str(outcount)
+    
+    with stage('sample'):
+        if args.sample and outcount:
+            rng = random.Random(args.seed)
+            outfile = open(os.path.join(args.output, hpath_input_name + '_constrained_sample.txt'), 'w')
+            weights = [zdd.count(n) for start, end, n in zdd.roots]
+            for k in range(args.sample):
+                # Choose a root in proportion to its paths, then a path within it.
+                pick = rng.randrange(outcount)
+                for (start, end, n), w in zip(zdd.roots, weights):
+                    if pick < w:
+                        break
+                    pick -= w
+                outfile.write(zdd.to_path(zdd.sample(n, rng), start) + '\n')
+            outfile.close()
+
+def line_with(path, weight):
+    '''
+    Output line for a path, keeping any weight it was read with.
+    
+    '''
+    if weight == '1':
+        return path + '\n'
+    return path + '\t' + weight + '\n'
+
+def filter_chunk(task):
+    '''
+    Filter the paths in bytes start to end of path file name, for --workers.
+    Gives the paths and weights read and passed, and the output text of the
+    paths passed and, if connectivity is given, of their moves, as the serial
+    loop of constrain writes them.
+    
+    '''
+    name, start, end, constraints, connectivity = task
+    infile = open(name, 'rb')
+    data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    counts = [0, 0, 0.0, 0.0]
+    out = []
+    m_out = []
+    for hampath in data[start:end].splitlines():
+        if not hampath.strip():
+            continue
+        counts[0] += 1
+        hampath, weight = (hampath.strip().split() + ['1'])[:2]
+        counts[2] += float(weight)
+        if passes(hampath, constraints):
+            counts[1] += 1
+            counts[3] += float(weight)
+            out.append(line_with(hampath, weight))
+            if connectivity:
+                m_out.append(line_with(notation(hampath, connectivity), weight))
+    data.close()
+    infile.close()
+    return counts, ''.join(out), ''.join(m_out)
+
+def filter_parallel(name, constraints, connectivity, workers):
+    '''
+    Iterate over the results of filter_chunk for line-aligned chunks of path
+    file name, filtered by a pool of worker processes, in file order. Chunks
+    are at most CHUNK bytes, and there are several per worker to balance the
+    load.
+    
+    '''
+    import multiprocessing
+    from hpRNA_index import line_chunks
+    
+    chunks = line_chunks(name, max(workers * 4, os.path.getsize(name) // CHUNK + 1))
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(filter_chunk, [(name, a, b, constraints, connectivity) for a, b in chunks]):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def filter_cached(name, constraints, connectivity, cache):
+    '''
+    As filter_parallel, for --cache. The paths of path file name passing
+    constraints are found from the best result in cache (see
+    hpRNA_cache.ResultCache.lookup), testing only the paths it leaves
+    undecided, and the new result is cached. The first result gives the
+    paths and weights read, and the rest the output of the paths passed, a
+    block at a time.
+    
+    '''
+    import numpy as np
+    from hpRNA_index import line_ends
+    from hpRNA_cache import constraint_set
+    
+    size = os.path.getsize(name)
+    infile = open(name, 'rb')
+    data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) if size else ''
+    ends = line_ends(name)
+    starts = np.append(0, ends[:-1])
+    # Blank lines are not paths; only lines of at most two bytes can be.
+    blank = [k for k in np.flatnonzero(ends - starts <= 2) if not data[starts[k]:ends[k]].strip()]
+    if blank:
+        starts = np.delete(starts, blank)
+        ends = np.delete(ends, blank)
+    
+    lib, total, weight = cache.library(name, lambda: (data[a:b] for a, b in zip(starts, ends)))
+    cset = constraint_set(constraints)
+    found = cache.lookup(lib, cset, total)
+    if found is None:
+        keep = np.zeros(total, dtype=bool)
+        test = np.arange(total)
+    elif found[0][5] == cset:
+        keep = found[1]
+        test = []
+    elif found[0][5] <= cset:
+        keep = np.zeros(total, dtype=bool)
+        test = np.flatnonzero(found[1])
+    else:
+        keep = found[1].copy()
+        test = np.flatnonzero(~found[1])
+    for k in test:
+        if passes(data[starts[k]:ends[k]].split()[0], constraints):
+            keep[k] = True
+    if len(test):
+        cache.store(lib, cset, keep)
+    
+    yield [total, 0, weight, 0.0], '', ''
+    passed = np.flatnonzero(keep)
+    for lo in range(0, len(passed), BLOCK):
+        out = []
+        m_out = []
+        counts = [0, 0, 0.0, 0.0]
+        for k in passed[lo:lo+BLOCK]:
+            hampath, weight = (data[starts[k]:ends[k]].strip().split() + ['1'])[:2]
+            counts[1] += 1
+            counts[3] += float(weight)
+            out.append(line_with(hampath, weight))
+            if connectivity:
+                m_out.append(line_with(notation(hampath, connectivity), weight))
+        yield counts, ''.join(out), ''.join(m_out)
+    if size:
+        data.close()
+    infile.close()
+
+def constrain(args):
+    '''
+    Function for constraining paths. A constraint file is loaded containing
+    components of the paths, with specifiers to whether the components are
+    present or not present. These paths are filtered against these constraints:
+    only paths that pass all constraints are output. If ms2 is selected,
+    special analysis will be run (including drawing of output paths).
+    
+    '''
+    
+    constrain_occ, constrain_unocc = read_constraints(args.constraints)
 
     # Load in file with constrained edges
     # Sample constraint file provided as constraint.txt
 
     # Sift through paths, removing those that do not meet constraints
-    hpath_input_name, hpath_input_extension = os.path.splitext(os.path.basename(args.paths.name))
+    hpath_input_name, hpath_input_extension = path_file_name(args)
     
     infile = args.paths
     
     if not args.ms2:
         outfile_n = os.path.join(args.output, hpath_input_name + '_constrained' + hpath_input_extension)
-        outfile = open(outfile_n, 'w')
+        outfile = open_paths(outfile_n, 'w', args.background)
+    
+    connectivity = read_connectivity(args.connectivity) if args.connectivity else None
     
     if args.moves or args.ms2:
-        connfile = args.connectivity
-        connectivity = {}
-        for line in connfile:
-            line = line.strip().split()
-            connectivity[line[0]] = line[1:]
-        connfile.close()
         if not args.ms2:
             m_outfile_n = os.path.join(args.output, hpath_input_name + '_constrained_moves' + hpath_input_extension)
-            m_outfile = open(m_outfile_n, 'w')
+            m_outfile = open_paths(m_outfile_n, 'w', args.background)
     
     ms2_input_paths = []
     ms2_output_paths = []
     incount = 0
     outcount = 0
-    
-    for hampath in infile:
-        incount += 1
-        hampath = hampath.strip()
-        if args.ms2:
-            ms2_input_paths.append((notation(hampath, connectivity), hampath))
-        test = True
-        for opt1, opt2 in constrain_occ:
-            if (opt1 not in hampath) and (opt2 not in hampath):
-                test = False
-                break
-        for opt1, opt2 in constrain_unocc:
-            if (opt1 in hampath) or (opt2 in hampath):
-                test = False
-                break
-        if test:
-            outcount += 1
-            if args.ms2:
-                ms2_output_paths.append((notation(hampath, connectivity), hampath))
-            elif args.moves:
-                outfile.write(hampath + '\n')
-                m_outfile.write(notation(hampath, connectivity) + '\n')
+    inweight = 0
+    outweight = 0
+    
+    with stage('filter'):
+        if args.workers > 1 or args.cache:
+            if args.cache:
+                from hpRNA_cache import ResultCache
+                cache = ResultCache(args.cache, args.cache_size << 20)
+                results = filter_cached(infile.name, (constrain_occ, constrain_unocc), connectivity if args.moves else None, cache)
             else:
-                outfile.write(hampath + '\n')
-    if args.ms2:
-        input_paths = []
-        output_paths = []
-        for n, h in ms2_input_paths:
-            input_paths.append((n[n.index('1'):n.rindex('1') + 1], h[n.index('1'):n.rindex('1') + 2]))
-        for n, h in ms2_output_paths:
-            output_paths.append((n[n.index('1'):n.rindex('1') + 1], h[n.index('1'):n.rindex('1') + 2]))
-
-        input_paths = list(set(input_paths))
-        output_paths = upshift_ms2(list(set(output_paths)))
-        
-        if len(output_paths) < 20 and len(output_paths) > 0:
-            # If few result paths, display and draw.
-            display_solution_paths(input_paths, output_paths[:5], args, constrain_occ, constrain_unocc)
-        elif len(output_paths) > 0:
-            # Otherwise, just list them.
-            comparison(input_paths, output_paths)
+                results = filter_parallel(infile.name, (constrain_occ, constrain_unocc), connectivity if args.moves else None, args.workers)
+            for counts, text, m_text in results:
+                incount += counts[0]
+                outcount += counts[1]
+                inweight += counts[2]
+                outweight += counts[3]
+                outfile.write(text)
+                if args.moves:
+                    m_outfile.write(m_text)
+            paths = []
         else:
-            # If no result paths, the constraints you have imposed mean none are feasible.
-            print '\nNO SOLUTIONS'
+            paths = read_paths(infile, connectivity)
+        for hampath in paths:
+            if not hampath.strip():
+                continue
+            incount += 1
+            # Sampled paths (hpRNA_generate.py --sample) carry a weight column.
+            hampath, weight = (hampath.strip().split() + ['1'])[:2]
+            inweight += float(weight)
+            if args.ms2:
+                ms2_input_paths.append((notation(hampath, connectivity), hampath))
+            if passes(hampath, (constrain_occ, constrain_unocc)):
+                outcount += 1
+                outweight += float(weight)
+                if args.ms2:
+                    ms2_output_paths.append((notation(hampath, connectivity), hampath))
+                elif args.moves:
+                    outfile.write(line_with(hampath, weight))
+                    m_outfile.write(line_with(notation(hampath, connectivity), weight))
+                else:
+                    outfile.write(line_with(hampath, weight))
+    if args.ms2:
+        with stage('ms2 analysis'):
+            input_paths = ms2_classes(ms2_input_paths)
+            output_paths = ms2_classes(ms2_output_paths)
+        ms2_report(args, input_paths, output_paths, constrain_occ, constrain_unocc)
                
     elif args.moves:
         infile.close()
@@ -201,20 +495,204 @@ def constrain(args):
     else:
         infile.close()
         outfile.close()
+    
+    if args.index and not args.ms2:
+        from hpRNA_index import build_index
+        with stage('index'):
+            build_index(outfile_n)
+            if args.moves:
+                build_index(m_outfile_n)
+    
+    if not args.ms2 and inweight != incount:
+        print 'weighted fraction passing constraints: %.6g' % (outweight / inweight if inweight else 0,)
+    
+    if args.recommend is not None and not args.ms2:
+        with stage('recommend'):
+            infile = read_file(outfile_n)
+            recommend(args, infile, (constrain_occ, constrain_unocc))
+            infile.close()
+    
+    if args.cluster is not None and not args.ms2:
+        with stage('cluster'):
+            infile = read_file(outfile_n)
+            cluster_paths(args, infile, (constrain_occ, constrain_unocc))
+            infile.close()
         
+def edge_occupancy(lines):
+    '''
+    Weight of the paths using each edge, over lines of a PATHS file (which
+    may carry a weight column), with array operations on blocks of lines.
+    Returns a (256, 256) array of the weight of paths stepping from each
+    position to each other, by character code, and the total weight. A path
+    steps along an edge at most once, in one direction or the other.
+    
+    '''
+    import numpy as np
+    
+    lines = (line for line in lines if line.strip())
+    steps = np.zeros(1 << 16)
+    total = 0.0
+    block = list(itertools.islice(lines, BLOCK))
+    while block:
+        text = ''.join(block)
+        weights = None
+        if '\t' in text or ' ' in text:
+            rows = [(line.split() + ['1'])[:2] for line in block]
+            text = ''.join(path + '\n' for path, weight in rows)
+            weights = np.array([float(weight) for path, weight in rows])
+        t = np.frombuffer(text, dtype=np.uint8)
+        ends = t == 10
+        inside = ~(ends[:-1] | ends[1:])
+        pairs = (t[:-1].astype(np.int64) << 8 | t[1:])[inside]
+        if weights is None:
+            steps += np.bincount(pairs, minlength=1 << 16)
+            total += len(block)
+        else:
+            line = (np.cumsum(ends) - ends)[:-1][inside]
+            steps += np.bincount(pairs, weights=weights[line], minlength=1 << 16)
+            total += weights.sum()
+        block = list(itertools.islice(lines, BLOCK))
+    return steps.reshape(256, 256), total
+
+def recommend(args, lines, constraints):
+    '''
+    Rank the edges not yet constrained by how evenly they split the paths
+    given as lines: the expected information, in bits, from measuring the
+    edge is the entropy of the fraction of paths using it. All edges are
+    saved to NAME_recommend.txt (NAME_constrained_recommend.txt after
+    constraints) in OUTPUT and the best --recommend printed.
+    
+    '''
+    steps, total = edge_occupancy(lines)
+    table = rank_edges(steps, total, constraints)
+    
+    hpath_input_name, hpath_input_extension = path_file_name(args)
+    if constraints[0] or constraints[1]:
+        hpath_input_name += '_constrained'
+    report_recommend(args.output, hpath_input_name, table, total, args.recommend)
+
+def rank_edges(steps, total, constraints):
+    '''
+    Table ranking the edges not in constraints, given the weight of paths
+    stepping from each position to each other as from edge_occupancy, and
+    the total weight, as the lines of NAME_recommend.txt.
+    
+    '''
+    import numpy as np
+    
+    occupancy = steps + steps.T
+    constrained = set(min(e) for e in constraints[0] + constraints[1])
+    
+    ranked = []
+    for a, b in zip(*np.nonzero(np.triu(occupancy))):
+        edge = chr(a) + chr(b)
+        if edge in constrained:
+            continue
+        p = occupancy[a, b] / total
+        gain = 0.0 if p >= 1 else -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+        ranked.append((-gain, edge, occupancy[a, b], p))
+    ranked.sort()
+    
+    table = ['%-6s %12s %10s %10s' % ('edge', 'occupied', 'fraction', 'bits')]
+    for gain, edge, occupied, p in ranked:
+        table.append('%-6s %12.6g %10.4f %10.4f' % (edge, occupied, p, -gain))
+    return table
+
+def report_recommend(output, name, table, total, top):
+    '''
+    Save a table from rank_edges to NAME_recommend.txt in output, and print
+    its best top edges.
+    
+    '''
+    outfile = open(os.path.join(output, name + '_recommend.txt'), 'w')
+    outfile.write('\n'.join(table) + '\n')
+    outfile.close()
+    
+    print '\nNEXT MEASUREMENTS, of %.6g paths\n' % (total,)
+    print '\n'.join(table[:top + 1])
+
+def cluster_paths(args, lines, constraints):
+    '''
+    Cluster the paths given as lines by the edges they use, so that every
+    path is within --cluster of its cluster's representative, as Jaccard
+    distance or, with --cluster-by hamming, as a number of edges used by only
+    one of the two. Representatives are saved to NAME_clusters.txt
+    (NAME_constrained_clusters.txt after constraints) in OUTPUT, largest
+    cluster first, each with the weight of its cluster (its number of paths,
+    unless they carry weights), and the largest CLUSTERS printed.
+    
+    '''
+    import hpRNA_cluster
+    
+    rows = [(line.split() + ['1'])[:2] for line in lines if line.strip()]
+    paths = [path for path, weight in rows]
+    weights = [float(weight) for path, weight in rows]
+    clusters = hpRNA_cluster.cluster(paths, args.cluster, args.cluster_by == 'hamming')
+    
+    ranked = []
+    for k, members in clusters:
+        weight = sum(weights[m] for m in members)
+        ranked.append((-weight, -len(members), k))
+    ranked.sort()
+    weighted = any(weight != '1' for path, weight in rows)
+    
+    hpath_input_name, hpath_input_extension = path_file_name(args)
+    if constraints[0] or constraints[1]:
+        hpath_input_name += '_constrained'
+    outfile = open(os.path.join(args.output, hpath_input_name + '_clusters.txt'), 'w')
+    for weight, size, k in ranked:
+        outfile.write(line_with(paths[k], '%.6g' % (-weight,) if weighted else '%i' % (-size,)))
+    outfile.close()
+    
+    print '\nCLUSTERS, %i of %i paths within %s distance %g of a representative\n' % (len(clusters), len(paths), args.cluster_by, args.cluster)
+    print '%8s %12s   %s' % ('paths', 'weight', 'representative')
+    for weight, size, k in ranked[:CLUSTERS]:
+        print '%8i %12.6g   %s' % (-size, -weight, paths[k])
+
+def ms2_classes(ms2_paths):
+    '''
+    Distinct paths, from (moves, positions) pairs, cut to run from the first
+    move 1 to the last, as compared by the ms2 analysis.
+    
+    '''
+    classes = set()
+    for n, h in ms2_paths:
+        classes.add((n[n.index('1'):n.rindex('1') + 1], h[n.index('1'):n.rindex('1') + 2]))
+    return list(classes)
+
+def ms2_report(args, input_paths, output_paths, constrain_occ, constrain_unocc):
+    '''
+    Report the ms2 analysis of the classes from ms2_classes passing the
+    constraints, drawing them if there are few.
+    
+    '''
+    output_paths = upshift_ms2(output_paths)
+    
+    if len(output_paths) < 20 and len(output_paths) > 0:
+        # If few result paths, display and draw.
+        display_solution_paths(input_paths, output_paths[:5], args, constrain_occ, constrain_unocc)
+    elif len(output_paths) > 0:
+        # Otherwise, just list them.
+        comparison(input_paths, output_paths)
+    else:
+        # If no result paths, the constraints you have imposed mean none are feasible.
+        print '\nNO SOLUTIONS'
+
 def display_solution_paths(input_paths, output_paths, args, constrain_occ, constrain_unocc):
     
     comparison(input_paths, output_paths)
     
-    import hpRNA_ms2_draw
+    with stage('draw import'):
+        import hpRNA_ms2_draw
     
-    hpath_input_name, hpath_input_extension = os.path.splitext(os.path.basename(args.paths.name))
+    hpath_input_name, hpath_input_extension = path_file_name(args)
     
     print 'SOLUTION PATHS\n'
     for hampath, proteins in output_paths:
         draw = [a+b for a, b in zip(proteins[:-1], proteins[1:]) if ((a+b not in [e for tupl in constrain_occ for e in tupl]) and (a+b not in [e for tupl in constrain_unocc for e in tupl]))]
         pngname = os.path.join(args.output, hpath_input_name + '_output_' + proteins + '.png')
-        hpRNA_ms2_draw.hami_draw(constrain_occ, constrain_unocc, draw, pngname, hampath, proteins)
+        with stage('draw'):
+            hpRNA_ms2_draw.hami_draw(constrain_occ, constrain_unocc, draw, pngname, hampath, proteins)
     
 def count_best_ms2(output_paths):
     '''
@@ -261,12 +739,8 @@ def realize(args):
     points on the polyhedron.
     
     '''
-    degenmatrix = np.loadtxt(args.degeneracy, dtype=str)
-
-    startp = degenmatrix[0,0]
-    translation = {}
-    for i in range(degenmatrix.shape[0]):
-        translation[degenmatrix[i,0]] = dict(zip(degenmatrix[0,:], degenmatrix[i,:]))
+    with stage('load degeneracy'):
+        translation = read_degeneracy(args.degeneracy)
     
     realizefile = args.realize
     args.realize = []
@@ -274,38 +748,28 @@ def realize(args):
         args.realize.append(line.strip())
     realizefile.close()
 
-    hpath_input_name, hpath_input_extension = os.path.splitext(os.path.basename(args.paths.name))
+    hpath_input_name, hpath_input_extension = path_file_name(args)
 
-    outfile_n = os.path.join(args.output, '.' + hpath_input_name + '_realized_tmp' + hpath_input_extension)
     prunedfile_n = os.path.join(args.output, hpath_input_name + '_realized' + hpath_input_extension)
     
     infile = args.paths
-    outfile = open(outfile_n, 'w')
+    outfile = open_paths(prunedfile_n, 'w', args.background)
+    
+    connectivity = read_connectivity(args.connectivity) if args.connectivity else None
     
     if args.moves:
-        connfile = args.connectivity
-        connectivity = {}
-        for line in connfile:
-            line = line.strip().split()
-            connectivity[line[0]] = line[1:]
-        connfile.close()
-        m_outfile_n = os.path.join(args.output, '.' + hpath_input_name + '_moves_realized_tmp' + hpath_input_extension)
         m_prunedfile_n = os.path.join(args.output, hpath_input_name + '_moves_realized' + hpath_input_extension)
-        
-        m_outfile = open(m_outfile_n, 'w')
-        
-    for hampath in infile:
-        hampath = hampath.strip()
-        for realize_point in args.realize:
-            trans = translate(hampath, realize_point, translation)
-            backwards = backwards_string(trans)
+        m_outfile = open_paths(m_prunedfile_n, 'w', args.background)
+        m_seen = set()
+    
+    with stage('realize'):
+        for trans in realize_iter(read_paths(infile, connectivity), args.realize, translation, args.backwards):
             outfile.write(trans + '\n')
-            if args.backwards:
-                outfile.write(backwards + '\n')
             if args.moves:
-                m_outfile.write(notation(trans, connectivity) + '\n')
-                if args.backwards:
-                    m_outfile.write(notation(trans, connectivity) + '\n')
+                moves = notation(trans, connectivity)
+                if moves not in m_seen:
+                    m_seen.add(moves)
+                    m_outfile.write(moves + '\n')
     
     infile.close()
     outfile.close()
@@ -313,19 +777,77 @@ def realize(args):
     if args.moves:
         m_outfile.close()
     
-    awk = "awk \'!seen[$0]++\' " + outfile_n + " > " + prunedfile_n
-    os.system(awk)
-    
+    if args.index:
+        from hpRNA_index import build_index
+        with stage('index'):
+            build_index(prunedfile_n)
+            if args.moves:
+                build_index(m_prunedfile_n)
+
+def store_realize(args):
+    '''
+    Realize through the run store (--store): the realized paths are taken
+    from STORE if a run with the same input files and options is held there,
+    otherwise realized and kept.
+
+    '''
+    from hpRNA_store import RunStore
+
+    hpath_input_name, hpath_input_extension = path_file_name(args)
+    names = [hpath_input_name + '_realized' + hpath_input_extension]
     if args.moves:
-        awk_m = "awk \'!seen[$0]++\' " + m_outfile_n + " > " + m_prunedfile_n
-        os.system(awk_m)
+        names.append(hpath_input_name + '_moves_realized' + hpath_input_extension)
+    if args.index:
+        names.extend([name + '.idx' for name in names])
+    # Connectivity only changes the output of moves and move PATHS.
+    moves = args.moves or args.paths.name.endswith('.bin')
+    files = {'paths': args.paths, 'degeneracy': args.degeneracy, 'realize': args.realize,
+             'connectivity': args.connectivity if moves else None}
+    options = {'run': 'realize', 'backwards': args.backwards, 'moves': args.moves, 'index': args.index, 'names': names}
+
+    store = RunStore(args.store, args.store_size << 20)
+    if store.produce(files, options, args.output, names, lambda: realize(args)):
+        print '%s taken from %s' % (', '.join(names), args.store)
+
+def read_degeneracy(degenfile):
+    '''
+    Load a DEGENERACY file into a translation, for each position, from the
+    frame of the first row to the frame starting at that position.
+    
+    '''
+    degenmatrix = read_symmetries(degenfile)
+    
+    translation = {}
+    for row in degenmatrix:
+        translation[row[0]] = dict(zip(degenmatrix[0], row))
+    return translation
+
+def realize_iter(paths, frames, translation, backwards=False):
+    '''
+    Iterate over the copies of paths in each of frames, the positions given
+    in a REALIZE file, using a translation from read_degeneracy. Copies are
+    given once each, in order of first appearance, reversed copies following
+    each copy if backwards.
+    
+    '''
+    seen = set()
+    for hampath in paths:
+        hampath = hampath.strip()
+        if not hampath:
+            continue
+        for realize_point in frames:
+            trans = translate(hampath, realize_point, translation)
+            for copy in ([trans, backwards_string(trans)] if backwards else [trans]):
+                if copy not in seen:
+                    seen.add(copy)
+                    yield copy
             
 
 ### MAIN
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Realize and constrain connected paths mapping to a polyhedral cage.")
-    parser.add_argument("-p", "--paths", help='File PATHS. Provide paths to realize or constrain.', type=file, required=True)
+    parser.add_argument("-p", "--paths", help='File PATHS. Provide paths to realize or constrain. A diagram written by hpRNA_generate.py --zdd (.zdd) can also be constrained, and move words written by hpRNA_generate.py --moves (.bin), which require --connectivity, are expanded to paths, as are levels written by hpRNA_generate.py --trie (.trie). Compressed paths (.gz) are read directly, and their outputs are compressed too.', type=file, required=True)
     parser.add_argument("-x", "--constraints", help='File CONSTRAINTS. Provide constraints for paths, i.e. edges of the polyhedral cage that are either present (1) or not present (0).', type=file)
     parser.add_argument("-d", "--degeneracy", help='File DEGENERACY. Rotational symmetry of polyhedron: all moves. For example, if the cage has icosahedral symmetry, there will be 12*5=60 identical symmetric views. Each line of the file represents a rotation to an identical view: in every row, the elements have the same relationship to each other, but the rows begin at different positions.', type=file)
     parser.add_argument("-r", "--realize", help='File REALIZE. Points to realize the paths from. Generated paths start from a small subset of points, specified in the START file. Realize creates copies of these general paths, to the symmetric frames of points given in the REALIZE file, with respect to the frame of the initial path being \'a\'. Requires --degeneracy.', type=file)
@@ -333,7 +855,21 @@ if __name__ == '__main__':
     parser.add_argument("-o", "--output", help='Directory OUTPUT. Choose output directory. Default \'paths\'.', default='paths')
     parser.add_argument("-m", "--moves", help='Option. Abstracts to a numbered move view, suitable for simple symmetric cages. Numbered moves are allocated from CONNECTIVITY file, thus correct ordering of row elements in CONNECTIVITY file is essential. Requires --connectivity.', action='store_true')
     parser.add_argument("-c", "--connectivity", help='File CONNECTIVITY. Provide a neighbor connectivity map. First column position linked to positions in other columns. Number of links does not have to be uniform.', type=file)
+    parser.add_argument("-n", "--sample", help='Int SAMPLE. With a PATHS diagram (.zdd), draw SAMPLE paths uniformly from the constrained diagram.', type=int)
+    parser.add_argument("--seed", help='Int SEED. Random seed for --sample.', type=int)
     parser.add_argument("--ms2", help='Option. Additional analysis of constraints to compare to published example of bacteriophage ms2. Provides graphical output. Requires --connectivity and --constraints.', action='store_true')
+    parser.add_argument("--background", help='Option. Write output path files from a background thread, so filtering and realizing do not wait on the disk.', action='store_true')
+    parser.add_argument("--index", help='Option. Write an offset index (.idx) beside each output path file, for random access with hpRNA_index.py.', action='store_true')
+    parser.add_argument("--cache", help='Directory CACHE. Keep the result of each constraint set in CACHE, keyed by a hash of PATHS and the set. A set holding a cached one only tests the paths that passed it, and a set within a cached one only tests the paths that failed it. Plain text PATHS only.')
+    parser.add_argument("--cache-size", help='Int CACHE_SIZE. Megabytes of results kept in CACHE, least recently used first out. Default 512.', type=int, default=512)
+    parser.add_argument("--store", help='Directory STORE. Keep the realized paths of each --realize run in STORE, keyed by a hash of the contents of PATHS, DEGENERACY, REALIZE and, with --moves or move PATHS, CONNECTIVITY, and of the options changing the outputs. A repeat of a kept run, from any OUTPUT, takes them from STORE as hard links (copies on another file system) instead of realizing again. STORE can be shared between projects and with hpRNA_generate.py --store.')
+    parser.add_argument("--store-size", help='Int STORE_SIZE. Megabytes of runs kept in STORE, least recently used first out. Default 2048.', type=int, default=2048)
+    parser.add_argument("--recommend", help='Int RECOMMEND. Rank the cage edges not yet constrained by how evenly they split the paths passing the constraints, or all PATHS without --constraints, so that measuring them prunes the most paths. Each edge\'s fraction of paths and expected information in bits are saved to NAME_recommend.txt in OUTPUT, and the best RECOMMEND printed.', type=int)
+    parser.add_argument("--cluster", help='Float CLUSTER. Group the paths passing the constraints, or all PATHS without --constraints, into clusters whose paths are all within distance CLUSTER of a representative, by the edges they use. Representatives are saved, largest cluster first and with the number of paths in their cluster, or their total weight, to NAME_clusters.txt in OUTPUT. Large sets of paths are bucketed by MinHash first, so are not compared in pairs. 0 groups the paths using the same edges, such as a path and its reverse.', type=float)
+    parser.add_argument("--cluster-by", help='String CLUSTER_BY. Distance for --cluster: \'jaccard\', the fraction of the edges used by either path that only one uses, or \'hamming\', the number of those edges. Default \'jaccard\'.', choices=['jaccard', 'hamming'], default='jaccard')
+    parser.add_argument("--workers", help='Int WORKERS. Filter PATHS against the constraints in WORKERS processes, each taking line-aligned chunks of the memory-mapped file. The output is the same as with 1. Plain text PATHS only. Default 1.', type=int, default=1)
+    parser.add_argument("--profile", help='Option. Time each stage of the run (wall and CPU), including --ms2 drawing, printed and saved to constrain_profile.txt in OUTPUT.', action='store_true')
+    parser.add_argument("--cprofile", help='Option. With --profile, also save a cProfile dump of the run to constrain_profile.prof in OUTPUT.', action='store_true')
     args = parser.parse_args()
     
     if (not args.output) and args.realize:
@@ -353,14 +889,53 @@ if __name__ == '__main__':
         parser.error("--backwards requires --realize.")
     if args.moves and args.connectivity is None:
         parser.error("--moves requires --connectivity.")
+    if args.paths.name.endswith('.bin') and args.connectivity is None:
+        parser.error("move PATHS (.bin) require --connectivity.")
     if args.ms2 and (args.connectivity is None or args.constraints is None):
         parser.error("--ms2 requires --connectivity and --constraints.")
 
-    if args.realize:
-        realize(args)
-    elif args.constraints:
-        constrain(args)
-    else:
-        parser.error("either --realize or --constraints is required")
+    if args.paths.name.endswith('.zdd') and (args.realize or args.moves or args.ms2):
+        parser.error("diagram PATHS cannot be used with --realize, --moves or --ms2.")
+    if not (args.paths.name.endswith('.zdd') or args.realize or args.constraints or args.recommend is not None or args.cluster is not None):
+        parser.error("either --realize, --constraints, --recommend or --cluster is required")
+    if args.recommend is not None and (args.paths.name.endswith('.zdd') or args.realize or args.ms2):
+        parser.error("--recommend cannot be used with diagram PATHS, --realize or --ms2.")
+    if args.cluster is not None and (args.paths.name.endswith('.zdd') or args.realize or args.ms2):
+        parser.error("--cluster cannot be used with diagram PATHS, --realize or --ms2.")
+    if args.cluster is not None and not (0 <= args.cluster <= 1 or args.cluster_by == 'hamming' and args.cluster >= 0):
+        parser.error("--cluster must be a Jaccard distance from 0 to 1, or a number of edges with --cluster-by hamming.")
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile requires --profile.")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if args.workers > 1 and (args.realize or args.ms2 or os.path.splitext(args.paths.name)[1] in ('.gz', '.bin', '.trie', '.zdd')):
+        parser.error("--workers filters plain text PATHS, and cannot be used with --realize or --ms2.")
+    if args.cache and (args.workers > 1 or args.realize or args.ms2 or os.path.splitext(args.paths.name)[1] in ('.gz', '.bin', '.trie', '.zdd')):
+        parser.error("--cache filters plain text PATHS, and cannot be used with --workers, --realize or --ms2.")
+    if args.store and not args.realize:
+        parser.error("--store keeps realized paths, so requires --realize.")
+    if args.index and compressed(args.paths.name):
+        parser.error("--index needs plain text outputs, so cannot be used with compressed PATHS.")
+
+    with profiling(args.output, 'constrain', args.profile, args.cprofile):
+        if args.paths.name.endswith('.zdd'):
+            constrain_zdd(args)
+        elif args.realize and args.store:
+            store_realize(args)
+        elif args.realize:
+            realize(args)
+        elif args.constraints:
+            constrain(args)
+        else:
+            connectivity = read_connectivity(args.connectivity) if args.connectivity else None
+            lines = read_paths(args.paths, connectivity)
+            if args.recommend is not None and args.cluster is not None:
+                lines = list(lines)
+            if args.recommend is not None:
+                with stage('recommend'):
+                    recommend(args, iter(lines), ([], []))
+            if args.cluster is not None:
+                with stage('cluster'):
+                    cluster_paths(args, lines, ([], []))
 
 ### ENDS
\ No newline at end of file
@@ -20,10 +20,15 @@
 
 import os
 import sys
-import subprocess
-import numpy as np
 import argparse
 import shutil
+import random
+import time
+import struct
+import hashlib
+from collections import OrderedDict
+from hpRNA_profile import stage, profiling
+from hpRNA_io import BUFFER, GzipWriter, open_paths, read_file, writer
 
 ### FUNCTION DEFINITIONS
 
@@ -35,12 +40,7 @@ def generate_paths(args):
     
     '''
         
-    connfile = args.connectivity
-    args.connectivity = {}
-    for line in connfile:
-        line = line.strip().split()
-        args.connectivity[line[0]] = line[1:]
-    connfile.close()
+    args.connectivity = read_connectivity(args.connectivity)
     
     firststart = args.start.readline().strip()
     args.start.seek(0)
@@ -49,19 +49,15 @@ def generate_paths(args):
         raise Exception("Not all start positions/paths are same length")
     args.start.seek(0)
         
-    if args.iteration == None:
-        args.iteration = len(firststart)
-        shutil.copyfile(args.start.name, os.path.join(args.output, 'paths_%02i.txt' % (args.iteration,)))
+    # Compressed levels are gzip files, read and written through hpRNA_io.
+    suffix = '.txt.gz' if args.compress else '.txt'
         
     if args.degeneracy and args.both:
-        degenfile = args.degeneracy
-        degenmatrix = np.loadtxt(degenfile, dtype=str)
-        degenfile.close()
-        args.degeneracy = {}
-        for i in range(degenmatrix.shape[0]):
-            args.degeneracy[degenmatrix[i,0]] = dict(zip(degenmatrix[i,:], degenmatrix[0,:]))
-    
-    iteration = args.iteration
+        with stage('load degeneracy'):
+            degenmatrix = read_symmetries(args.degeneracy)
+            args.degeneracy = {}
+            for row in degenmatrix:
+                args.degeneracy[row[0]] = dict(zip(row, degenmatrix[0]))
     
     if args.length:
         lengths = [int(a) for l in args.length for a in l.strip().split()]
@@ -71,15 +67,31 @@ def generate_paths(args):
         maxlength = len(args.connectivity)
     
     if args.require:
-        req = dict((a.strip().split()[0], a.strip().split()[1:]) for a in args.require)
+        req = read_rules(args.require)
     else:
         req = None
     
     if args.preclude:
-        pre = dict((a.strip().split()[0], a.strip().split()[1:]) for a in args.preclude)
+        pre = read_rules(args.preclude)
     else:
         pre = None
     
+    # Each level is recorded with the rules it was made under, for --update.
+    rules = save_rules(args.output, rule_text(args.connectivity, req, pre, args.both))
+    
+    if args.update:
+        args.iteration = update_levels(args, len(firststart), suffix, req, pre, maxlength, rules)
+    
+    if args.iteration == None:
+        args.iteration = len(firststart)
+        outfile = open_paths(os.path.join(args.output, 'paths_%02i' % (args.iteration,) + suffix))
+        shutil.copyfileobj(args.start, outfile)
+        outfile.close()
+        mark_complete(args.output, 'paths_%02i' % (args.iteration,) + suffix)
+        mark_rules(args.output, 'paths_%02i' % (args.iteration,) + suffix, rules)
+    
+    iteration = args.iteration
+    
     toolbar_width = maxlength - args.iteration
     
     # setup toolbar
@@ -89,79 +101,1408 @@ def generate_paths(args):
         
     
     while iteration < maxlength:
-        infile = open(os.path.join(args.output,'paths_%02i.txt' % (iteration,)), 'r')
+        infile = read_file(os.path.join(args.output,'paths_%02i' % (iteration,) + suffix))
         
         iteration += 1
         #print iteration
         
-        if args.both == True:
-            outfile = open(os.path.join(args.output,'.paths_%02i_tmp.txt' % (iteration,)), 'w')
+        # Each level is written to a part file, renamed into place only once
+        # complete. Checkpoints record how far through the input the part
+        # file has got, so an interrupted level carries on from there.
+        partname = os.path.join(args.output,'.paths_%02i_part' % (iteration,) + suffix)
+        checkname = os.path.join(args.output,'.paths_%02i_checkpoint.txt' % (iteration,))
+        
+        if args.engine == 'numpy':
+            expand = make_expander(args.connectivity, req, pre, args.degeneracy if args.both else None)
+        elif args.both == True:
             execute = execute_both
         else:
-            outfile = open(os.path.join(args.output,'paths_%02i.txt' % (iteration,)), 'w')
             execute = execute_forward
         
-        for i in infile:
-            execute(i.strip(), args.connectivity, outfile, args.degeneracy, req, pre)
+        inoffset, outoffset = read_checkpoint(checkname)
+        if inoffset and os.path.exists(partname):
+            infile.seek(inoffset)
+            outfile = open(partname, 'r+', BUFFER)
+            outfile.truncate(outoffset)
+            outfile.seek(outoffset)
+            outfile = writer(GzipWriter(outfile) if args.compress else outfile, args.background)
+        else:
+            outfile = open_paths(partname, 'w', args.background)
         
-        infile.close()
-        outfile.close()
+        done = 0
+        with stage('extend'):
+            if args.engine == 'numpy':
+                # Every line of a level is iteration bytes long, newline included.
+                for block in iter(lambda: infile.read(args.chunk * iteration), ''):
+                    outfile.write(expand(block))
+                    done += args.chunk
+                    if args.checkpoint and done >= args.checkpoint:
+                        done = 0
+                        outfile.flush()
+                        os.fsync(outfile.fileno())
+                        write_checkpoint(checkname, infile.tell(), outfile.tell())
+            else:
+                for i in iter(infile.readline, ''):
+                    execute(i.strip(), args.connectivity, outfile, args.degeneracy, req, pre)
+                    done += 1
+                    if args.checkpoint and done % args.checkpoint == 0:
+                        outfile.flush()
+                        os.fsync(outfile.fileno())
+                        write_checkpoint(checkname, infile.tell(), outfile.tell())
+        
+            infile.close()
+            outfile.close()
         
         if args.both == True:
-            awk = ("awk \'!seen[$0]++\' " +
-                  os.path.join(args.output,'.paths_%02i_tmp.txt' % (iteration,)) + " > " +
-                  os.path.join(args.output,'paths_%02i.txt' % (iteration,)))
-            os.system(awk)
+            with stage('dedupe'):
+                dedupename = os.path.join(args.output,'.paths_%02i_tmp' % (iteration,) + suffix)
+                if args.compress:
+                    awk = ("gzip -dc " + partname + " | awk \'!seen[$0]++\' | gzip -c > " + dedupename)
+                else:
+                    awk = ("awk \'!seen[$0]++\' " + partname + " > " + dedupename)
+                os.system(awk)
+                os.rename(dedupename, partname)
+        
+        os.rename(partname, os.path.join(args.output,'paths_%02i' % (iteration,) + suffix))
+        mark_complete(args.output, 'paths_%02i' % (iteration,) + suffix)
+        mark_rules(args.output, 'paths_%02i' % (iteration,) + suffix, rules)
+        if os.path.exists(checkname):
+            os.remove(checkname)
             
         sys.stdout.write("-")
         sys.stdout.flush()
     sys.stdout.write("\n")
     
-    if args.end:
-        endfile = args.end
-        args.end = []
-        for line in endfile:
-            args.end.append(line.strip())
-        endfile.close()
+    with stage('collect'):
+        if args.end:
+            endfile = args.end
+            args.end = []
+            for line in endfile:
+                args.end.append(line.strip())
+            endfile.close()
         
-        outfile = open(os.path.join(args.output,'paths_out.txt'), 'w')
+            outfile = open_paths(os.path.join(args.output,'.paths_out_part' + suffix), 'w', args.background)
         
-        for l in lengths:
-            infile = open(os.path.join(args.output,'paths_%02i.txt' % (l,)), 'r')
+            for l in lengths:
+                infile = read_file(os.path.join(args.output,'paths_%02i' % (l,) + suffix))
         
-            for i in infile:
-                i=i.strip()
-                for e in args.end:
-                    if i[-len(e):] == e:
-                        outfile.write(i+'\n')
+                for i in infile:
+                    i=i.strip()
+                    for e in args.end:
+                        if i[-len(e):] == e:
+                            outfile.write(i+'\n')
             
-            infile.close()
-        outfile.close()
+                infile.close()
+            outfile.close()
         
-    else:
-        outfile = open(os.path.join(args.output,'paths_out.txt'), 'w')
+        else:
+            outfile = open_paths(os.path.join(args.output,'.paths_out_part' + suffix), 'w', args.background)
         
-        for l in lengths:
-            infile = open(os.path.join(args.output,'paths_%02i.txt' % (l,)), 'r')
+            for l in lengths:
+                infile = read_file(os.path.join(args.output,'paths_%02i' % (l,) + suffix))
         
-            for i in infile:
-                outfile.write(i)
+                shutil.copyfileobj(infile, outfile, BUFFER)
             
+                infile.close()
+            outfile.close()
+    
+        os.rename(os.path.join(args.output,'.paths_out_part' + suffix), os.path.join(args.output,'paths_out' + suffix))
+        mark_complete(args.output, 'paths_out' + suffix)
+    
+    if args.index:
+        from hpRNA_index import build_index
+        with stage('index'):
+            build_index(os.path.join(args.output, 'paths_out.txt'))
+
+def update_levels(args, first, suffix, req, pre, maxlength, rules):
+    '''
+    Bring the levels left in OUTPUT by an earlier run up to date with new
+    REQUIRE and PRECLUDE rules, and return the last level that is, to
+    generate on from, or None if the levels cannot be used. A path of a
+    level under the new rules is a path of it under the old rules if the new
+    rules allow no move the old did not; so, up to the first level with a
+    path given a move only the new rules allow, each level is filtered,
+    testing again only the moves to positions whose rules have tightened.
+    
+    '''
+    output = args.output
+    level = lambda n: 'paths_%02i' % (n,) + suffix
+    
+    # The starts must be unchanged, and every level made under one rule set.
+    done = completed(output)
+    made = recorded_rules(output)
+    if level(first) not in done or made.get(level(first)) is None:
+        return None
+    infile = read_file(os.path.join(output, level(first)))
+    same = infile.read() == args.start.read()
+    infile.close()
+    args.start.seek(0)
+    if not same:
+        return None
+    
+    last = first
+    old = None
+    while last < maxlength and level(last + 1) in done and made.get(level(last + 1)) is not None:
+        if old not in (None, made[level(last + 1)]):
+            break
+        old = made[level(last + 1)]
+        last += 1
+    if old is None:
+        return first
+    if old == rules:
+        return last
+    
+    old_connectivity, both, old_req, old_pre = read_rule_text(open(os.path.join(output, 'rules_%s.txt' % (old,))).read())
+    if both or old_connectivity != connectivity_digest(args.connectivity):
+        return None
+    
+    tightened = set(p for p in args.connectivity if not implies(old_req, old_pre, req, pre, p))
+    loosened = set(p for p in args.connectivity if not implies(req, pre, old_req, old_pre, p))
+    if not tightened and not loosened:
+        for n in range(first + 1, last + 1):
+            mark_rules(output, level(n), rules)
+        return last
+    refilter = make_refilter(args.connectivity, first, maxlength, (req, pre), (old_req, old_pre), tightened, loosened)
+    
+    # Each level is filtered in blocks of CHUNK paths, after checking the
+    # level before for a move only the new rules allow.
+    n = first
+    gained = False
+    while True:
+        infile = read_file(os.path.join(output, level(n)))
+        if n > first:
+            partname = os.path.join(output, '.paths_%02i_part' % (n,) + suffix)
+            outfile = open_paths(partname, 'w', args.background)
+        kept = total = 0
+        with stage('update'):
+            for block in iter(lambda: infile.read(args.chunk * (n + 1)), ''):
+                text, count, gain = refilter(block)
+                total += block.count('\n')
+                kept += count
+                gained = gained or gain
+                if n > first:
+                    outfile.write(text)
             infile.close()
+        if n > first:
+            outfile.close()
+            os.rename(partname, os.path.join(output, level(n)))
+            mark_complete(output, level(n))
+            mark_rules(output, level(n), rules)
+            print '%s: %i of %i paths kept under the new rules' % (level(n), kept, total)
+        if gained or n == last:
+            break
+        n += 1
+    
+    if gained:
+        print 'The new rules allow moves from %s, regenerating from there' % (level(n),)
+    # Checkpoints of levels made again are stale.
+    for m in range(n + 1, maxlength + 1):
+        if os.path.exists(os.path.join(output, '.paths_%02i_checkpoint.txt' % (m,))):
+            os.remove(os.path.join(output, '.paths_%02i_checkpoint.txt' % (m,)))
+    return n
+
+def generate_trie(args):
+    '''
+    Level-by-level generation as generate_paths, with each level after the
+    starts stored as a trie over the level before (see hpRNA_trie):
+    paths_NN.trie holds, for each path, the index of the path it extends and
+    the position it moves to. The level before is rebuilt from its records
+    CHUNK paths at a time to be extended, and paths_out is rebuilt from the
+    levels in LENGTH at the end.
+    
+    '''
+    import hpRNA_trie
+    
+    connectivity = read_connectivity(args.connectivity)
+    
+    starts = [line.strip() for line in args.start if line.strip()]
+    args.start.close()
+    if not all(len(s) == len(starts[0]) for s in starts):
+        raise Exception("Not all start positions/paths are same length")
+    
+    suffix = '.txt.gz' if args.compress else '.txt'
+    level_name = lambda n: 'paths_%02i' % (n,) + (suffix if n == len(starts[0]) else '.trie')
+    
+    if args.iteration == None:
+        args.iteration = len(starts[0])
+        outfile = open_paths(os.path.join(args.output, level_name(args.iteration)))
+        outfile.write(''.join(s + '\n' for s in starts))
+        outfile.close()
+        mark_complete(args.output, level_name(args.iteration))
+    
+    if args.length:
+        lengths = [int(a) for l in args.length for a in l.strip().split()]
+        maxlength = max(lengths)
+    else:
+        lengths = [len(connectivity),]
+        maxlength = len(connectivity)
+    
+    req = read_rules(args.require) if args.require else None
+    pre = read_rules(args.preclude) if args.preclude else None
+    
+    if args.engine == 'numpy':
+        expand = make_expander(connectivity, req, pre, trie=True)
+    
+    iteration = args.iteration
+    
+    toolbar_width = maxlength - args.iteration
+    sys.stdout.write("[%s]" % (" " * toolbar_width))
+    sys.stdout.flush()
+    sys.stdout.write("\b" * (toolbar_width+1))
+    
+    while iteration < maxlength:
+        trie = hpRNA_trie.Trie(args.output, iteration)
+        count = trie.count()
+        
+        iteration += 1
+        
+        # Records are a fixed size, so a checkpoint is the number of parents
+        # done and the bytes of records written for them.
+        partname = os.path.join(args.output,'.paths_%02i_part.trie' % (iteration,))
+        checkname = os.path.join(args.output,'.paths_%02i_checkpoint.txt' % (iteration,))
+        
+        inoffset, outoffset = read_checkpoint(checkname)
+        if inoffset and os.path.exists(partname):
+            outfile = open(partname, 'r+b', BUFFER)
+            outfile.truncate(outoffset)
+            outfile.seek(outoffset)
+            outfile = writer(outfile, args.background)
+        else:
+            inoffset = 0
+            outfile = open_paths(partname, 'wb', args.background)
+        
+        done = 0
+        with stage('extend'):
+            for lo in range(inoffset, count, args.chunk):
+                hi = min(lo + args.chunk, count)
+                block = trie.lines(iteration - 1, lo, hi)
+                if args.engine == 'numpy':
+                    parents, moves = expand(block)
+                    outfile.write(hpRNA_trie.records(parents + lo, moves.view('S1')))
+                else:
+                    parents = []
+                    moves = []
+                    for k, i in enumerate(block.split()):
+                        for path in extensions(i, connectivity, req, pre):
+                            parents.append(lo + k)
+                            moves.append(path[-1])
+                    outfile.write(hpRNA_trie.records(parents, moves))
+                done += hi - lo
+                if args.checkpoint and done >= args.checkpoint:
+                    done = 0
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+                    write_checkpoint(checkname, hi, outfile.tell())
+            outfile.close()
+        
+        del trie
+        os.rename(partname, os.path.join(args.output, level_name(iteration)))
+        mark_complete(args.output, level_name(iteration))
+        if os.path.exists(checkname):
+            os.remove(checkname)
+        
+        sys.stdout.write("-")
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+    
+    with stage('collect'):
+        if args.end:
+            ends = [line.strip() for line in args.end if line.strip()]
+            args.end.close()
+        
+        trie = hpRNA_trie.Trie(args.output, maxlength)
+        outfile = open_paths(os.path.join(args.output,'.paths_out_part' + suffix), 'w', args.background)
+        for l in lengths:
+            for block in trie.blocks(l):
+                if args.end:
+                    outfile.write(''.join(i + '\n' for i in block.split() if any(i.endswith(e) for e in ends)))
+                else:
+                    outfile.write(block)
         outfile.close()
+        
+        os.rename(os.path.join(args.output,'.paths_out_part' + suffix), os.path.join(args.output,'paths_out' + suffix))
+        mark_complete(args.output, 'paths_out' + suffix)
+    
+    if args.index:
+        from hpRNA_index import build_index
+        with stage('index'):
+            build_index(os.path.join(args.output, 'paths_out.txt'))
+
+def store_paths(args):
+    '''
+    Level-by-level (or --meet) generation through the run store (--store):
+    paths_out is taken from STORE if a run with the same input files and
+    options is held there, otherwise generated and kept. Levels are only
+    written when the paths are generated.
 
+    '''
+    from hpRNA_store import RunStore
 
-def execute_forward(i, connectivity, outfile, degeneracy, req, pre):
+    run = meet_paths if args.meet else generate_trie if args.trie else generate_paths
+    suffix = '.txt.gz' if args.compress else '.txt'
+    names = ['paths_out' + suffix] + (['paths_out.txt.idx'] if args.index else [])
+    files = {'connectivity': args.connectivity, 'start': args.start, 'end': args.end, 'require': args.require,
+             'preclude': args.preclude, 'length': args.length, 'degeneracy': args.degeneracy if args.both else None}
+    options = {'run': 'generate', 'both': args.both, 'meet': args.meet, 'compress': args.compress, 'index': args.index}
+
+    store = RunStore(args.store, args.store_size << 20)
+    if store.produce(files, options, args.output, names, lambda: run(args)):
+        mark_complete(args.output, names[0])
+        print '%s taken from %s' % (names[0], args.store)
+
+def completed(output):
     '''
-    Moves. Extend each path by one unit, attempting each possible move.
+    Files in OUTPUT recorded as complete in the manifest, with their sizes.
+    Files whose size no longer matches are left out.
+    
+    '''
+    manifest = {}
+    name = os.path.join(output, 'paths_manifest.txt')
+    if os.path.exists(name):
+        for line in open(name):
+            f, size = line.strip().split()
+            if os.path.exists(os.path.join(output, f)) and os.path.getsize(os.path.join(output, f)) == int(size):
+                manifest[f] = int(size)
+    return manifest
+
+def resumable(output, f):
+    '''
+    Whether level f in OUTPUT can be resumed from with --iteration: recorded
+    as complete in the manifest or, in an OUTPUT written before levels were
+    recorded, with no manifest, present without a part file of its own. Such
+    a level is recorded as complete.
+    
+    '''
+    if f in completed(output):
+        return True
+    base, extension = f[:8], f[8:]
+    if os.path.exists(os.path.join(output, 'paths_manifest.txt')) or not os.path.exists(os.path.join(output, f)) \
+            or os.path.exists(os.path.join(output, '.%s_part%s' % (base, extension))):
+        return False
+    mark_complete(output, f)
+    return True
+
+def mark_complete(output, f):
+    '''
+    Record a finished file in the manifest of OUTPUT.
     
     '''
+    manifest = completed(output)
+    manifest[f] = os.path.getsize(os.path.join(output, f))
+    replace_file(os.path.join(output, 'paths_manifest.txt'), ''.join('%s\t%i\n' % a for a in sorted(manifest.items())))
+
+def connectivity_digest(connectivity):
+    return hashlib.sha1(repr(sorted(connectivity.items()))).hexdigest()
+
+def rule_text(connectivity, req, pre, both):
+    '''
+    Canonical text of the rules a level is made under: the connectivity, by
+    digest, whether paths are extended both ways, then the REQUIRE and
+    PRECLUDE rules ('none' if not given) with keys and groups in order.
+    
+    '''
+    text = 'connectivity %s\nboth %i\n' % (connectivity_digest(connectivity), bool(both))
+    for title, rules in (('require', req), ('preclude', pre)):
+        if rules is None:
+            text += title + ' none\n'
+            continue
+        text += title + '\n'
+        for k in sorted(rules):
+            text += ' '.join([k] + sorted(''.join(sorted(g)) for g in rules[k])) + '\n'
+    return text
+
+def read_rule_text(text):
+    '''
+    Connectivity digest, both flag, and REQUIRE and PRECLUDE rules (or None)
+    of the text from rule_text.
+    
+    '''
+    lines = text.splitlines()
+    found = {}
+    title = None
+    for line in lines[2:]:
+        if line.split()[0] in ('require', 'preclude'):
+            title = line.split()[0]
+            found[title] = None if line.endswith(' none') else {}
+        else:
+            found[title][line.split()[0]] = line.split()[1:]
+    return lines[0].split()[1], lines[1].split()[1] == '1', found['require'], found['preclude']
+
+def save_rules(output, text):
+    '''
+    Keep rule text in OUTPUT as rules_DIGEST.txt, and return the digest.
+    
+    '''
+    digest = hashlib.sha1(text).hexdigest()[:12]
+    name = os.path.join(output, 'rules_%s.txt' % (digest,))
+    if not os.path.exists(name):
+        replace_file(name, text)
+    return digest
+
+def recorded_rules(output):
+    '''
+    Digest of the rules each level in OUTPUT was made under, by file name.
+    
+    '''
+    name = os.path.join(output, 'paths_rules.txt')
+    if not os.path.exists(name):
+        return {}
+    return dict(line.split() for line in open(name) if line.strip())
+
+def mark_rules(output, f, digest):
+    '''
+    Record the rules file f of OUTPUT was made under.
+    
+    '''
+    made = recorded_rules(output)
+    made[f] = digest
+    replace_file(os.path.join(output, 'paths_rules.txt'), ''.join('%s\t%s\n' % a for a in sorted(made.items())))
+
+def read_checkpoint(name):
+    '''
+    Input and output offsets saved by write_checkpoint, or zero if there is no
+    checkpoint.
+    
+    '''
+    if not os.path.exists(name):
+        return 0, 0
+    inoffset, outoffset = open(name).read().split()
+    return int(inoffset), int(outoffset)
+
+def write_checkpoint(name, inoffset, outoffset):
+    replace_file(name, '%i %i\n' % (inoffset, outoffset))
+
+def replace_file(name, text):
+    '''
+    Write text to a file atomically, so a crash leaves the old or new version
+    but never a partial one.
     
+    '''
+    tmp = name + '.tmp'
+    outfile = open(tmp, 'w')
+    outfile.write(text)
+    outfile.flush()
+    os.fsync(outfile.fileno())
+    outfile.close()
+    os.rename(tmp, name)
+
+
+def read_connectivity(connfile):
+    '''
+    Read a neighbor connectivity map into a dictionary. First column position
+    is the key, positions in the other columns are its neighbors, in order.
+    
+    '''
+    connectivity = {}
+    for line in connfile:
+        line = line.strip().split()
+        if line:
+            connectivity[line[0]] = line[1:]
+    connfile.close()
+    return connectivity
+
+def read_symmetries(degenfile):
+    '''
+    Read a DEGENERACY file into its rows of positions, the first row being
+    the reference frame. Split by hand, as importing numpy for loadtxt takes
+    longer than reading the file.
+    
+    '''
+    rows = [line.strip().split() for line in degenfile if line.strip()]
+    degenfile.close()
+    return rows
+
+def read_rules(rulefile):
+    '''
+    Read a REQUIRE or PRECLUDE file. First column position is the key, each
+    subsequent column is a group of positions that must all be visited for the
+    group to apply.
+    
+    '''
+    rules = dict((a.strip().split()[0], a.strip().split()[1:]) for a in rulefile if a.strip())
+    rulefile.close()
+    return rules
+
+def read_search(args):
+    '''
+    Read the files used by the search modes (--count, --sample). Positions are
+    held as bits of a visited mask, and each group of a REQUIRE or PRECLUDE
+    rule as a mask, so rules are tested without scanning the path.
+    
+    '''
+    connectivity = read_connectivity(args.connectivity)
+    
+    starts = [line.strip() for line in args.start if line.strip()]
+    args.start.close()
+    
+    if args.length:
+        lengths = set(int(a) for l in args.length for a in l.strip().split())
+    else:
+        lengths = set([len(connectivity),])
+    
+    if args.end:
+        ends = [line.strip() for line in args.end if line.strip()]
+        args.end.close()
+    else:
+        ends = None
+    
+    bit = make_bits(connectivity)
+    req = group_masks(read_rules(args.require), bit) if args.require else None
+    pre = group_masks(read_rules(args.preclude), bit) if args.preclude else None
+    
+    return connectivity, starts, ends, lengths, bit, req, pre
+
+def make_bits(connectivity):
+    '''
+    Bit of each position in a visited mask.
+    
+    '''
+    return dict((p, 1 << n) for n, p in enumerate(sorted(connectivity)))
+
+def group_masks(rules, bit):
+    '''
+    REQUIRE or PRECLUDE rules, as from read_rules, with each group as a mask.
+    
+    '''
+    return dict((k, [sum(bit[a] for a in g) for g in v]) for k, v in rules.items())
+
+def allowed_moves(path, mask, connectivity, bit, req, pre):
+    '''
+    Moves available from the end of path, in connectivity order, given the
+    visited mask of path.
+    
+    '''
+    moves = []
+    for np in connectivity[path[-1]]:
+        if mask & bit[np]:
+            continue
+        if pre and any(mask & g == g for g in pre[np]):
+            continue
+        if req and not any(mask & g == g for g in req[np]):
+            continue
+        moves.append(np)
+    return moves
+
+def implies(req, pre, other_req, other_pre, np):
+    '''
+    True if, whatever the positions visited, a move to np allowed by the
+    rules req and pre is allowed by other_req and other_pre: each required
+    group holds a group other_req requires, and each group other_pre
+    precludes holds a group pre precludes. Rules not given always allow.
+    
+    '''
+    groups = lambda rules, default: [set(g) for g in rules.get(np, [])] if rules is not None else default
+    required, other_required = groups(req, [set()]), groups(other_req, [set()])
+    precluded, other_precluded = groups(pre, []), groups(other_pre, [])
+    return (all(any(o <= g for o in other_required) for g in required) and
+            all(any(g <= o for g in precluded) for o in other_precluded))
+
+def make_viable(connectivity, ends, lengths, bit):
+    '''
+    Return a test for whether a move can still lead to a complete path, used
+    to prune the any-time search. Positions in every END are kept for the closing
+    moves and, for Hamiltonian paths, every unvisited position must remain
+    reachable from the new end, once the path is longer than every shorter
+    LENGTH. Only moves with no completions are rejected.
+    
+    '''
+    closing = set.intersection(*[set(e) for e in ends]) if ends else set()
+    closing_from = min(lengths) - max(len(e) for e in ends) if ends else 0
+    hamiltonian = max(lengths) == len(connectivity)
+    # Longest LENGTH short of a Hamiltonian path, which may still be completed.
+    shorter = max([l for l in lengths if l < len(connectivity)] or [0])
+    full = sum(bit.values())
+    
+    def viable(path, mask, np):
+        if np in closing and len(path) < closing_from:
+            return False
+        if hamiltonian and len(path) >= shorter:
+            mask = mask | bit[np]
+            reached = [np]
+            for p in reached:
+                for q in connectivity[p]:
+                    if not mask & bit[q]:
+                        mask |= bit[q]
+                        reached.append(q)
+            return mask == full
+        return True
+    
+    return viable
+
+def make_counter(connectivity, bit, req, pre, lengths, width, size):
+    '''
+    Return a memoised search giving, for a path and its visited mask, the
+    number of completions for every (length, final positions) reachable. The
+    memo is keyed on (tail of path, visited mask) and the oldest states are
+    evicted once it holds more than size entries.
+    
+    '''
+    maxlength = max(lengths)
+    memo = OrderedDict()
+    
+    def search(path, mask):
+        key = (path[-width:], mask)
+        if key in memo:
+            found = memo.pop(key)
+            memo[key] = found
+            return found
+        found = {}
+        if len(path) in lengths:
+            found[(len(path), path[-width:])] = 1
+        if len(path) < maxlength:
+            for np in allowed_moves(path, mask, connectivity, bit, req, pre):
+                for k, n in search(path + np, mask | bit[np]).items():
+                    found[k] = found.get(k, 0) + n
+        memo[key] = found
+        while len(memo) > size:
+            memo.popitem(last=False)
+        return found
+    
+    return search
+
+def ending_count(found, ends):
+    '''
+    Number of completions in a search result that finish with one of ends.
+    
+    '''
+    if ends is None:
+        return sum(found.values())
+    return sum(n for (length, tail), n in found.items() for e in ends if tail[-len(e):] == e)
+
+def count_paths(args):
+    '''
+    Count paths without enumerating them. A depth-first search is memoised on
+    (tail of path, visited mask) states, each state storing the number of
+    completions for every length and ending reachable from it. States are
+    evicted oldest first once the memo holds more than args.memo entries, so
+    memory stays bounded at the cost of repeating some of the search. Counts
+    are written per start and per end to counts_out.txt.
+    
+    '''
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    width = max(len(e) for e in ends) if ends else 1
+    search = make_counter(connectivity, bit, req, pre, lengths, width, args.memo)
+    
+    outfile = open(os.path.join(args.output, 'counts_out.txt'), 'w')
+    total = 0
+    for start in starts:
+        found = search(start, sum(bit[a] for a in set(start)))
+        counts = {}
+        for (length, tail), n in found.items():
+            if ends is None:
+                counts[(length, tail)] = counts.get((length, tail), 0) + n
+            else:
+                for e in ends:
+                    if tail[-len(e):] == e:
+                        counts[(length, e)] = counts.get((length, e), 0) + n
+        for (length, e), n in sorted(counts.items()):
+            outfile.write('%s\t%s\t%i\t%i\n' % (start, e, length, n))
+            total += n
+    outfile.close()
+    
+    sys.stdout.write("%i paths counted\n" % (total,))
+
+def sample_paths(args):
+    '''
+    Draw args.sample paths at random instead of enumerating them, following
+    the same START, END, REQUIRE, PRECLUDE and LENGTH rules. By default each
+    path is grown by a random walk choosing evenly between the moves allowed,
+    and is written with its importance weight (the number of choices made
+    along the way); walks that dead-end are retried. The weighted mean over
+    all walks estimates the number of paths, and weighted fractions estimate
+    the share of paths with a property. With --uniform, moves are instead
+    chosen in proportion to the completions counted below them (as --count),
+    so paths are drawn uniformly and written with weight 1. Samples are
+    saved to paths_sample.txt and are reproducible given --seed.
+    
+    '''
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    maxlength = max(lengths)
+    rng = random.Random(args.seed)
+    
+    def finished(path):
+        return ends is None or any(path[-len(e):] == e for e in ends)
+    
+    if args.uniform and not (req or pre):
+        # Without visiting-order rules the paths fit a decision diagram, which
+        # samples uniformly at any cage size.
+        zdd = make_zdd(connectivity, starts, ends, lengths)
+        roots = [(start, n) for start, end, n in zdd.roots]
+        rootcounts = [zdd.count(n) for start, n in roots]
+    elif args.uniform:
+        width = max(len(e) for e in ends) if ends else 1
+        search = make_counter(connectivity, bit, req, pre, lengths, width, args.memo)
+    
+    outfile = open(os.path.join(args.output, 'paths_sample.txt'), 'w')
+    drawn = 0
+    attempts = 0
+    weights = 0
+    while drawn < args.sample and attempts < 1000 * args.sample:
+        attempts += 1
+        if args.uniform and not (req or pre):
+            if not sum(rootcounts):
+                break
+            start, n = roots[weighted_choice(rootcounts, rng)]
+            path = zdd.to_path(zdd.sample(n, rng), start)
+            weight = 1
+        elif args.uniform:
+            options = [(start, sum(bit[a] for a in set(start))) for start in starts]
+            counts = [ending_count(search(p, m), ends) for p, m in options]
+            if not sum(counts):
+                break
+            path, mask = options[weighted_choice(counts, rng)]
+            while True:
+                options = [(path + np, mask | bit[np]) for np in allowed_moves(path, mask, connectivity, bit, req, pre)] if len(path) < maxlength else []
+                counts = [ending_count(search(p, m), ends) for p, m in options]
+                if len(path) in lengths and finished(path):
+                    # Stopping here is one more completion to choose from.
+                    options.append(None)
+                    counts.append(1)
+                choice = options[weighted_choice(counts, rng)]
+                if choice is None:
+                    break
+                path, mask = choice
+            weight = 1
+        else:
+            path = rng.choice(starts)
+            mask = sum(bit[a] for a in set(path))
+            weight = len(starts)
+            while True:
+                options = allowed_moves(path, mask, connectivity, bit, req, pre) if len(path) < maxlength else []
+                if len(path) in lengths:
+                    options.append(None)
+                if not options:
+                    weight = 0
+                    break
+                weight *= len(options)
+                np = rng.choice(options)
+                if np is None:
+                    break
+                path += np
+                mask |= bit[np]
+            if not weight or not finished(path):
+                continue
+        weights += weight
+        drawn += 1
+        outfile.write('%s\t%i\n' % (path, weight))
+    outfile.close()
+    
+    if args.uniform:
+        sys.stdout.write("%i paths sampled uniformly\n" % (drawn,))
+    else:
+        sys.stdout.write("%i paths sampled from %i walks, estimated %.4g paths\n" % (drawn, attempts, float(weights) / max(attempts, 1)))
+
+def first_paths(args):
+    '''
+    Any-time search for a first few paths. Runs depth-first, trying moves with
+    the fewest onward moves first (Warnsdorff's rule), and writes each
+    complete path to paths_first.txt as soon as it is found. Stops after
+    args.first paths or args.timeout seconds, whichever comes first.
+    
+    '''
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    maxlength = max(lengths)
+    
+    def finished(path):
+        return ends is None or any(path[-len(e):] == e for e in ends)
+    
+    viable = make_viable(connectivity, ends, lengths, bit)
+    
+    def ordered(path, mask):
+        if len(path) >= maxlength:
+            return []
+        moves = [np for np in allowed_moves(path, mask, connectivity, bit, req, pre) if viable(path, mask, np)]
+        onward = lambda np: len(allowed_moves(path + np, mask | bit[np], connectivity, bit, req, pre))
+        return sorted(moves, key=onward)
+    
+    outfile = open(os.path.join(args.output, 'paths_first.txt'), 'w')
+    began = time.time()
+    found = 0
+    nodes = 0
+    stack = []
+    for start in reversed(starts):
+        mask = sum(bit[a] for a in set(start))
+        stack.append((start, mask, None))
+    while stack and found < args.first:
+        path, mask, moves = stack.pop()
+        if moves is None:
+            nodes += 1
+            if nodes % 1000 == 0 and args.timeout and time.time() - began > args.timeout:
+                break
+            if len(path) in lengths and finished(path):
+                outfile.write(path + '\n')
+                outfile.flush()
+                found += 1
+            moves = ordered(path, mask)
+        if moves:
+            stack.append((path, mask, moves[1:]))
+            stack.append((path + moves[0], mask | bit[moves[0]], None))
+    outfile.close()
+    
+    sys.stdout.write("%i paths found in %.2f s\n" % (found, time.time() - began))
+
+def meet_paths(args):
+    '''
+    Meet-in-the-middle search for paths pinned at both ends. Half paths are
+    grown forward from the starts and backward from the ends until they meet
+    at a junction position halfway along. A forward half with visited mask m
+    ending at the junction joins every backward half from the junction over
+    exactly the positions missing from m, so two trees of half the depth are
+    explored instead of one of full depth. As every position is visited, the
+    positions visited before any point of a backward half are the complement
+    of those after it, so REQUIRE and PRECLUDE are checked on both halves.
+    Paths are saved to paths_out.txt in the order of level-by-level
+    generation.
+    
+    '''
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    size = len(connectivity)
+    if lengths != set([size,]):
+        raise Exception("--meet joins halves over complementary positions, so only finds paths of length %i" % (size,))
+    full = sum(bit.values())
+    if not starts or not ends:
+        # Nothing to pin, so no paths, as from level-by-level generation.
+        open_paths(os.path.join(args.output, 'paths_out.txt'), 'w').close()
+        mark_complete(args.output, 'paths_out.txt')
+        sys.stdout.write("0 paths found, as START or END holds no paths\n")
+        return
+    
+    # Forward halves are path[:junction + 1], backward halves path[junction:].
+    junction = min(max(size // 2, max(len(s) for s in starts) - 1), size - max(len(e) for e in ends))
+    if junction < max(len(s) for s in starts) - 1:
+        raise Exception("START and END paths are too long to meet between")
+    
+    def ruled(p, mask):
+        if pre and any(mask & g == g for g in pre[p]):
+            return False
+        if req and not any(mask & g == g for g in req[p]):
+            return False
+        return True
+    
+    before = dict((p, []) for p in connectivity)
+    for q in sorted(connectivity):
+        for p in connectivity[q]:
+            before[p].append(q)
+    
+    # Halves are pruned as in the any-time search: positions in every START
+    # are kept for the forward halves, and every position not yet visited
+    # must still be able to lead into a backward half.
+    opening = set.intersection(*[set(s) for s in starts])
+    viable = make_viable(connectivity, ends, lengths, bit)
+    
+    def reaching(p, mask):
+        reached = [p]
+        for a in reached:
+            for q in before[a]:
+                if not mask & bit[q]:
+                    mask |= bit[q]
+                    reached.append(q)
+        return mask == full
+    
+    # Backward halves by (junction position, positions of the forward half),
+    # with the column of each move, to be joined in the order of generation.
+    halves = {}
+    backward = 0
+    with stage('backward'):
+        for k, e in enumerate(ends):
+            if any(a not in bit for a in e) or len(set(e)) < len(e) or any(b not in connectivity[a] for a, b in zip(e[:-1], e[1:])):
+                continue
+            mask = sum(bit[a] for a in e)
+            if not all(ruled(e[i], full ^ sum(bit[a] for a in e[i:])) for i in range(1, len(e))):
+                continue
+            stack = [(e, mask)]
+            while stack:
+                path, mask = stack.pop()
+                if len(path) == size - junction:
+                    columns = ''.join(chr(connectivity[a].index(b)) for a, b in zip(path[:-1], path[1:]))
+                    halves.setdefault((path[0], full ^ mask | bit[path[0]]), []).append((columns, k, path[1:]))
+                    backward += 1
+                    continue
+                if not ruled(path[0], full ^ mask):
+                    continue
+                for q in before[path[0]]:
+                    if mask & bit[q] or (q in opening and len(path) + 1 < size - junction):
+                        continue
+                    if reaching(q, mask | bit[q]):
+                        stack.append((q + path, mask | bit[q]))
+        for v in halves.values():
+            v.sort()
+    
+    outfile = open_paths(os.path.join(args.output, '.paths_out_part.txt'), 'w', args.background)
+    forward = 0
+    found = 0
+    with stage('forward'):
+        for start in starts:
+            stack = [(start, sum(bit[a] for a in set(start)))]
+            while stack:
+                path, mask = stack.pop()
+                if len(path) == junction + 1:
+                    forward += 1
+                    for columns, k, rest in halves.get((path[-1], mask), ()):
+                        outfile.write(path + rest + '\n')
+                        found += 1
+                    continue
+                for np in reversed(allowed_moves(path, mask, connectivity, bit, req, pre)):
+                    if viable(path, mask, np):
+                        stack.append((path + np, mask | bit[np]))
+    outfile.close()
+    os.rename(os.path.join(args.output, '.paths_out_part.txt'), os.path.join(args.output, 'paths_out.txt'))
+    mark_complete(args.output, 'paths_out.txt')
+    
+    sys.stdout.write("%i paths found, joining %i forward and %i backward halves at position %i\n" % (found, forward, backward, junction + 1))
+
+def iter_completions(path, mask, connectivity, bit, req, pre, lengths, ends):
+    '''
+    Depth-first iteration over the complete paths extending path, in
+    connectivity order.
+    
+    '''
+    maxlength = max(lengths)
+    viable = make_viable(connectivity, ends, lengths, bit)
+    stack = [(path, mask)]
+    while stack:
+        path, mask = stack.pop()
+        if len(path) in lengths and (ends is None or any(path[-len(e):] == e for e in ends)):
+            yield path
+        if len(path) < maxlength:
+            moves = allowed_moves(path, mask, connectivity, bit, req, pre)
+            for np in reversed(moves):
+                if viable(path, mask, np):
+                    stack.append((path + np, mask | bit[np]))
+
+def iter_paths(connectivity, starts, ends=None, lengths=None, require=None, preclude=None):
+    '''
+    Iterate over the complete paths from each of starts, depth-first and
+    without writing anything to disk. Arguments take the form the files are
+    read into: connectivity as from read_connectivity, require and preclude
+    as from read_rules, starts and ends as lists of paths and lengths as a
+    list of ints, otherwise paths are Hamiltonian. For example,
+    
+        connectivity = read_connectivity(open('example_3/connectivity.txt'))
+        for path in iter_paths(connectivity, ['ab']):
+            ...
+    
+    '''
+    lengths = set(lengths or [len(connectivity),])
+    bit = make_bits(connectivity)
+    req = group_masks(require, bit) if require else None
+    pre = group_masks(preclude, bit) if preclude else None
+    for start in starts:
+        for path in iter_completions(start, sum(bit[a] for a in set(start)), connectivity, bit, req, pre, lengths, ends):
+            yield path
+
+def coordinate(args):
+    '''
+    Coordinator of a distributed run. Extends the starts to args.coordinator
+    positions, writes the prefixes to the queue directory as work units of
+    args.unit paths, then waits for workers (--worker) to complete every unit
+    and gathers their shards into paths_out.txt. If the queue already holds
+    units, from an earlier coordinator, they are reused.
+    
+    '''
+    import hpRNA_queue
+    
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    if not len(starts[0]) <= args.coordinator < min(lengths):
+        raise Exception("Coordinator prefixes must be at least as long as the starts and shorter than the paths")
+    
+    if hpRNA_queue.unit_count(args.queue) is None:
+        def all_prefixes():
+            for start in starts:
+                for prefix in iter_completions(start, sum(bit[a] for a in set(start)), connectivity, bit, req, pre, set([args.coordinator]), None):
+                    yield prefix
+        units = hpRNA_queue.write_units(args.queue, all_prefixes(), args.unit)
+        sys.stdout.write("%i work units written to %s\n" % (units, args.queue))
+    
+    while hpRNA_queue.pending(args.queue):
+        time.sleep(5)
+    
+    hpRNA_queue.collect(args.queue, os.path.join(args.output, 'paths_out.txt'))
+    mark_complete(args.output, 'paths_out.txt')
+
+def work(args):
+    '''
+    Worker of a distributed run. Leases units from the queue directory,
+    extends their prefixes to complete paths and publishes a result shard per
+    unit. The lease is renewed from a background thread while a unit is
+    worked on, even while its prefixes give no paths; a unit whose lease has
+    not been renewed for args.lease seconds is taken over by another worker,
+    and a worker that loses its lease drops the unit. Exits once every unit
+    has a shard.
+    
+    '''
+    import hpRNA_queue
+    
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    
+    while True:
+        remaining = hpRNA_queue.pending(args.queue)
+        if remaining == []:
+            break
+        leased = False
+        for unit in remaining or []:
+            if not hpRNA_queue.lease(args.queue, unit, args.lease):
+                continue
+            leased = True
+            renewal = hpRNA_queue.Renewal(args.queue, unit, args.lease / 4.0)
+            shardfile = hpRNA_queue.shard(args.queue, unit)
+            for prefix in open(hpRNA_queue.unit_name(args.queue, unit, 'txt')):
+                if renewal.lost:
+                    break
+                prefix = prefix.strip()
+                for path in iter_completions(prefix, sum(bit[a] for a in set(prefix)), connectivity, bit, req, pre, lengths, ends):
+                    shardfile.write(path + '\n')
+            renewal.stop()
+            hpRNA_queue.finish(args.queue, unit, shardfile)
+        if not leased:
+            time.sleep(5)
+
+def generate_moves(args):
+    '''
+    Generate paths directly as words over moves, the column of CONNECTIVITY
+    taken at each step (as hpRNA_constrain.notation), for regular cages with
+    at most three neighbors per position. Only one word of each mirror and
+    reverse class (see hpRNA_constrain.permute_path) is kept: the smallest of
+    the words of the class that are paths from the start, as those are the
+    words read back by hpRNA_constrain.read_paths. Where swapping columns 2
+    and 3 is a symmetry of the cage fixing the start (see mirrors), mirrored
+    words are never searched, as the first move other than 1 must be a 2.
+    Words are packed two bits per move into moves_out.bin.
+    
+    '''
+    from hpRNA_constrain import permute_path, positions
+    
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    if len(starts) != 1 or len(starts[0]) != 1:
+        raise Exception("--moves requires a single starting position")
+    if len(set(len(v) for v in connectivity.values())) != 1 or len(connectivity[starts[0]]) > 3:
+        raise Exception("--moves requires every position to have the same number of neighbors, at most 3")
+    
+    maxlength = max(lengths)
+    viable = make_viable(connectivity, ends, lengths, bit)
+    mirrored = mirrors(connectivity, starts[0])
+    
+    outfile = open(os.path.join(args.output, 'moves_out.bin'), 'wb')
+    outfile.write('hpRNA-moves %s\n' % (starts[0],))
+    found = 0
+    stack = [(starts[0], '', bit[starts[0]])]
+    while stack:
+        path, word, mask = stack.pop()
+        if len(path) in lengths and word == min(w for w in permute_path(word) if positions(w, starts[0], connectivity)):
+            outfile.write(pack_moves(word))
+            found += 1
+        if len(path) < maxlength:
+            turned = word.strip('1') != ''
+            for k in range(len(connectivity[path[-1]]) - 1, -1, -1):
+                q = connectivity[path[-1]][k]
+                if mask & bit[q] or not viable(path, mask, q):
+                    continue
+                if k == 2 and mirrored and not turned:
+                    continue
+                stack.append((path + q, word + str(k + 1), mask | bit[q]))
+    outfile.close()
+    
+    sys.stdout.write("%i move words written\n" % (found,))
+
+def mirrors(connectivity, start):
+    '''
+    True if swapping columns 2 and 3 of CONNECTIVITY, fixing start, is a
+    symmetry of the cage, so that the mirror of every word that is a path
+    from start is one too.
+    
+    '''
+    swap = [0, 2, 1]
+    image = {start: start}
+    reached = [start]
+    for v in reached:
+        if len(connectivity[v]) != 3 or len(connectivity[image[v]]) != 3:
+            return False
+        for k in range(3):
+            a, b = connectivity[v][k], connectivity[image[v]][swap[k]]
+            if a not in image:
+                image[a] = b
+                reached.append(a)
+            elif image[a] != b:
+                return False
+    return len(reached) == len(connectivity) and len(set(image.values())) == len(image)
+
+def pack_moves(word):
+    '''
+    One record of a move file: the number of moves as two bytes, then the
+    moves packed four to a byte, first move in the highest bits.
+    
+    '''
+    moves = [int(m) for m in word] + [0] * (-len(word) % 4)
+    return struct.pack('>H', len(word)) + ''.join(chr((a << 6) | (b << 4) | (c << 2) | d) for a, b, c, d in zip(*[iter(moves)] * 4))
+
+def read_moves(movefile):
+    '''
+    Iterate over the words of a move file written by generate_moves. Returns
+    the starting position and the iterator.
+    
+    '''
+    start = movefile.readline().split()[1]
+    
+    def words():
+        while True:
+            n = movefile.read(2)
+            if not n:
+                break
+            n = struct.unpack('>H', n)[0]
+            packed = movefile.read((n + 3) // 4)
+            yield ''.join(str((ord(b) >> s) & 3) for b in packed for s in (6, 4, 2, 0))[:n]
+        movefile.close()
+    
+    return start, words()
+
+def weighted_choice(weights, rng):
+    '''
+    Index chosen in proportion to weights, exact for large integer weights.
+    
+    '''
+    pick = rng.randrange(sum(weights))
+    for n, w in enumerate(weights):
+        if pick < w:
+            return n
+        pick -= w
+
+def build_zdd(args):
+    '''
+    Build the library as a zero-suppressed decision diagram over the edges of
+    the cage instead of listing paths level by level. One root is built for
+    each start, end and length; the diagram is saved to paths_out.zdd for
+    hpRNA_constrain.py. Only the edges used are recorded, so REQUIRE and
+    PRECLUDE, which depend on visiting order, cannot be applied.
+    
+    '''
+    connectivity, starts, ends, lengths, bit, req, pre = read_search(args)
+    
+    zdd = make_zdd(connectivity, starts, ends, lengths)
+    zdd.save(os.path.join(args.output, 'paths_out.zdd'))
+    
+    sys.stdout.write("%i paths in %i nodes\n" % (zdd.total(), len(zdd.nodes) - 2))
+
+def make_zdd(connectivity, starts, ends, lengths):
+    '''
+    Diagram with one root for each length, start and end.
+    
+    '''
+    import hpRNA_zdd
+    
+    zdd = hpRNA_zdd.ZDD(hpRNA_zdd.edge_order(connectivity, starts[0][0]))
+    for l in sorted(lengths):
+        for start in starts:
+            for e in ends or [None,]:
+                zdd.build(connectivity, start, e, l if l < len(connectivity) else None)
+    return zdd
+
+def make_expander(connectivity, req, pre, degeneracy=None, trie=False):
+    '''
+    Return a function extending a block of whole lines from one level by every
+    allowed move, giving the lines of the next level in the same order as
+    execute_forward, or execute_both if degeneracy is given. The block is held
+    as a 2-D array of position indices, one row per path, with a column of
+    visited masks, and every path is extended at once with array operations.
+    With trie, it gives the row in the block and the new position of each
+    extension instead, as stored by --trie.
+    
+    '''
+    import numpy as np
+    
+    names = sorted(connectivity)
+    size = len(names)
+    if size > 255:
+        raise Exception("--engine numpy supports at most 255 positions")
+    
+    # Index size stands for a missing neighbor, and is always visited.
+    code = np.zeros(256, dtype=np.uint8) + size
+    for n, p in enumerate(names):
+        code[ord(p)] = n
+    chars = np.array([ord(p) for p in names] + [0], dtype=np.uint8)
+    
+    degree = max(len(v) for v in connectivity.values())
+    table = np.zeros((size + 1, degree), dtype=np.uint8) + size
+    for p, v in connectivity.items():
+        table[code[ord(p)], :len(v)] = [code[ord(q)] for q in v]
+    
+    # Visited masks are 64 positions to a word.
+    words = size // 64 + 1
+    word = np.arange(size + 1) // 64
+    bits = np.uint64(1) << (np.arange(size + 1) % 64).astype(np.uint64)
+    
+    def group_masks(rules):
+        masks = {}
+        for k, v in rules.items():
+            masks[code[ord(k)]] = g = np.zeros((len(v), words), dtype=np.uint64)
+            for n, group in enumerate(v):
+                for a in group:
+                    g[n, word[code[ord(a)]]] |= bits[code[ord(a)]]
+        return masks
+    
+    req = group_masks(req) if req else None
+    pre = group_masks(pre) if pre else None
+    
+    if degeneracy:
+        trans = np.zeros((size + 1, size + 1), dtype=np.uint8) + np.arange(size + 1, dtype=np.uint8)
+        for first, t in degeneracy.items():
+            for a, b in t.items():
+                trans[code[ord(first)], code[ord(a)]] = code[ord(b)]
+    
+    def moves(paths, mask, ends):
+        # Allowed moves from the given end of every path, as a (paths, degree)
+        # array of neighbors and a mask of those allowed.
+        nb = table.take(paths[:, ends], axis=0)
+        ok = mask[np.arange(len(paths))[:, None], word[nb]] & bits[nb] == 0
+        for p in range(size):
+            for rules, need in ((pre, False), (req, True)):
+                if rules is None:
+                    continue
+                r, k = np.nonzero(ok & (nb == p))
+                if not len(r):
+                    continue
+                hit = np.zeros(len(r), dtype=bool)
+                for g in rules.get(p, []):
+                    hit |= (mask[r] & g == g).all(axis=1)
+                ok[r, k] = hit if need else ~hit
+        return nb, ok
+    
+    def expand(block):
+        if not block.endswith('\n'):
+            block += '\n'
+        width = block.index('\n') + 1
+        lines = np.frombuffer(block, dtype=np.uint8)
+        if len(lines) % width or (lines[width-1::width] != 10).any():
+            raise Exception("Not all paths in a level are the same length")
+        lines = lines.reshape(-1, width)
+        paths = code[lines[:, :-1]]
+        
+        rows = np.arange(len(paths))
+        mask = np.zeros((len(paths), words), dtype=np.uint64)
+        mask[:, word[size]] = bits[size]
+        for column in paths.T:
+            if words == 1:
+                mask[:, 0] |= bits[column]
+            else:
+                mask[rows, word[column]] |= bits[column]
+        
+        nb, ok = moves(paths, mask, -1)
+        if degeneracy:
+            nb_back, ok_back = moves(paths, mask, 0)
+            nb = np.hstack((nb, nb_back))
+            ok = np.hstack((ok, ok_back))
+        
+        # Row-major order keeps each path's moves together, forwards first.
+        # Forward moves copy the input line and add the new position.
+        r, k = np.nonzero(ok)
+        moved = nb[r, k]
+        if trie:
+            return r, chars[moved]
+        out = np.empty((len(r), width + 1), dtype=np.uint8)
+        out[:, -1] = 10
+        if degeneracy:
+            forward = k < degree
+            back = ~forward
+            out[forward, :-1] = lines.take(r[forward], axis=0)
+            out[forward, -2] = chars[moved[forward]]
+            first = moved[back]
+            rest = paths.take(r[back], axis=0)
+            out[back, 0] = chars[trans[first, first]]
+            out[back, 1:-1] = chars[trans[first[:, None], rest]]
+        else:
+            out[:, :-1] = lines.take(r, axis=0)
+            out[:, -2] = chars[moved]
+        return out.tostring()
+    
+    return expand
+
+def make_refilter(connectivity, first, maxlength, rules, old_rules, tightened, loosened):
+    '''
+    Return a function filtering a block of whole lines from one level, made
+    under old_rules, to the paths allowed by rules, for --update. Only moves
+    to the positions tightened are tested, after the first positions. It
+    gives the lines kept, their number, and whether any may move to one of
+    the positions loosened where only rules allow it. As in make_expander,
+    the block is held as an array, with the place of each position in each
+    path, so a rule group is visited before a move if all its places are
+    earlier.
+    
+    '''
+    import numpy as np
+    
+    names = sorted(connectivity)
+    size = len(names)
+    if size > 255:
+        raise Exception("--update supports at most 255 positions")
+    code = np.zeros(256, dtype=np.uint8)
+    for n, p in enumerate(names):
+        code[ord(p)] = n
+    # Unvisited positions are placed after every move.
+    never = 255
+    
+    def allows(rules, p, place, at):
+        req, pre = rules
+        ok = np.ones(len(at), dtype=bool)
+        for g in pre[p] if pre else []:
+            ok &= ~(place[:, code[[ord(a) for a in g]]] < at[:, None]).all(axis=1)
+        if req:
+            hit = np.zeros(len(at), dtype=bool)
+            for g in req[p]:
+                hit |= (place[:, code[[ord(a) for a in g]]] < at[:, None]).all(axis=1)
+            ok &= hit
+        return ok
+    
+    # Positions each loosened position can be moved to from.
+    beside = dict((p, np.zeros(256, dtype=bool)) for p in loosened)
+    for q, v in connectivity.items():
+        for p in v:
+            if p in loosened:
+                beside[p][ord(q)] = True
+    
+    def refilter(block):
+        width = block.index('\n') + 1
+        lines = np.frombuffer(block, dtype=np.uint8).reshape(-1, width)
+        rows = np.arange(len(lines))
+        place = np.zeros((len(lines), size), dtype=np.uint8) + never
+        place[rows[:, None], code[lines[:, :-1]]] = np.arange(width - 1)
+        
+        keep = np.ones(len(lines), dtype=bool)
+        for p in tightened:
+            at = place[:, code[ord(p)]]
+            moved = (at >= first) & (at != never)
+            keep[moved] &= allows(rules, p, place[moved], at[moved])
+        lines, place = lines[keep], place[keep]
+        
+        gained = False
+        if width - 1 < maxlength:
+            for p in loosened:
+                free = beside[p][lines[:, -2]] & (place[:, code[ord(p)]] == never)
+                if free.any():
+                    at = np.zeros(free.sum(), dtype=np.uint8) + never
+                    if (allows(rules, p, place[free], at) & ~allows(old_rules, p, place[free], at)).any():
+                        gained = True
+                        break
+        return lines.tostring(), len(lines), gained
+    
+    return refilter
+
+def extensions(i, connectivity, req, pre):
+    '''
+    Moves. Iterate over the paths one unit longer than i, attempting each
+    possible move from its end.
+    
+    '''
     for np in connectivity[i[-1]]:
         if np not in i:
-            if not args.preclude or not any(all(pp in i for pp in p) for p in pre[np]):
-                if not args.require or any(all(tt in i for tt in t) for t in req[np]):
-                    outfile.write(i+np+'\n')
+            if not pre or not any(all(pp in i for pp in p) for p in pre[np]):
+                if not req or any(all(tt in i for tt in t) for t in req[np]):
+                    yield i+np
+
+def execute_forward(i, connectivity, outfile, degeneracy, req, pre):
+    '''
+    Moves. Extend each path by one unit, attempting each possible move.
+    
+    '''
+    outfile.write(''.join([path+'\n' for path in extensions(i, connectivity, req, pre)]))
 
 
 def execute_both(i, connectivity, outfile, degeneracy, req, pre):
@@ -171,17 +1512,9 @@ def execute_both(i, connectivity, outfile, degeneracy, req, pre):
     
     '''
     # Forwards
-    for np in connectivity[i[-1]]:
-        if np not in i:
-            if not args.preclude or not any(all(pp in i for pp in p) for p in pre[np]):
-                if not args.require or any(all(tt in i for tt in t) for t in req[np]):
-                    outfile.write(i+np+'\n')
-    # Backwards
-    for np in connectivity[i[0]]:
-        if np not in i:
-            if not args.preclude or not any(all(pp in i for pp in p) for p in pre[np]):
-                if not args.require or any(all(tt in i for tt in t) for t in req[np]):
-                    outfile.write(rework(np+i, degeneracy)+'\n')
+    outfile.write(''.join([path+'\n' for path in extensions(i, connectivity, req, pre)]))
+    # Backwards, as forward moves on the reversed path
+    outfile.write(''.join([rework(path[::-1], degeneracy)+'\n' for path in extensions(i[::-1], connectivity, req, pre)]))
 
 def rework(path, degeneracy):
     '''
@@ -205,9 +1538,36 @@ if __name__ == '__main__':
     parser.add_argument("-p", "--preclude", help='File PRECLUDE. Provide exclusion based on previously visited positions. A move to positions in first column cannot occur if those in subsequent columns have previously been visited.', type=file)
     parser.add_argument("-l", "--length", help='File LENGTH. Length of paths to consider, otherwise paths visiting every position in CONNECTIVITY are assumed: i.e. Hamiltonian path.', type=file)
     parser.add_argument("-i", "--iteration", help='Int ITERATION. Resume previously started generation at supplied ITERATION (corresponding to path length).', type=int)
+    parser.add_argument("-u", "--update", help='Option. Reuse the levels an earlier run left in OUTPUT with other REQUIRE or PRECLUDE rules, each level being recorded with its rules in paths_rules.txt. Levels are filtered while the new rules allow no move the old did not, and generated again from the first level with a path they allow a new move from. The same START and CONNECTIVITY must be given.', action="store_true")
     parser.add_argument("-d", "--degeneracy", help='File DEGENERACY. Rotational symmetry of polyhedron: all moves. For example, if the cage has icosahedral symmetry, there will be 12*5=60 identical symmetric views. Each line of the file represents a rotation to an identical view: in every row, the elements have the same relationship to each other, but the rows begin at different positions.', type=file)
     parser.add_argument("-b", "--both", help='Option. Paths are calculated both 5\'-3\' and 3\'-5\'. This only will make a difference if --require or --preclude are used. Requires --degeneracy.', action="store_true")
     parser.add_argument("-o", "--output", help='Directory OUTPUT. Choose output directory. Default \'paths\'.', default='paths')
+    parser.add_argument("--checkpoint", help='Int CHECKPOINT. Save progress through each level every CHECKPOINT input paths, so an interrupted run resumed with --iteration carries on mid-level. 0 disables. Default 100000.', type=int, default=100000)
+    parser.add_argument("--engine", help='String ENGINE. How each level is extended: \'text\', one path at a time, or \'numpy\', in blocks of CHUNK paths held as arrays, which is much faster on large levels. Default \'text\'.', choices=['text', 'numpy'], default='text')
+    parser.add_argument("--chunk", help='Int CHUNK. Paths read into memory at once by --engine numpy, or rebuilt at once by --trie. Default 100000.', type=int, default=100000)
+    parser.add_argument("--count", help='Option. Count paths per start and per end without writing them, using a memoised search. Counts are saved to counts_out.txt in OUTPUT.', action="store_true")
+    parser.add_argument("--memo", help='Int MEMO. Maximum number of search states held by --count before the oldest are evicted. Default 1000000.', type=int, default=1000000)
+    parser.add_argument("--zdd", help='Option. Build the paths as a decision diagram over cage edges, saved to paths_out.zdd in OUTPUT, instead of listing them. Cannot be used with --require, --preclude or --both.', action="store_true")
+    parser.add_argument("--sample", help='Int SAMPLE. Draw SAMPLE random paths instead of enumerating them, saved with their importance weights to paths_sample.txt in OUTPUT. Uses the same START, END, REQUIRE, PRECLUDE and LENGTH rules.', type=int)
+    parser.add_argument("--uniform", help='Option. With --sample, draw paths uniformly (weight 1). Sampled from a --zdd diagram, or with REQUIRE or PRECLUDE by counting completions as --count does.', action="store_true")
+    parser.add_argument("--seed", help='Int SEED. Random seed for --sample.', type=int)
+    parser.add_argument("--first", help='Int FIRST. Any-time search: write the first FIRST paths found, depth-first with fewest-onward-moves ordering, to paths_first.txt in OUTPUT as they are found.', type=int)
+    parser.add_argument("--timeout", help='Float TIMEOUT. Seconds after which --first stops searching.', type=float)
+    parser.add_argument("--meet", help='Option. Meet-in-the-middle search for paths pinned at both ends: grow half paths forward from START and backward from END, and join those meeting at the same position over complementary positions. Explores two trees of half the depth instead of one. Requires END, and paths visiting every position. Saved to paths_out.txt in OUTPUT, in the same order as level-by-level generation.', action="store_true")
+    parser.add_argument("--coordinator", help='Int COORDINATOR. Distributed run: extend the starts to COORDINATOR positions, write them as work units to the --queue directory, and gather the workers\' results into paths_out.txt in OUTPUT.', type=int)
+    parser.add_argument("--worker", help='Option. Distributed run: complete work units from the --queue directory. Give the same CONNECTIVITY, START, END, REQUIRE, PRECLUDE and LENGTH as the coordinator. Any number of workers, on any machine sharing the directory, can run at once.', action="store_true")
+    parser.add_argument("--queue", help='Directory QUEUE. Shared work queue for --coordinator and --worker.')
+    parser.add_argument("--unit", help='Int UNIT. Prefix paths per work unit. Default 1000.', type=int, default=1000)
+    parser.add_argument("--lease", help='Float LEASE. Seconds without renewal after which a worker\'s unit is reissued. Default 600.', type=float, default=600)
+    parser.add_argument("--moves", help='Option. Generate in move notation for regular cages (see hpRNA_constrain.py --moves), keeping one word per mirror/reverse class of paths from the start, packed into moves_out.bin in OUTPUT. Requires a single starting position, and cannot be used with --end, --require or --preclude.', action="store_true")
+    parser.add_argument("--trie", help='Option. Store each level after the starts as paths_NN.trie: for each path, the index of the path it extends in the level before and the position it moves to, 5 bytes a path. paths_out is written in full as usual. Cannot be used with --both.', action="store_true")
+    parser.add_argument("--compress", help='Option. Keep levels and paths_out as gzip files (paths_NN.txt.gz), a fraction of the size. hpRNA_constrain.py reads them directly.', action="store_true")
+    parser.add_argument("--background", help='Option. Write path files from a background thread, so extending paths does not wait on the disk.', action="store_true")
+    parser.add_argument("--index", help='Option. Write an offset index of paths_out (paths_out.txt.idx), for random access with hpRNA_index.py.', action="store_true")
+    parser.add_argument("--store", help='Directory STORE. Keep paths_out of each run in STORE, keyed by a hash of the contents of CONNECTIVITY, START, END, REQUIRE, PRECLUDE, LENGTH and, with --both, DEGENERACY, and of the options changing paths_out. A repeat of a kept run, from any OUTPUT, takes paths_out from STORE as a hard link (a copy on another file system) instead of generating it. STORE can be shared between projects and with hpRNA_constrain.py --store.')
+    parser.add_argument("--store-size", help='Int STORE_SIZE. Megabytes of runs kept in STORE, least recently used first out. Default 2048.', type=int, default=2048)
+    parser.add_argument("--profile", help='Option. Time each stage of the run (wall and CPU), printed and saved to generate_profile.txt in OUTPUT.', action="store_true")
+    parser.add_argument("--cprofile", help='Option. With --profile, also save a cProfile dump of the run to generate_profile.prof in OUTPUT.', action="store_true")
     args = parser.parse_args()
 
     if not os.path.exists(args.output):
@@ -217,7 +1577,81 @@ if __name__ == '__main__':
             parser.error("--output directory error.")
     if args.both is True and args.degeneracy is None:
         parser.error("--both requires --degeneracy.")
+    if args.count and (args.both or args.iteration is not None):
+        parser.error("--count cannot be combined with --both or --iteration.")
 
-    generate_paths(args)
+    if args.zdd and (args.require or args.preclude or args.both or args.count):
+        parser.error("--zdd cannot be combined with --require, --preclude, --both or --count.")
+
+    if args.sample is not None and (args.both or args.iteration is not None or args.count or args.zdd):
+        parser.error("--sample cannot be combined with --both, --iteration, --count or --zdd.")
+    if args.uniform and args.sample is None:
+        parser.error("--uniform requires --sample.")
+
+    if args.first is not None and (args.both or args.iteration is not None or args.count or args.zdd or args.sample is not None):
+        parser.error("--first cannot be combined with --both, --iteration, --count, --zdd or --sample.")
+    if args.timeout and args.first is None:
+        parser.error("--timeout requires --first.")
+
+    if args.meet and args.end is None:
+        parser.error("--meet requires --end.")
+    if args.meet and (args.both or args.iteration is not None or args.count or args.zdd or args.sample is not None or args.first is not None):
+        parser.error("--meet cannot be combined with --both, --iteration, --count, --zdd, --sample or --first.")
+
+    distributed = args.coordinator is not None or args.worker
+    if distributed and args.queue is None:
+        parser.error("--coordinator and --worker require --queue.")
+    if distributed and (args.both or args.iteration is not None or args.count or args.zdd or args.sample is not None or args.first is not None or args.meet):
+        parser.error("--coordinator and --worker cannot be combined with other generation modes.")
+
+    if args.update and (args.both or args.iteration is not None or args.trie or args.moves or distributed or args.count or args.zdd or args.sample is not None or args.first is not None or args.meet):
+        parser.error("--update applies to level-by-level generation, and cannot be combined with --both, --iteration or --trie.")
+
+    if args.moves and (args.end or args.require or args.preclude or args.both or args.iteration is not None or distributed or args.count or args.zdd or args.sample is not None or args.first is not None):
+        parser.error("--moves cannot be combined with --end, --require, --preclude or other generation modes.")
+
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile requires --profile.")
+
+    if (args.engine == 'numpy' or args.compress or args.trie) and (args.moves or distributed or args.count or args.zdd or args.sample is not None or args.first is not None or args.meet):
+        parser.error("--engine numpy, --compress and --trie only apply to level-by-level generation.")
+    if args.index and (args.compress or args.moves or distributed or args.count or args.zdd or args.sample is not None or args.first is not None or args.meet):
+        parser.error("--index applies to the uncompressed paths_out of level-by-level generation.")
+    if args.trie and args.both:
+        parser.error("--trie cannot be combined with --both, whose backward moves do not extend the end of a path.")
+    if args.iteration is not None:
+        # The start level is plain text, even with --trie.
+        width = len(args.start.readline().strip())
+        args.start.seek(0)
+        level = 'paths_%02i' % (args.iteration,) + ('.trie' if args.trie and args.iteration != width else '.txt.gz' if args.compress else '.txt')
+        if not resumable(args.output, level):
+            done = [int(f[6:8]) for f in completed(args.output) if f.startswith('paths_') and not f.startswith('paths_out')]
+            parser.error("--iteration %i: %s is not a completed level in OUTPUT; the last completed level is %s." % (args.iteration, level, max(done) if done else 'none'))
+    if args.store and (args.iteration is not None or args.update or args.moves or distributed or args.count or args.zdd or args.sample is not None or args.first is not None):
+        parser.error("--store keeps paths_out of whole level-by-level or --meet runs, so cannot be combined with --iteration, --update or other generation modes.")
+
+    with profiling(args.output, 'generate', args.profile, args.cprofile):
+        if args.store:
+            store_paths(args)
+        elif args.moves:
+            generate_moves(args)
+        elif args.coordinator is not None:
+            coordinate(args)
+        elif args.worker:
+            work(args)
+        elif args.count:
+            count_paths(args)
+        elif args.first is not None:
+            first_paths(args)
+        elif args.sample is not None:
+            sample_paths(args)
+        elif args.meet:
+            meet_paths(args)
+        elif args.zdd:
+            build_zdd(args)
+        elif args.trie:
+            generate_trie(args)
+        else:
+            generate_paths(args)
     
 ## ENDS
\ No newline at end of file
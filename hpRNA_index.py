@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_index.py                                                    SCRIPT  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Tool for random access to large path files. A sidecar index (.idx)        ##
+##  holds the byte offset of every STRIDE-th path, so any path can be         ##
+##  reached with one seek and a short scan, and a library can be split into   ##
+##  line-aligned chunks of equal numbers of paths without reading it.         ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import sys
+import argparse
+import mmap
+import numpy as np
+
+### CONSTANTS
+
+# Paths between indexed offsets.
+STRIDE = 256
+
+# Bytes of the path file scanned at once while indexing.
+SCAN = 1 << 26
+
+### FUNCTION DEFINITIONS
+
+def index_name(name):
+    return name + '.idx'
+
+def build_index(name, stride=STRIDE):
+    '''
+    Write the index of path file name: its stride, number of paths and size,
+    then the offset of every stride-th path, all as 8 byte integers.
+
+    '''
+    if name.endswith('.gz') or name.endswith('.bin') or name.endswith('.trie'):
+        raise Exception("Only plain text path files can be indexed, not %s" % (name,))
+    size = os.path.getsize(name)
+    offsets = [np.zeros(1, dtype=np.int64)] if size else []
+    count = 0
+    if size:
+        data = np.memmap(name, dtype=np.uint8, mode='r')
+        for lo in range(0, size, SCAN):
+            # Path count + n starts just after the n-th newline of the scan.
+            starts = np.flatnonzero(data[lo:lo+SCAN] == 10) + (lo + 1)
+            number = np.arange(count + 1, count + 1 + len(starts))
+            offsets.append(starts[(number % stride == 0) & (starts < size)])
+            count += len(starts)
+        if data[-1] != 10:
+            count += 1
+        del data
+    header = np.array([stride, count, size], dtype=np.int64)
+    index = np.concatenate([header] + offsets).astype('<u8')
+    index.tofile(index_name(name) + '.tmp')
+    os.rename(index_name(name) + '.tmp', index_name(name))
+    return count
+
+
+class PathIndex(object):
+    '''
+    Random access to the paths of an indexed path file, by number from 0.
+
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        if not os.path.exists(index_name(name)):
+            raise Exception("%s has no index, build it with hpRNA_index.py" % (name,))
+        index = np.fromfile(index_name(name), dtype='<u8').astype(np.int64)
+        self.stride, self.count, self.size = [int(a) for a in index[:3]]
+        self.offsets = index[3:]
+        if os.path.getsize(name) != self.size:
+            raise Exception("The index of %s is out of date, rebuild it with hpRNA_index.py" % (name,))
+        self.file = open(name, 'rb')
+
+    def __len__(self):
+        return self.count
+
+    def seek(self, k):
+        '''
+        Move the file to the start of path k.
+
+        '''
+        if k >= self.count:
+            self.file.seek(self.size)
+            return
+        self.file.seek(self.offsets[k // self.stride])
+        for n in range(k % self.stride):
+            self.file.readline()
+
+    def lines(self, lo, hi):
+        '''
+        Paths lo to hi, as text, one path to a line.
+
+        '''
+        lo, hi, step = slice(lo, hi).indices(self.count)
+        self.seek(lo)
+        return ''.join(self.file.readline() for n in range(lo, hi))
+
+    def offset(self, k):
+        self.seek(k)
+        return self.file.tell()
+
+    def chunks(self, n):
+        '''
+        Split the file into at most n line-aligned byte ranges (start, end)
+        holding equal numbers of paths, to within STRIDE.
+
+        '''
+        blocks = len(self.offsets)
+        if not blocks:
+            return []
+        edges = sorted(set(blocks * c // n for c in range(n)))
+        bounds = [int(self.offsets[b]) for b in edges] + [self.size]
+        return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    def close(self):
+        self.file.close()
+
+def line_ends(name):
+    '''
+    Offset just past the end of every line of file name.
+
+    '''
+    size = os.path.getsize(name)
+    if not size:
+        return np.zeros(0, dtype=np.int64)
+    data = np.memmap(name, dtype=np.uint8, mode='r')
+    ends = [np.flatnonzero(data[lo:lo+SCAN] == 10) + (lo + 1) for lo in range(0, size, SCAN)]
+    if data[-1] != 10:
+        ends.append(np.array([size]))
+    del data
+    return np.concatenate(ends).astype(np.int64)
+
+def line_chunks(name, n):
+    '''
+    Split path file name into at most n line-aligned byte ranges (start, end),
+    holding equal numbers of paths if the file has an up to date index, and
+    otherwise of about equal size.
+
+    '''
+    try:
+        index = PathIndex(name)
+    except Exception:
+        index = None
+    if index is not None:
+        chunks = index.chunks(n)
+        index.close()
+        return chunks
+    size = os.path.getsize(name)
+    if not size:
+        return []
+    infile = open(name, 'rb')
+    data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    bounds = [0]
+    for c in range(1, n):
+        # Each range ends with the line running over its share of the bytes.
+        b = data.find('\n', max(size * c // n - 1, bounds[-1])) + 1
+        bounds.append(b or size)
+    bounds.append(size)
+    data.close()
+    infile.close()
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def open_index(name, stride=STRIDE):
+    '''
+    PathIndex of name, building the index first if it is missing or stale.
+
+    '''
+    try:
+        return PathIndex(name)
+    except Exception:
+        build_index(name, stride)
+        return PathIndex(name)
+
+### MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index a path file for random access, and read paths from it by number")
+    parser.add_argument("-p", "--paths", help='File PATHS. Path file to index or read. Its index is PATHS.idx. Levels written by hpRNA_generate.py --trie (.trie) can be read without an index.', required=True)
+    parser.add_argument("--build", help='Option. Build or rebuild the index, then report the number of paths.', action="store_true")
+    parser.add_argument("--stride", help='Int STRIDE. Paths between indexed offsets. Default %i.' % (STRIDE,), type=int, default=STRIDE)
+    parser.add_argument("--head", help='Int HEAD. Print the first HEAD paths.', type=int)
+    parser.add_argument("--slice", help='Int LO HI. Print paths LO to HI, counting from 0 and not including HI.', type=int, nargs=2, metavar=('LO', 'HI'))
+    parser.add_argument("--get", help='Int GET. Print the paths numbered GET, in the order given.', type=int, nargs='+')
+    parser.add_argument("--chunks", help='Int CHUNKS. Print CHUNKS line-aligned byte ranges of equal numbers of paths, as start and end offsets.', type=int)
+    args = parser.parse_args()
+
+    if args.stride < 1:
+        parser.error("--stride must be at least 1.")
+    if args.chunks is not None and args.chunks < 1:
+        parser.error("--chunks must be at least 1.")
+
+    if args.paths.endswith('.trie'):
+        if args.build or args.chunks:
+            parser.error("--trie levels need no index, and have no byte ranges.")
+        import hpRNA_trie
+        trie = hpRNA_trie.Trie(os.path.dirname(args.paths), int(os.path.basename(args.paths)[6:-5]))
+        count = trie.count()
+        lines = lambda lo, hi: trie.lines(trie.level, *slice(lo, hi).indices(count)[:2])
+    else:
+        if args.build:
+            build_index(args.paths, args.stride)
+        index = open_index(args.paths, args.stride)
+        count = len(index)
+        lines = index.lines
+
+    if args.build:
+        print '%i paths indexed in %s' % (count, index_name(args.paths))
+    if args.head is not None:
+        sys.stdout.write(lines(0, args.head))
+    if args.slice:
+        sys.stdout.write(lines(args.slice[0], args.slice[1]))
+    if args.get:
+        for k in args.get:
+            if not 0 <= k < count:
+                parser.error("path %i is out of range, PATHS holds %i." % (k, count))
+            sys.stdout.write(lines(k, k + 1))
+    if args.chunks:
+        for a, b in index.chunks(args.chunks):
+            print '%i\t%i' % (a, b)
+
+### ENDS
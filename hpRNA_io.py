@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_io.py                                                       MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for reading and writing path files. Output is buffered in large    ##
+##  blocks and can be handed to a background thread, so that the search       ##
+##  does not wait on the disk. Files named .gz are compressed with gzip.      ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import gzip
+import io
+import threading
+import Queue
+
+### CONSTANTS
+
+# Bytes of file buffer, and lines collected before a block is handed over.
+BUFFER = 1 << 20
+BLOCK = 1 << 16
+
+# gzip level for compressed path files. Level 1 still shrinks path files about
+# fivefold, in a fraction of the time of higher levels.
+LEVEL = 1
+
+### FUNCTION DEFINITIONS
+
+def compressed(name):
+    return name.endswith('.gz')
+
+def open_paths(name, mode='w', background=False):
+    '''
+    Open a path file for writing with a large buffer, written from a
+    background thread if background is set. Names ending .gz are compressed.
+    A file already at name is replaced rather than rewritten in place, as it
+    may be a hard link to a run kept by --store.
+
+    '''
+    if os.path.exists(name):
+        os.remove(name)
+    outfile = open(name, mode, BUFFER)
+    if compressed(name):
+        outfile = GzipWriter(outfile)
+    return writer(outfile, background)
+
+def read_file(name):
+    '''
+    Open a path file for reading, decompressing it if the name ends .gz. Offsets
+    from tell and seek always count uncompressed bytes.
+
+    '''
+    if compressed(name):
+        # GzipFile.readline is slow in Python; the buffered reader splits lines
+        # in C.
+        return io.BufferedReader(gzip.open(name, 'rb'), BUFFER)
+    return open(name, 'r', BUFFER)
+
+def writer(outfile, background=False):
+    '''
+    Writer for an open file: the file itself, or a BackgroundWriter if
+    background is set.
+
+    '''
+    if background:
+        return BackgroundWriter(outfile)
+    return outfile
+
+
+class BackgroundWriter(object):
+    '''
+    File-like writer that collects lines and hands them, BLOCK lines at a
+    time, to a thread that writes them to outfile. A few blocks may wait in
+    the queue; beyond that the caller waits for the disk. flush and tell wait
+    for every block to be written, so checkpoints remain exact.
+
+    '''
+
+    def __init__(self, outfile):
+        self.file = outfile
+        self.name = outfile.name
+        self.lines = []
+        self.error = None
+        self.queue = Queue.Queue(4)
+        self.thread = threading.Thread(target=self.drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            block = self.queue.get()
+            try:
+                if block is None:
+                    return
+                if self.error is None:
+                    self.file.write(block)
+            except Exception, e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= BLOCK:
+            self.hand_over()
+
+    def writelines(self, lines):
+        self.lines.extend(lines)
+        if len(self.lines) >= BLOCK:
+            self.hand_over()
+
+    def hand_over(self):
+        if self.lines:
+            self.queue.put(''.join(self.lines))
+            self.lines = []
+        if self.error is not None:
+            raise self.error
+
+    def flush(self):
+        self.hand_over()
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        self.flush()
+        return self.file.tell()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.file.close()
+
+
+class GzipWriter(object):
+    '''
+    File-like writer that compresses into outfile, BLOCK lines at a time, as
+    each call to the compressor costs far more than a line. flush ends the
+    current gzip member, so tell then gives an offset in outfile at which the
+    file can be truncated and written on, as checkpoints do. The members read
+    back as one stream.
+
+    '''
+
+    def __init__(self, outfile):
+        self.file = outfile
+        self.name = outfile.name
+        self.lines = []
+        self.member = None
+
+    def write(self, data):
+        self.lines.append(data)
+        if len(self.lines) >= BLOCK:
+            self.compress()
+
+    def writelines(self, lines):
+        self.lines.extend(lines)
+        if len(self.lines) >= BLOCK:
+            self.compress()
+
+    def compress(self):
+        if self.lines:
+            if self.member is None:
+                self.member = gzip.GzipFile('', 'wb', LEVEL, self.file, 0)
+            self.member.write(''.join(self.lines))
+            self.lines = []
+
+    def flush(self):
+        self.compress()
+        if self.member is not None:
+            self.member.close()
+            self.member = None
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        self.flush()
+        return self.file.tell()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.file.close()
+
+### END OF MODULE
@@ -19,8 +19,6 @@
 ### MODULE IMPORTS
 
 from math import sqrt, atan, sin, cos, pi
-import matplotlib
-import cairo
 import os.path
 
 ### CONSTANTS
@@ -300,6 +298,8 @@ def draw_scaffold():
     Draw the baseline of the MS2 architecture to lay the path description above.
     
     '''
+    import cairo
+    
     surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1400, 800)
     if background:
         bg = cairo.Context(surface)
@@ -547,6 +547,8 @@ def draw_scaffold():
     return surface, draw_dict
 
 def hami_draw(constrain_occ, constrain_unocc, draw, name, movestr, protstr):
+    import cairo
+    
     surface, draw_dict = draw_scaffold()
     
     for (e1, e2), ev in constrain_occ:
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_profile.py                                                  MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for profiling the hpRNA scripts (--profile): wall and CPU time     ##
+##  spent in each named stage of a run, and optionally a cProfile dump of     ##
+##  the whole run.                                                            ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+### CONSTANTS
+
+# Stage name: [wall seconds, CPU seconds, times entered]. None when disabled.
+STAGES = None
+
+### FUNCTION DEFINITIONS
+
+def cpu_time():
+    '''
+    CPU time of this process and its finished children, such as awk.
+
+    '''
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+@contextmanager
+def stage(name):
+    '''
+    Count the time spent inside the with block towards stage name. Does
+    nothing unless profiling.
+
+    '''
+    if STAGES is None:
+        yield
+        return
+    wall, cpu = time.time(), cpu_time()
+    try:
+        yield
+    finally:
+        totals = STAGES.setdefault(name, [0.0, 0.0, 0])
+        totals[0] += time.time() - wall
+        totals[1] += cpu_time() - cpu
+        totals[2] += 1
+
+def report(total):
+    '''
+    Table of the stages, in the order first entered, with the total run.
+
+    '''
+    lines = ['%-24s %10s %10s %8s' % ('stage', 'wall (s)', 'cpu (s)', 'calls')]
+    for name, (wall, cpu, calls) in STAGES.items() + [('total', total + [1])]:
+        lines.append('%-24s %10.3f %10.3f %8i' % (name, wall, cpu, calls))
+    return '\n'.join(lines) + '\n'
+
+@contextmanager
+def profiling(output, name, timers, cprofile=False):
+    '''
+    Profile the with block if timers is set: the stage table is printed and
+    saved to NAME_profile.txt in output and, with cprofile, a cProfile dump
+    of the block is saved to NAME_profile.prof, for pstats or snakeviz.
+
+    '''
+    global STAGES
+    if not timers:
+        yield
+        return
+    STAGES = OrderedDict()
+    if cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    wall, cpu = time.time(), cpu_time()
+    try:
+        yield
+    finally:
+        total = [time.time() - wall, cpu_time() - cpu]
+        if cprofile:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(output, name + '_profile.prof'))
+        table = report(total)
+        STAGES = None
+        outfile = open(os.path.join(output, name + '_profile.txt'), 'w')
+        outfile.write(table)
+        outfile.close()
+        print '\n' + table
+
+### END OF MODULE
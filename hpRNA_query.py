@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_query.py                                                    SCRIPT  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Client for hpRNA_server.py. Constrains the library held by a server as    ##
+##  hpRNA_constrain.py would constrain the file, with the same options and    ##
+##  outputs, without reading the library again.                               ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import sys
+import argparse
+import json
+import socket
+from hpRNA_constrain import read_constraints, report_recommend
+from hpRNA_io import open_paths
+
+### FUNCTION DEFINITIONS
+
+def parse_address(address):
+    '''
+    Socket family and address of ADDRESS: a port number or host:port for a
+    TCP socket, otherwise the path of a Unix socket.
+
+    '''
+    host, sep, port = address.rpartition(':')
+    if port.isdigit():
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, address
+
+def query(address, request):
+    '''
+    Send request, a dictionary, to the server at address and return its
+    reply. Raises the server's error if the request failed.
+
+    '''
+    family, address = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    try:
+        sock.sendall(json.dumps(request) + '\n')
+        reply = json.loads(sock.makefile('r').readline())
+    finally:
+        sock.close()
+    if 'error' in reply:
+        raise Exception(reply['error'])
+    return reply
+
+### MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Constrain the path library held by hpRNA_server.py")
+    parser.add_argument("-s", "--socket", help='String SOCKET. Address the server listens on, as given to hpRNA_server.py. Default hpRNA.sock.', default='hpRNA.sock')
+    parser.add_argument("-x", "--constraints", help='File CONSTRAINTS. Provide constraints for paths, i.e. edges of the polyhedral cage that are either present (1) or not present (0).', type=file)
+    parser.add_argument("-o", "--output", help='Directory OUTPUT. Choose output directory. Default \'constrained\'.', default='constrained')
+    parser.add_argument("-m", "--moves", help='Option. Also write the passing paths in move notation, as hpRNA_constrain.py --moves. The server needs --connectivity.', action='store_true')
+    parser.add_argument("--ms2", help='Option. Additional analysis of constraints to compare to published example of bacteriophage ms2, drawn into OUTPUT by the server. The server needs --connectivity.', action='store_true')
+    parser.add_argument("--count", help='Option. Only report how many paths pass, without writing them.', action='store_true')
+    parser.add_argument("--recommend", help='Int RECOMMEND. Rank the cage edges not yet constrained by how evenly they split the paths passing, as hpRNA_constrain.py --recommend.', type=int)
+    parser.add_argument("--stop", help='Option. Shut the server down.', action='store_true')
+    args = parser.parse_args()
+
+    if args.stop:
+        query(args.socket, {'stop': True})
+        sys.exit(0)
+    if args.ms2 and args.constraints is None:
+        parser.error("--ms2 requires --constraints.")
+    if args.ms2 and (args.moves or args.count or args.recommend is not None):
+        parser.error("--ms2 cannot be combined with --moves, --count or --recommend.")
+    if args.count and args.moves:
+        parser.error("--count writes no paths, so cannot be combined with --moves.")
+
+    if not os.path.exists(args.output):
+        try:
+            os.makedirs(args.output)
+        except:
+            parser.error("--output directory error.")
+
+    constraints = []
+    if args.constraints:
+        constrain_occ, constrain_unocc = read_constraints(args.constraints)
+        constraints = [(e[0], 1) for e in constrain_occ] + [(e[0], 0) for e in constrain_unocc]
+    request = {'constraints': constraints, 'paths': not (args.count or args.ms2), 'moves': args.moves,
+               'recommend': args.recommend, 'ms2': args.ms2, 'output': os.path.abspath(args.output)}
+    reply = query(args.socket, request)
+
+    name = reply['name'] + ('_constrained' if constraints else '')
+    if args.ms2:
+        sys.stdout.write(reply['report'])
+    elif not args.count:
+        outfile = open_paths(os.path.join(args.output, name + reply['extension']))
+        outfile.write(str(reply['text']))
+        outfile.close()
+        if args.moves:
+            outfile = open_paths(os.path.join(args.output, name + '_moves' + reply['extension']))
+            outfile.write(str(reply['moves_text']))
+            outfile.close()
+
+    print '%i of %i paths pass the constraints (%.1f ms)' % (reply['passing'], reply['paths'], reply['seconds'] * 1000)
+    if reply['weight'] != reply['paths']:
+        print 'weighted fraction passing constraints: %.6g' % (reply['passing_weight'] / reply['weight'] if reply['weight'] else 0,)
+    if args.recommend is not None:
+        report_recommend(args.output, name, reply['recommend'], reply['passing_weight'], args.recommend)
+
+### ENDS
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_queue.py                                                    MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for sharing path generation between machines through a queue      ##
+##  directory on a shared filesystem. Work units are files of prefix paths,  ##
+##  leased by workers with lease files and completed by result shards.        ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import socket
+import threading
+import time
+
+### FUNCTION DEFINITIONS
+
+def unit_name(queue, unit, kind):
+    '''
+    File of a work unit: 'txt' for its prefixes, 'lease' for its lease and
+    'out' for its result shard.
+
+    '''
+    return os.path.join(queue, 'unit_%05i.%s' % (unit, kind))
+
+def worker_id():
+    return '%s:%i' % (socket.gethostname(), os.getpid())
+
+def write_units(queue, prefixes, size):
+    '''
+    Split prefixes into units of size paths. The unit count is written to
+    units.txt last, so workers only start on a fully written queue.
+
+    '''
+    if not os.path.exists(queue):
+        os.makedirs(queue)
+    units = 0
+    outfile = None
+    for n, prefix in enumerate(prefixes):
+        if n % size == 0:
+            if outfile:
+                outfile.close()
+                os.rename(unit_name(queue, units - 1, 'txt.tmp'), unit_name(queue, units - 1, 'txt'))
+            outfile = open(unit_name(queue, units, 'txt.tmp'), 'w')
+            units += 1
+        outfile.write(prefix + '\n')
+    if outfile:
+        outfile.close()
+        os.rename(unit_name(queue, units - 1, 'txt.tmp'), unit_name(queue, units - 1, 'txt'))
+    outfile = open(os.path.join(queue, 'units.tmp'), 'w')
+    outfile.write('%i\n' % (units,))
+    outfile.close()
+    os.rename(os.path.join(queue, 'units.tmp'), os.path.join(queue, 'units.txt'))
+    return units
+
+def unit_count(queue):
+    '''
+    Number of units in the queue, or None if it is not yet written.
+
+    '''
+    name = os.path.join(queue, 'units.txt')
+    if not os.path.exists(name):
+        return None
+    return int(open(name).read())
+
+def set_aside(name):
+    '''
+    Move lease file name aside, to a name of this worker's own, so that no
+    other worker can renew or replace it meanwhile. Returns the new name, or
+    None if there was no lease.
+
+    '''
+    aside = name + '.' + worker_id()
+    try:
+        os.rename(name, aside)
+    except OSError:
+        return None
+    return aside
+
+def put_back(aside, name):
+    '''
+    Return a lease moved aside by set_aside, unless another has been taken
+    in its place.
+
+    '''
+    try:
+        os.link(aside, name)
+    except OSError:
+        pass
+    os.remove(aside)
+
+def holder(name):
+    '''
+    Worker holding lease file name, or None.
+
+    '''
+    try:
+        return open(name).read().strip() or None
+    except IOError:
+        return None
+
+def lease(queue, unit, seconds):
+    '''
+    Try to take the lease on a unit. Fails if the unit is finished or leased
+    by another worker within the last seconds. An expired lease is moved
+    aside, which only one worker can do, and its age checked again once
+    moved, in case it was renewed meanwhile. A lease is taken by linking a
+    file holding the worker's id into place, which fails if another worker
+    has just taken it.
+
+    '''
+    if os.path.exists(unit_name(queue, unit, 'out')):
+        return False
+    name = unit_name(queue, unit, 'lease')
+    try:
+        if time.time() - os.path.getmtime(name) < seconds:
+            return False
+    except OSError:
+        pass
+    else:
+        aside = set_aside(name)
+        if aside is None:
+            # Another worker has just moved the expired lease.
+            return False
+        if time.time() - os.path.getmtime(aside) < seconds:
+            put_back(aside, name)
+            return False
+        os.remove(aside)
+    mine = name + '.' + worker_id() + '.new'
+    outfile = open(mine, 'w')
+    outfile.write(worker_id() + '\n')
+    outfile.close()
+    try:
+        os.link(mine, name)
+        taken = True
+    except OSError:
+        taken = False
+    os.remove(mine)
+    if taken and os.path.exists(unit_name(queue, unit, 'out')):
+        release(queue, unit)
+        return False
+    return taken
+
+def holds(queue, unit):
+    '''
+    Whether this worker holds the lease on a unit.
+
+    '''
+    return holder(unit_name(queue, unit, 'lease')) == worker_id()
+
+def renew(queue, unit):
+    '''
+    Keep a lease alive during a long unit. Returns False if the lease has
+    been lost to another worker.
+
+    '''
+    name = unit_name(queue, unit, 'lease')
+    if holder(name) != worker_id():
+        return False
+    try:
+        os.utime(name, None)
+    except OSError:
+        return False
+    return True
+
+def release(queue, unit):
+    '''
+    Give up the lease on a unit, if this worker holds it.
+
+    '''
+    name = unit_name(queue, unit, 'lease')
+    aside = set_aside(name)
+    if aside is None:
+        return
+    if holder(aside) == worker_id():
+        os.remove(aside)
+    else:
+        put_back(aside, name)
+
+
+class Renewal(object):
+    '''
+    Renew the lease on a unit every interval seconds from a background
+    thread, while the unit is worked on, whether or not it is producing
+    paths. lost is set once the lease has been lost to another worker.
+
+    '''
+
+    def __init__(self, queue, unit, interval):
+        self.queue = queue
+        self.unit = unit
+        self.interval = interval
+        self.lost = False
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            if not renew(self.queue, self.unit):
+                self.lost = True
+                return
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+
+def shard(queue, unit):
+    '''
+    Open a temporary result shard for a leased unit, made visible by finish.
+
+    '''
+    return open(unit_name(queue, unit, 'out.' + worker_id()), 'w')
+
+def finish(queue, unit, shardfile):
+    '''
+    Publish the result shard of a unit and give up its lease. If the lease
+    has been lost to another worker, the shard is discarded and False
+    returned.
+
+    '''
+    shardfile.flush()
+    os.fsync(shardfile.fileno())
+    shardfile.close()
+    if not holds(queue, unit):
+        os.remove(shardfile.name)
+        return False
+    os.rename(shardfile.name, unit_name(queue, unit, 'out'))
+    release(queue, unit)
+    return True
+
+def pending(queue):
+    '''
+    Units without a result shard.
+
+    '''
+    units = unit_count(queue)
+    if units is None:
+        return None
+    return [u for u in range(units) if not os.path.exists(unit_name(queue, u, 'out'))]
+
+def collect(queue, name):
+    '''
+    Concatenate the result shards, in unit order, into one file.
+
+    '''
+    outfile = open(name + '.tmp', 'w')
+    for unit in range(unit_count(queue)):
+        infile = open(unit_name(queue, unit, 'out'))
+        for line in infile:
+            outfile.write(line)
+        infile.close()
+    outfile.close()
+    os.rename(name + '.tmp', name)
+
+### END OF MODULE
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_server.py                                                   SCRIPT  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Resident server answering constraint queries on a path library, for       ##
+##  hpRNA_query.py. The library is read once and indexed by edge, as a        ##
+##  bitmap over the paths for every cage edge, so a constraint set is a few   ##
+##  bitmap operations rather than a scan of the file. Requests are one line   ##
+##  of JSON each, over a Unix socket or a localhost port, and are served      ##
+##  concurrently from threads.                                                ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import sys
+import argparse
+import json
+import socket
+import threading
+import time
+import SocketServer
+import StringIO
+import numpy as np
+from hpRNA_generate import read_connectivity
+from hpRNA_cluster import POPCOUNT, edge_codes
+from hpRNA_query import parse_address
+from hpRNA_constrain import (line_with, make_constraints, ms2_classes, ms2_report,
+                             notation, path_file_name, rank_edges, read_paths)
+
+### CONSTANTS
+
+# Paths indexed at once while loading.
+BLOCK = 1 << 16
+
+### FUNCTION DEFINITIONS
+
+class Library(object):
+    '''
+    A path library held in memory: its lines, weights and, for every cage
+    edge, a packed bitmap of the paths that step along it.
+
+    '''
+
+    def __init__(self, infile, connectivity=None):
+        self.name, self.extension = path_file_name(argparse.Namespace(paths=infile))
+        self.connectivity = connectivity
+        rows = [(line.split() + ['1'])[:2] for line in read_paths(infile, connectivity) if line.strip()]
+        self.paths = [path for path, weight in rows]
+        self.marks = [weight for path, weight in rows]
+        self.weights = np.array([float(weight) for path, weight in rows])
+        self.weighted = any(weight != '1' for weight in self.marks)
+        self.moves = None
+        self.classes = None
+        count = len(self.paths)
+
+        present = np.zeros(1 << 16, dtype=bool)
+        for lo in range(0, count, BLOCK):
+            present[edge_codes('\n'.join(self.paths[lo:lo+BLOCK]) + '\n')[0]] = True
+        codes = np.flatnonzero(present)
+        table = np.zeros(1 << 16, dtype=np.int64)
+        table[codes] = np.arange(len(codes))
+        self.edges = {}
+        for k, c in enumerate(codes):
+            self.edges[chr(c >> 8) + chr(c & 255)] = k
+            self.edges[chr(c & 255) + chr(c >> 8)] = k
+        self.codes = codes
+
+        blocks = []
+        for lo in range(0, count, BLOCK):
+            step, line = edge_codes('\n'.join(self.paths[lo:lo+BLOCK]) + '\n')
+            bits = np.zeros((len(codes), min(BLOCK, count - lo)), dtype=bool)
+            bits[table[step], line] = True
+            blocks.append(np.packbits(bits, axis=1))
+        self.bits = np.hstack(blocks) if blocks else np.zeros((len(codes), 0), dtype=np.uint8)
+        self.all = np.packbits(np.ones(count, dtype=bool))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def passing(self, constraints):
+        '''
+        Packed bitmap of the paths passing constraints, as from
+        make_constraints.
+
+        '''
+        mask = self.all.copy()
+        for edge, reverse in constraints[0]:
+            if edge not in self.edges:
+                return np.zeros_like(mask)
+            mask &= self.bits[self.edges[edge]]
+        for edge, reverse in constraints[1]:
+            if edge in self.edges:
+                mask &= ~self.bits[self.edges[edge]]
+        return mask
+
+    def indices(self, mask):
+        return np.flatnonzero(np.unpackbits(mask)[:len(self)])
+
+    def weight(self, mask):
+        if not self.weighted:
+            return float(POPCOUNT[mask].sum())
+        return float(self.weights[self.indices(mask)].sum())
+
+    def occupancy(self, mask):
+        '''
+        Weight of the paths in mask stepping along each edge, in the form
+        given by hpRNA_constrain.edge_occupancy.
+
+        '''
+        steps = np.zeros((256, 256))
+        for k, c in enumerate(self.codes):
+            if self.weighted:
+                steps[c >> 8, c & 255] = self.weight(mask & self.bits[k])
+            else:
+                steps[c >> 8, c & 255] = POPCOUNT[mask & self.bits[k]].sum()
+        return steps
+
+    def lines(self, indices, moves=False):
+        '''
+        Output lines of the paths at indices, or of their moves, keeping
+        their weights.
+
+        '''
+        if moves:
+            return ''.join(line_with(notation(self.paths[k], self.connectivity), self.marks[k]) for k in indices)
+        return ''.join(line_with(self.paths[k], self.marks[k]) for k in indices)
+
+    def ms2_paths(self, indices):
+        '''
+        (moves, positions) pairs of the paths at indices, and ms2_classes of
+        the whole library. Moves are worked out on first use.
+
+        '''
+        if self.moves is None:
+            self.moves = [notation(path, self.connectivity) for path in self.paths]
+            self.classes = ms2_classes(zip(self.moves, self.paths))
+        return [(self.moves[k], self.paths[k]) for k in indices], self.classes
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    '''
+    Answer one request per connection. The request is a JSON object whose
+    'constraints' are (edge, occupied) pairs; it may ask for the passing
+    'paths', their 'moves', a 'recommend' table of that many edges or an
+    'ms2' report, drawn into 'output'. 'stop' shuts the server down.
+
+    '''
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            reply = self.server.answer(request)
+        except Exception, e:
+            reply = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        self.wfile.write(json.dumps(reply) + '\n')
+        # Only shut down once the reply is sent, as the process then exits.
+        if reply.get('stopped'):
+            self.server.shutdown()
+
+
+class Server(object):
+    '''
+    Threaded server for a Library at address.
+
+    '''
+
+    def __init__(self, library, address):
+        family, self.address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            base = SocketServer.ThreadingUnixStreamServer
+        else:
+            base = SocketServer.ThreadingTCPServer
+        base.allow_reuse_address = True
+        self.server = base(self.address, Handler)
+        self.server.daemon_threads = True
+        self.server.answer = self.answer
+        self.family = family
+        self.library = library
+        # Reports are printed by hpRNA_constrain, so are captured one at a time.
+        self.printing = threading.Lock()
+
+    def answer(self, request):
+        began = time.time()
+        library = self.library
+        if request.get('stop'):
+            return {'stopped': True}
+        constraints = make_constraints((str(edge), int(occupied)) for edge, occupied in request.get('constraints', []))
+        mask = library.passing(constraints)
+        reply = {'name': library.name, 'extension': library.extension, 'paths': len(library),
+                 'weight': float(library.weights.sum()), 'passing_weight': library.weight(mask)}
+        reply['passing'] = int(POPCOUNT[mask].sum())
+        if request.get('paths') or request.get('moves') or request.get('ms2'):
+            passing = library.indices(mask)
+        if (request.get('moves') or request.get('ms2')) and library.connectivity is None:
+            raise Exception("the server was started without --connectivity")
+        if request.get('paths'):
+            reply['text'] = library.lines(passing)
+        if request.get('moves'):
+            reply['moves_text'] = library.lines(passing, moves=True)
+        if request.get('recommend') is not None:
+            reply['recommend'] = rank_edges(library.occupancy(mask), reply['passing_weight'], constraints)
+        if request.get('ms2'):
+            ms2_paths, classes = library.ms2_paths(passing)
+            args = argparse.Namespace(output=request['output'], paths=argparse.Namespace(name=library.name + library.extension))
+            with self.printing:
+                report = StringIO.StringIO()
+                stdout, sys.stdout = sys.stdout, report
+                try:
+                    ms2_report(args, classes, ms2_classes(ms2_paths), constraints[0], constraints[1])
+                finally:
+                    sys.stdout = stdout
+            reply['report'] = report.getvalue()
+        reply['seconds'] = time.time() - began
+        return reply
+
+    def serve(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if self.family == socket.AF_UNIX and os.path.exists(self.address):
+                os.remove(self.address)
+
+### MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve constraint queries on a path library held in memory")
+    parser.add_argument("-p", "--paths", help='File PATHS. Path library to serve, in any form hpRNA_constrain.py reads.', type=file, required=True)
+    parser.add_argument("-s", "--socket", help='String SOCKET. Unix socket to listen on, or a port or host:port to listen on over TCP. Default hpRNA.sock.', default='hpRNA.sock')
+    parser.add_argument("-c", "--connectivity", help='File CONNECTIVITY. Neighbor map, needed for move PATHS (.bin) and for --moves and --ms2 queries.', type=file)
+    args = parser.parse_args()
+
+    if args.paths.name.endswith('.zdd'):
+        parser.error("diagram PATHS (.zdd) cannot be served.")
+    if args.paths.name.endswith('.bin') and args.connectivity is None:
+        parser.error("move PATHS (.bin) require --connectivity.")
+
+    began = time.time()
+    connectivity = read_connectivity(args.connectivity) if args.connectivity else None
+    library = Library(args.paths, connectivity)
+    server = Server(library, args.socket)
+    print '%i paths of %s indexed over %i edges in %.2f s, serving on %s' % (len(library), args.paths.name, len(library.codes), time.time() - began, args.socket)
+    sys.stdout.flush()
+    server.serve()
+
+### ENDS
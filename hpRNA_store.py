@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_store.py                                                    MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for keeping the outputs of whole runs (hpRNA_generate.py and       ##
+##  hpRNA_constrain.py --store). A run is addressed by a hash of the          ##
+##  contents of its input files and of the options that change its outputs,   ##
+##  so the same run in another project is answered by linking the kept        ##
+##  outputs into place. Runs are evicted least recently used first.           ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import time
+import shutil
+import hashlib
+
+### CONSTANTS
+
+# Bytes of a file hashed at once.
+READ = 1 << 24
+
+### FUNCTION DEFINITIONS
+
+def file_digest(name):
+    '''
+    SHA1 of the contents of file name.
+
+    '''
+    digest = hashlib.sha1()
+    infile = open(name, 'rb')
+    for block in iter(lambda: infile.read(READ), ''):
+        digest.update(block)
+    infile.close()
+    return digest.hexdigest()
+
+def place(source, target):
+    '''
+    Put file source at target, as a hard link where both are on one file
+    system, otherwise as a copy.
+
+    '''
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class RunStore(object):
+    '''
+    Store of run outputs in directory path, of at most budget bytes. Each run
+    is kept in a directory named by its key. manifest.txt holds one line per
+    run: key, last use, bytes, then each output file name and the hash of its
+    contents. files.txt remembers the hash of each input file by its name,
+    size, modification time, inode and change time, so a large input is read
+    in full only once.
+
+    Outputs are hard links to the store, so a kept run stays valid only while
+    they are replaced rather than rewritten in place. Every output is checked
+    against its hash before it is placed, and a run whose files have changed
+    is dropped.
+
+    '''
+
+    def __init__(self, path, budget):
+        self.path = path
+        self.budget = budget
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.entries = []
+        name = os.path.join(path, 'manifest.txt')
+        if os.path.exists(name):
+            for line in open(name):
+                row = line.rstrip('\n').split('\t')
+                if os.path.isdir(os.path.join(path, row[0])):
+                    self.entries.append([row[0], float(row[1]), int(row[2]), row[3::2], row[4::2]])
+
+    def digest(self, name):
+        '''
+        file_digest of file name, remembered in files.txt.
+
+        '''
+        stat = os.stat(name)
+        key = '%s\t%i\t%r\t%i\t%r' % (os.path.abspath(name), stat.st_size, stat.st_mtime, stat.st_ino, stat.st_ctime)
+        memo = os.path.join(self.path, 'files.txt')
+        known = {}
+        if os.path.exists(memo):
+            for line in open(memo):
+                fields = line.rstrip('\n').split('\t')
+                known['\t'.join(fields[:-1])] = fields[-1]
+        if key not in known:
+            known[key] = file_digest(name)
+            outfile = open(memo + '.%i.tmp' % (os.getpid(),), 'w')
+            for k, digest in sorted(known.items()):
+                outfile.write('%s\t%s\n' % (k, digest))
+            outfile.close()
+            os.rename(memo + '.%i.tmp' % (os.getpid(),), memo)
+        return known[key]
+
+    def key(self, files, options):
+        '''
+        Key of a run reading files, a dictionary of open input files (None
+        where not given) by role, with options, a dictionary of the option
+        values that change its outputs.
+
+        '''
+        digest = hashlib.sha1()
+        for role, infile in sorted(files.items()):
+            if infile is not None:
+                digest.update('%s %s\n' % (role, self.digest(infile.name)))
+        for option, value in sorted(options.items()):
+            digest.update('%s %r\n' % (option, value))
+        return digest.hexdigest()
+
+    def fetch(self, key, output, names):
+        '''
+        Place the outputs names of run key into directory output, if held
+        and unchanged since they were kept. Returns True if they were.
+
+        '''
+        for entry in self.entries:
+            if entry[0] == key and sorted(entry[3]) == sorted(names):
+                break
+        else:
+            return False
+        run = os.path.join(self.path, key)
+        if not all(os.path.exists(os.path.join(run, name)) for name in entry[3]) \
+                or sum(os.path.getsize(os.path.join(run, name)) for name in entry[3]) != entry[2] \
+                or any(file_digest(os.path.join(run, name)) != digest for name, digest in zip(entry[3], entry[4])):
+            self.entries.remove(entry)
+            shutil.rmtree(run, ignore_errors=True)
+            self.save()
+            return False
+        for name in names:
+            place(os.path.join(run, name), os.path.join(output, name))
+        entry[1] = time.time()
+        self.evict(entry)
+        return True
+
+    def keep(self, key, output, names):
+        '''
+        Add the outputs names in directory output as run key, then evict the
+        least recently used runs until the store is within budget.
+
+        '''
+        run = os.path.join(self.path, key)
+        part = run + '.%i.part' % (os.getpid(),)
+        shutil.rmtree(part, ignore_errors=True)
+        os.makedirs(part)
+        for name in names:
+            place(os.path.join(output, name), os.path.join(part, name))
+        shutil.rmtree(run, ignore_errors=True)
+        os.rename(part, run)
+        self.entries = [e for e in self.entries if e[0] != key]
+        entry = [key, time.time(), sum(os.path.getsize(os.path.join(run, name)) for name in names), list(names),
+                 [file_digest(os.path.join(run, name)) for name in names]]
+        self.entries.append(entry)
+        self.evict(entry)
+
+    def produce(self, files, options, output, names, run):
+        '''
+        Outputs names in directory output of the run made by calling run,
+        reading files with options as for key: placed from the store if it
+        holds them, otherwise made by run and kept. Returns True if they came
+        from the store.
+
+        '''
+        key = self.key(files, options)
+        if self.fetch(key, output, names):
+            return True
+        # Outputs linked from an earlier run must not be rewritten in place.
+        for name in names:
+            if os.path.exists(os.path.join(output, name)):
+                os.remove(os.path.join(output, name))
+        run()
+        self.keep(key, output, names)
+        return False
+
+    def evict(self, entry):
+        '''
+        Remove the least recently used runs, other than entry, until the
+        store is within budget, and save the manifest.
+
+        '''
+        self.entries.sort(key=lambda e: e[1])
+        while sum(e[2] for e in self.entries) > self.budget and self.entries[0] is not entry:
+            shutil.rmtree(os.path.join(self.path, self.entries.pop(0)[0]), ignore_errors=True)
+        self.save()
+
+    def save(self):
+        name = os.path.join(self.path, 'manifest.txt')
+        outfile = open(name + '.%i.tmp' % (os.getpid(),), 'w')
+        for key, used, size, names, digests in self.entries:
+            outfile.write('\t'.join([key, repr(used), str(size)] + sum(map(list, zip(names, digests)), [])) + '\n')
+        outfile.close()
+        os.rename(name + '.%i.tmp' % (os.getpid(),), name)
+
+### END OF MODULE
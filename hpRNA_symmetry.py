@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_symmetry.py                                                 SCRIPT  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Tool for finding the symmetries of a polyhedral cage from its             ##
+##  connectivity, and writing them as a DEGENERACY file. Automorphisms are    ##
+##  found by colour refinement and individualisation, as in nauty: only a     ##
+##  few generators are searched for, and the group is built from them.        ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import argparse
+from collections import Counter
+
+### FUNCTION DEFINITIONS
+
+def read_positions(connfile):
+    '''
+    Read a connectivity map as positions in file order, and neighbor lists,
+    in order, by position number.
+
+    '''
+    rows = [line.split() for line in connfile if line.strip()]
+    connfile.close()
+    positions = [row[0] for row in rows]
+    number = dict((p, k) for k, p in enumerate(positions))
+    for row in rows:
+        for p in row[1:]:
+            if p not in number:
+                raise Exception("Neighbor %s of %s has no line in the connectivity file" % (p, row[0]))
+    return positions, [[number[p] for p in row[1:]] for row in rows]
+
+def refine(adjacency, colour):
+    '''
+    Coarsest equitable refinement of colour, a colour number per position:
+    positions keep a colour only while they have the same numbers of
+    neighbors of each colour. New colours are ranks of sorted signatures, so
+    the same partition of an isomorphic cage gets the same colours.
+
+    '''
+    cells = len(set(colour))
+    while True:
+        signature = [(colour[v], tuple(sorted(colour[u] for u in adjacency[v]))) for v in range(len(colour))]
+        rank = dict((s, k) for k, s in enumerate(sorted(set(signature))))
+        colour = [rank[s] for s in signature]
+        if len(rank) == cells:
+            return colour
+        cells = len(rank)
+
+def individualise(adjacency, colour, v):
+    '''
+    Give position v a colour of its own, then refine.
+
+    '''
+    signature = [(c, u == v) for u, c in enumerate(colour)]
+    rank = dict((s, k) for k, s in enumerate(sorted(set(signature))))
+    return refine(adjacency, [rank[s] for s in signature])
+
+def target_cell(colour):
+    '''
+    Colour of the smallest cell with more than one position, lowest colour
+    first, or None if every position has its own colour.
+
+    '''
+    sizes = Counter(colour)
+    cells = [(n, c) for c, n in sizes.items() if n > 1]
+    return min(cells)[1] if cells else None
+
+def orbits(n, generators):
+    '''
+    Orbit number of each of n positions under generators.
+
+    '''
+    orbit = range(n)
+    def find(v):
+        while orbit[v] != v:
+            orbit[v] = orbit[orbit[v]]
+            v = orbit[v]
+        return v
+    for g in generators:
+        for v in range(n):
+            a, b = find(v), find(g[v])
+            if a != b:
+                orbit[max(a, b)] = min(a, b)
+    return [find(v) for v in range(n)]
+
+def automorphism_generators(adjacency):
+    '''
+    Generators of the automorphism group of the cage, as lists of the image
+    of each position, and the order of the group. A reference path of
+    individualised positions is refined down to a discrete colouring; at
+    each step, from the deepest, one automorphism is searched for to each
+    position of the step's cell not already in the orbit of the reference
+    position, so the search touches each orbit once rather than each group
+    element. The generators found from a step on fix the positions
+    individualised before it, so the order is the product of the orbit
+    sizes of the reference positions under them.
+
+    '''
+    n = len(adjacency)
+    edges = set((a, b) for a in range(n) for b in adjacency[a])
+
+    path = []
+    colour = refine(adjacency, [0] * n)
+    while target_cell(colour) is not None:
+        cell = target_cell(colour)
+        v = colour.index(cell)
+        path.append((colour, sorted(Counter(colour).items()), cell, v))
+        colour = individualise(adjacency, colour, v)
+    leaf = [0] * n
+    for v, c in enumerate(colour):
+        leaf[c] = v
+
+    def search(level, colour):
+        # First automorphism mapping the reference path below level onto
+        # colour, which matches it above level.
+        if level == len(path):
+            g = [0] * n
+            for w, c in enumerate(colour):
+                g[leaf[c]] = w
+            if all((g[a], g[b]) in edges for a, b in edges):
+                return g
+            return None
+        if sorted(Counter(colour).items()) != path[level][1]:
+            return None
+        for w in [u for u, c in enumerate(colour) if c == path[level][2]]:
+            g = search(level + 1, individualise(adjacency, colour, w))
+            if g is not None:
+                return g
+        return None
+
+    generators = []
+    order = 1
+    for level in range(len(path) - 1, -1, -1):
+        colour, sizes, cell, v = path[level]
+        orbit = orbits(n, generators)
+        tried = set([v])
+        for w in [u for u, c in enumerate(colour) if c == cell]:
+            if orbit[w] in set(orbit[u] for u in tried):
+                continue
+            tried.add(w)
+            g = search(level + 1, individualise(adjacency, colour, w))
+            if g is not None:
+                generators.append(g)
+                orbit = orbits(n, generators)
+        order *= orbit.count(orbit[v])
+    return generators, order
+
+def transversal(generators, n, v=0):
+    '''
+    One element of the group generated by generators taking position v to
+    each position of its orbit, by position, found by a breadth-first search
+    over the generators from the identity.
+
+    '''
+    found = {v: tuple(range(n))}
+    reached = [v]
+    for u in reached:
+        for h in generators:
+            if h[u] not in found:
+                found[h[u]] = tuple(h[w] for w in found[u])
+                reached.append(h[u])
+    return found
+
+def ordered_maps(neighbors):
+    '''
+    The symmetries keeping the order of neighbors (see preserves_order), by
+    image of the first position. Each is fixed by that image, as the image
+    of every neighbor follows from its column, so they are found without
+    the rest of the group. None if the cage is not connected, when they
+    are not.
+
+    '''
+    n = len(neighbors)
+    maps = {}
+    for u in range(n):
+        g = [None] * n
+        g[0] = u
+        reached = [0]
+        fits = True
+        for v in reached:
+            if len(neighbors[v]) != len(neighbors[g[v]]):
+                fits = False
+                break
+            for a, b in zip(neighbors[v], neighbors[g[v]]):
+                if g[a] is None:
+                    g[a] = b
+                    reached.append(a)
+                elif g[a] != b:
+                    fits = False
+                    break
+            if not fits:
+                break
+        if len(reached) < n and fits:
+            return None
+        if fits and len(set(g)) == n and preserves_order(g, neighbors):
+            maps[u] = tuple(g)
+    return maps
+
+def group(generators, n):
+    '''
+    Every element of the group generated by generators, identity first.
+
+    '''
+    identity = tuple(range(n))
+    elements = [identity]
+    seen = set(elements)
+    for g in elements:
+        for h in generators:
+            gh = tuple(h[v] for v in g)
+            if gh not in seen:
+                seen.add(gh)
+                elements.append(gh)
+    return elements
+
+def preserves_order(g, neighbors):
+    '''
+    True if g takes the k-th neighbor of every position to the k-th neighbor
+    of its image, so moves keep their numbers in notation.
+
+    '''
+    return all([g[u] for u in neighbors[v]] == neighbors[g[v]] for v in range(len(neighbors)))
+
+def symmetries(positions, neighbors, ordered=False, every=False):
+    '''
+    Rows of a DEGENERACY file for the cage: the positions, then their images
+    under each symmetry, and the order of the automorphism group. DEGENERACY
+    files are read by first position, so unless every, only one symmetry is
+    kept for each image of the first position, preferring one that keeps the
+    order of neighbors. With ordered, only those symmetries are used. The
+    whole group is only listed for every, or for ordered on a cage that is
+    not connected; otherwise the rows come from the generators.
+
+    '''
+    n = len(positions)
+    adjacency = [set(neighbors[v]) for v in range(n)]
+    for v in range(n):
+        for u in neighbors[v]:
+            adjacency[u].add(v)
+    generators, order = automorphism_generators([sorted(a) for a in adjacency])
+    maps = None if every else ordered_maps(neighbors)
+    if maps is None:
+        elements = group(generators, n)
+        elements.sort(key=lambda g: (g[0], not preserves_order(g, neighbors), g))
+        rows = []
+        first = set()
+        for g in elements:
+            if ordered and not preserves_order(g, neighbors):
+                continue
+            if every or g[0] not in first:
+                first.add(g[0])
+                rows.append([positions[g[v]] for v in range(n)])
+        return rows, order
+    if not ordered:
+        for u, g in transversal(generators, n).items():
+            maps.setdefault(u, g)
+    return [[positions[g[v]] for v in range(n)] for u, g in sorted(maps.items())], order
+
+### MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the symmetries of a polyhedral cage and write them as a DEGENERACY file")
+    parser.add_argument("-c", "--connectivity", help='File CONNECTIVITY. Neighbor map of the cage, as for hpRNA_generate.py.', type=file, required=True)
+    parser.add_argument("-o", "--output", help='Directory OUTPUT. Choose output directory, for degeneracy.txt. Default \'symmetry\'.', default='symmetry')
+    parser.add_argument("--ordered", help='Option. Only keep symmetries taking each column of CONNECTIVITY to the same column, so that moves keep their numbers in the notation of hpRNA_constrain.py. For the MS2 connectivity these are the 60 rotations.', action="store_true")
+    parser.add_argument("--all", help='Option. Write every symmetry, rather than one for each first position as read by --degeneracy.', action="store_true")
+    args = parser.parse_args()
+
+    positions, neighbors = read_positions(args.connectivity)
+    rows, size = symmetries(positions, neighbors, args.ordered, args.all)
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    outfile = open(os.path.join(args.output, 'degeneracy.txt'), 'w')
+    for row in rows:
+        outfile.write(' '.join(row) + '\n')
+    outfile.close()
+
+    print 'Automorphism group of order %i' % (size,)
+    print '%i symmetries written to %s' % (len(rows), os.path.join(args.output, 'degeneracy.txt'))
+    if len(set(row[0] for row in rows)) < len(positions):
+        print 'WARNING: not every position is the image of %s; paths starting elsewhere cannot be reworked' % (positions[0],)
+
+### ENDS
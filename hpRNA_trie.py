@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_trie.py                                                     MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for generation levels stored as a trie (hpRNA_generate.py          ##
+##  --trie). Each path of a level is a record of the path it extends in the   ##
+##  level before and the position it moves to, so a level costs a few bytes   ##
+##  per path however long the paths are. Paths are rebuilt in blocks by       ##
+##  following the records back to a text level.                               ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import numpy as np
+from hpRNA_io import read_file
+
+### CONSTANTS
+
+# One path: index of its parent in the level before, and its last position.
+RECORD = np.dtype([('parent', '<u4'), ('move', 'S1')])
+
+# Paths rebuilt at once.
+BLOCK = 1 << 16
+
+### FUNCTION DEFINITIONS
+
+def level_name(output, level):
+    return os.path.join(output, 'paths_%02i.trie' % (level,))
+
+def text_level(output, level):
+    '''
+    Length and name of the text level that trie level hangs from: the
+    nearest level, no longer, written as text, such as the starts.
+
+    '''
+    for l in range(level, 0, -1):
+        for suffix in ('.txt', '.txt.gz'):
+            name = os.path.join(output, 'paths_%02i' % (l,) + suffix)
+            if os.path.exists(name) and not os.path.exists(level_name(output, l)):
+                return l, name
+    raise Exception("No text level below %s" % (level_name(output, level),))
+
+def read_records(name):
+    '''
+    Records of a trie level, mapped from the file rather than read.
+
+    '''
+    if os.path.getsize(name) == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(name, dtype=RECORD, mode='r')
+
+def records(parents, moves):
+    '''
+    Records, as a string to write to a trie level, for paths extending the
+    given parent indices by the given positions.
+
+    '''
+    out = np.empty(len(parents), dtype=RECORD)
+    out['parent'] = parents
+    out['move'] = moves
+    return out.tostring()
+
+
+class Trie(object):
+    '''
+    Paths of trie level length level in output, and of the levels below it
+    down to their text level. Levels are held as arrays of path rows, one
+    byte per position.
+
+    '''
+
+    def __init__(self, output, level):
+        self.root, name = text_level(output, level)
+        self.level = level
+        infile = read_file(name)
+        text = infile.read()
+        infile.close()
+        if not text.endswith('\n'):
+            text += '\n'
+        self.base = np.frombuffer(text, dtype=np.uint8).reshape(-1, self.root + 1)[:, :-1]
+        self.levels = {}
+        for l in range(self.root + 1, level + 1):
+            self.levels[l] = read_records(level_name(output, l))
+
+    def count(self, level=None):
+        '''
+        Number of paths in a level, by default the top one.
+
+        '''
+        level = level or self.level
+        if level == self.root:
+            return len(self.base)
+        return len(self.levels[level])
+
+    def rows(self, level, lo, hi):
+        '''
+        Paths lo to hi of a level as rows. Parents of consecutive paths are
+        consecutive, so only the block of parents they extend is rebuilt.
+
+        '''
+        if level == self.root:
+            return self.base[lo:hi]
+        rec = self.levels[level][lo:hi]
+        out = np.empty((len(rec), level), dtype=np.uint8)
+        if len(rec):
+            parent = rec['parent'].astype(np.int64)
+            out[:, :-1] = self.rows(level - 1, parent[0], parent[-1] + 1).take(parent - parent[0], axis=0)
+            out[:, -1] = np.frombuffer(rec['move'].tostring(), dtype=np.uint8)
+        return out
+
+    def lines(self, level, lo, hi):
+        '''
+        Paths lo to hi of a level as text, one path to a line.
+
+        '''
+        rows = self.rows(level, lo, hi)
+        out = np.empty((len(rows), level + 1), dtype=np.uint8)
+        out[:, :-1] = rows
+        out[:, -1] = 10
+        return out.tostring()
+
+    def blocks(self, level=None, size=BLOCK):
+        '''
+        Iterate over a level, by default the top one, as text in blocks of
+        size paths.
+
+        '''
+        level = level or self.level
+        count = self.count(level)
+        for lo in range(0, count, size):
+            yield self.lines(level, lo, min(lo + size, count))
+
+### END OF MODULE
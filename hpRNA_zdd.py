@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  hpRNA_zdd.py                                                      MODULE  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Module for holding a library of connected paths on a polyhedral cage as   ##
+##  a zero-suppressed decision diagram (ZDD) over the edges of the cage.      ##
+##  Paths are built with the frontier-based (simpath) construction, and can   ##
+##  be counted, sampled and constrained without being written out.            ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import random
+
+### CONSTANTS
+
+# Mate of the loose end of the fragment growing from the start, when no END is
+# given and the path may finish anywhere.
+FREE = '*'
+
+### FUNCTION DEFINITIONS
+
+def edge_order(connectivity, first):
+    '''
+    Order the edges of the cage breadth-first from position first, which keeps
+    the frontier of the construction narrow.
+
+    '''
+    order = [first]
+    seen = set(order)
+    q = 0
+    while q < len(order):
+        for b in connectivity[order[q]]:
+            if b not in seen:
+                seen.add(b)
+                order.append(b)
+        q += 1
+    order += sorted(p for p in connectivity if p not in seen)
+    rank = dict((p, n) for n, p in enumerate(order))
+
+    edges = set()
+    for a in connectivity:
+        for b in connectivity[a]:
+            edges.add(tuple(sorted((a, b), key=rank.get)))
+    return sorted(edges, key=lambda e: (rank[e[0]], rank[e[1]]))
+
+
+class ZDD(object):
+    '''
+    Shared node table for one or more path diagrams over the same edge order.
+    Node 0 is the empty family, node 1 the family holding only the empty set,
+    and every other node is a (level, lo, hi) triple where level indexes the
+    edge decided at that node. Children always have smaller ids than their
+    parents. Each root is stored with the start and end it was built for.
+
+    '''
+
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self.index = {}
+        for n, (a, b) in enumerate(self.edges):
+            self.index[a+b] = n
+            self.index[b+a] = n
+        self.nodes = [None, None]
+        self.unique = {}
+        self.counts = [0, 1]
+        self.roots = []
+
+    def node(self, level, lo, hi):
+        '''
+        Return the node for (level, lo, hi), applying the zero-suppression rule
+        and sharing identical nodes.
+
+        '''
+        if hi == 0:
+            return lo
+        key = (level, lo, hi)
+        n = self.unique.get(key)
+        if n is None:
+            n = len(self.nodes)
+            self.nodes.append(key)
+            self.unique[key] = n
+        return n
+
+    def level(self, n):
+        if n < 2:
+            return len(self.edges)
+        return self.nodes[n][0]
+
+    def build(self, connectivity, start, end=None, length=None):
+        '''
+        Add a root for all paths beginning with start and, if given, finishing
+        with end. Paths visit every position unless length is given. Edges of
+        start and end are forced into every path.
+
+        '''
+        edges = self.edges
+        m = len(edges)
+        s = start[0]
+        t = end[-1] if end else None
+        forced = set(self.index[a+b] for p in (start, end or '') for a, b in zip(p[:-1], p[1:]))
+        target = length - 1 if length else None
+
+        first = {}
+        last = {}
+        for n, (a, b) in enumerate(edges):
+            for p in (a, b):
+                first.setdefault(p, n)
+                last[p] = n
+        if s not in last or (t is not None and (t not in last or t == s)):
+            self.roots.append((start, end or '', 0))
+            return 0
+        allseen = max(first.get(p, m) for p in connectivity)
+        lastforced = max(forced) if forced else -1
+
+        ends = set([s, t]) if t is not None else set([s])
+        active = []
+        for i in range(m + 1):
+            active.append(sorted(p for p in last if (first[p] <= i <= last[p]) or (p in ends and i <= last[p])))
+        leaving = [[] for i in range(m)]
+        for p, n in last.items():
+            leaving[n].append(p)
+
+        mate = dict((p, p) for p in active[0])
+        if t is None:
+            mate[s] = FREE
+        else:
+            mate[s] = t
+            mate[t] = s
+        initial = tuple(mate[p] for p in active[0]) + (0,)
+
+        def complete(mate, skip, count, i):
+            # Everything left on the frontier is finished and nothing is owed.
+            if i < lastforced:
+                return False
+            if target is None:
+                if i < allseen:
+                    return False
+                return all(mate[p] is None for p in mate if p not in skip)
+            if count != target:
+                return False
+            return all(mate[p] is None or mate[p] == p for p in mate if p not in skip)
+
+        levels = []
+        current = set([initial])
+        for i in range(m):
+            u, v = edges[i]
+            level = {}
+            following = set()
+            for state in current:
+                count = state[-1]
+                children = []
+                for branch in (0, 1):
+                    mate = dict(zip(active[i], state))
+                    child = None
+                    if branch == 0:
+                        if i in forced:
+                            child = 0
+                    else:
+                        mu, mv = mate[u], mate[v]
+                        if mu is None or mv is None:
+                            child = 0
+                        elif mu == v:
+                            if FREE not in mate.values() and complete(mate, (u, v), count + 1, i):
+                                child = 1
+                            else:
+                                child = 0
+                        elif target is not None and count + 1 > target:
+                            child = 0
+                        else:
+                            if mu != FREE:
+                                mate[mu] = mv
+                            if mv != FREE:
+                                mate[mv] = mu
+                            if mu != u:
+                                mate[u] = None
+                            if mv != v:
+                                mate[v] = None
+                            count += 1
+                    if child is None:
+                        for p in leaving[i]:
+                            val = mate[p]
+                            if val is None or (val == p and target is not None):
+                                continue
+                            if val == FREE:
+                                # The fragment from the start ends here.
+                                if p != s and complete(mate, (p,), count, i):
+                                    child = 1
+                                else:
+                                    child = 0
+                                break
+                            if val != p and FREE in mate.values():
+                                # The path ends here, so this fragment will be
+                                # joined to the one growing from the start.
+                                y = [q for q in mate if mate[q] == FREE][0]
+                                mate[y] = val
+                                mate[val] = y
+                                mate[p] = None
+                                continue
+                            child = 0
+                            break
+                    if child is None:
+                        if i + 1 == m:
+                            child = 0
+                        else:
+                            child = tuple(mate.get(p, p) for p in active[i+1]) + (count,)
+                            following.add(child)
+                    children.append(child)
+                    count = state[-1]
+                level[state] = children
+            levels.append(level)
+            current = following
+
+        ids = {}
+        for i in range(m - 1, -1, -1):
+            newids = {}
+            for state, (lo, hi) in levels[i].items():
+                lo = lo if isinstance(lo, int) else ids[lo]
+                hi = hi if isinstance(hi, int) else ids[hi]
+                newids[state] = self.node(i, lo, hi)
+            ids = newids
+        root = ids.get(initial, 0)
+        self.roots.append((start, end or '', root))
+        return root
+
+    def count(self, n):
+        '''
+        Number of paths in the family at node n.
+
+        '''
+        counts = self.counts
+        for k in range(len(counts), len(self.nodes)):
+            level, lo, hi = self.nodes[k]
+            counts.append(counts[lo] + counts[hi])
+        return counts[n]
+
+    def restrict(self, n, level, occupied, memo=None):
+        '''
+        Keep only the paths at node n that use (occupied) or avoid (not
+        occupied) the edge at level. Costs time in the size of the diagram.
+
+        '''
+        if memo is None:
+            memo = {}
+        if self.level(n) > level:
+            return 0 if occupied else n
+        if n in memo:
+            return memo[n]
+        l, lo, hi = self.nodes[n]
+        if l == level:
+            r = self.node(l, 0, hi) if occupied else lo
+        else:
+            r = self.node(l, self.restrict(lo, level, occupied, memo), self.restrict(hi, level, occupied, memo))
+        memo[n] = r
+        return r
+
+    def constrain(self, constrain_occ, constrain_unocc):
+        '''
+        Apply occupied and unoccupied edge constraints, in the same form as
+        hpRNA_constrain.constrain builds them, to every root.
+
+        '''
+        rules = [(self.index[e[0]], True) for e in constrain_occ]
+        rules += [(self.index[e[0]], False) for e in constrain_unocc]
+        roots = []
+        for start, end, n in self.roots:
+            for level, occupied in rules:
+                n = self.restrict(n, level, occupied)
+            roots.append((start, end, n))
+        self.roots = roots
+
+    def sample(self, n, rng=random):
+        '''
+        Draw one path uniformly from the family at node n, as edge levels.
+
+        '''
+        self.count(n)
+        chosen = []
+        while n > 1:
+            level, lo, hi = self.nodes[n]
+            if rng.randrange(self.counts[n]) < self.counts[hi]:
+                chosen.append(level)
+                n = hi
+            else:
+                n = lo
+        return chosen
+
+    def iter_sets(self, n):
+        '''
+        Iterate over every path in the family at node n, as edge levels.
+
+        '''
+        stack = [(n, [])]
+        while stack:
+            n, chosen = stack.pop()
+            if n == 1:
+                yield chosen
+            elif n > 1:
+                level, lo, hi = self.nodes[n]
+                stack.append((lo, chosen))
+                stack.append((hi, chosen + [level]))
+
+    def to_path(self, chosen, start):
+        '''
+        Walk a set of edge levels from the first position of start, returning
+        the path in position notation.
+
+        '''
+        adjacent = {}
+        for level in chosen:
+            a, b = self.edges[level]
+            adjacent.setdefault(a, []).append(b)
+            adjacent.setdefault(b, []).append(a)
+        path = [start[0]]
+        previous = None
+        while True:
+            onward = [p for p in adjacent.get(path[-1], []) if p != previous]
+            if not onward:
+                break
+            previous = path[-1]
+            path.append(onward[0])
+        return ''.join(path)
+
+    def total(self):
+        return sum(self.count(n) for start, end, n in self.roots)
+
+    def save(self, name):
+        '''
+        Write the edge order, roots and reachable nodes to a text file.
+
+        '''
+        reach = set()
+        stack = [n for start, end, n in self.roots]
+        while stack:
+            n = stack.pop()
+            if n > 1 and n not in reach:
+                reach.add(n)
+                stack.extend(self.nodes[n][1:])
+        renumber = {0: 0, 1: 1}
+        for n in sorted(reach):
+            renumber[n] = len(renumber)
+
+        outfile = open(name, 'w')
+        outfile.write('edges ' + ' '.join(a+b for a, b in self.edges) + '\n')
+        for start, end, n in self.roots:
+            outfile.write('root %s %s %i\n' % (start, end or '-', renumber[n]))
+        for n in sorted(reach):
+            level, lo, hi = self.nodes[n]
+            outfile.write('node %i %i %i\n' % (level, renumber[lo], renumber[hi]))
+        outfile.close()
+
+
+def load(zddfile):
+    '''
+    Read a diagram written by ZDD.save.
+
+    '''
+    zdd = None
+    for line in zddfile:
+        line = line.strip().split()
+        if not line:
+            continue
+        if line[0] == 'edges':
+            zdd = ZDD((e[0], e[1]) for e in line[1:])
+        elif line[0] == 'root':
+            zdd.roots.append((line[1], '' if line[2] == '-' else line[2], int(line[3])))
+        elif line[0] == 'node':
+            zdd.node(int(line[1]), int(line[2]), int(line[3]))
+    zddfile.close()
+    return zdd
+
+### END OF MODULE
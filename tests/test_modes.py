@@ -0,0 +1,703 @@
+#!/usr/bin/env python
+################################################################################
+##                                                                            ##
+##  test_modes.py                                                     SCRIPT  ##
+##  ------------------------------------------------------------------------  ##
+##                                                                            ##
+##  v. 15/01/2015                                                             ##
+##                                                                            ##
+##  James Geraets, University of York                                         ##
+##  jg923@york.ac.uk                                                          ##
+##                                                                            ##
+##  Regression checks for the generation and constraint modes. Each mode is   ##
+##  run on the examples and its paths compared with those of the plain        ##
+##  level-by-level generator, or of a plain hpRNA_constrain.py run. Run       ##
+##  from the repository with: python -m unittest discover tests               ##
+##                                                                            ##
+##  (C) University of York 2014                                               ##
+##                                                                            ##
+################################################################################
+
+### MODULE IMPORTS
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+import subprocess
+
+### CONSTANTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+### FUNCTION DEFINITIONS
+
+def example(number, name):
+    return os.path.join(ROOT, 'example_%i' % (number,), name)
+
+def read_lines(name):
+    '''
+    Lines of a path file, without weights or line ends.
+
+    '''
+    return [line.split()[0] for line in open(name) if line.strip()]
+
+
+class ModeTest(unittest.TestCase):
+    '''
+    Base for tests running the scripts in a scratch directory.
+
+    '''
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix='hpRNA_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def path(self, *names):
+        return os.path.join(self.scratch, *names)
+
+    def write(self, name, text):
+        outfile = open(self.path(name), 'w')
+        outfile.write(text)
+        outfile.close()
+        return self.path(name)
+
+    def run_script(self, script, *arguments):
+        '''
+        Run script with arguments, failing the test if it fails, and return
+        what it printed.
+
+        '''
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, script)] + list(arguments),
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.scratch)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0, '%s %s failed:\n%s' % (script, ' '.join(arguments), output))
+        return output
+
+    def assertPaths(self, found, expected):
+        '''
+        Fail unless the lists of paths found and expected are the same,
+        without the slow difference of long lists given by assertEqual.
+
+        '''
+        if found != expected:
+            extra = sorted(set(found) - set(expected))[:3]
+            missing = sorted(set(expected) - set(found))[:3]
+            self.fail('%i paths where %i expected; extra %r, missing %r' % (len(found), len(expected), extra, missing))
+
+    def generate(self, output, *arguments):
+        '''
+        Lines of paths_out.txt from hpRNA_generate.py into scratch directory
+        output.
+
+        '''
+        self.run_script('hpRNA_generate.py', '-o', self.path(output), *arguments)
+        return read_lines(self.path(output, 'paths_out.txt'))
+
+
+class FirstTest(ModeTest):
+    '''
+    hpRNA_generate.py --first.
+
+    '''
+
+    def test_multiple_lengths(self):
+        # A Hamiltonian LENGTH must not prune the completions of a shorter one.
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt'), '-l', self.write('length.txt', '8\n20\n')]
+        plain = self.generate('plain', *inputs)
+        self.run_script('hpRNA_generate.py', '-o', self.path('first'), '--first', '1000000', *inputs)
+        self.assertPaths(sorted(read_lines(self.path('first', 'paths_first.txt'))), sorted(plain))
+        counted = self.run_script('hpRNA_generate.py', '-o', self.path('count'), '--count', *inputs)
+        self.assertIn('%i paths counted' % (len(plain),), counted)
+
+
+class ResumeTest(ModeTest):
+    '''
+    hpRNA_generate.py --iteration.
+
+    '''
+
+    def test_unrecorded_level(self):
+        # Levels written before the manifest are resumed from as they stand.
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt')]
+        plain = self.generate('plain', *inputs)
+        os.makedirs(self.path('resumed'))
+        shutil.copy(example(3, 'paths_13.txt'), self.path('resumed'))
+        self.assertPaths(self.generate('resumed', '-i', '13', *inputs), plain)
+
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'hpRNA_generate.py'), '-o', self.path('resumed'), '-i', '9'] + inputs,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 2)
+        self.assertIn('paths_09.txt is not a completed level', output)
+        self.assertNotIn('Traceback', output)
+
+
+class LibraryTest(ModeTest):
+    '''
+    The iterators of library use.
+
+    '''
+
+    def test_iter_paths(self):
+        from hpRNA_generate import read_connectivity, read_rules, iter_paths
+        length = self.write('length.txt', '8\n20\n')
+        plain = self.generate('plain', '-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt'), '-l', length)
+        connectivity = read_connectivity(open(example(3, 'connectivity.txt')))
+        self.assertPaths(sorted(iter_paths(connectivity, ['ab'], lengths=[8, 20])), sorted(plain))
+
+        plain = self.generate('rules', '-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'),
+                              '-l', example(2, 'length.txt'), '-r', example(2, 'require.txt'))
+        connectivity = read_connectivity(open(example(2, 'connectivity.txt')))
+        require = read_rules(open(example(2, 'require.txt')))
+        self.assertPaths(sorted(iter_paths(connectivity, ['ad'], lengths=[12, 8], require=require)), sorted(plain))
+
+
+class MovesTest(ModeTest):
+    '''
+    hpRNA_generate.py --moves.
+
+    '''
+
+    def test_words(self):
+        # Every plain path is read back from the words exactly once, whether
+        # or not the mirror and reverse maps are symmetries of the cage.
+        from hpRNA_generate import read_connectivity, read_moves
+        from hpRNA_constrain import read_paths
+        start = self.write('start.txt', 'a\n')
+        for cage, lengths, compact in [(3, '8\n20\n', False), (1, '12\n', True)]:
+            inputs = ['-c', example(cage, 'connectivity.txt'), '-s', start, '-l', self.write('length.txt', lengths)]
+            plain = self.generate('plain_%i' % (cage,), *inputs)
+            self.run_script('hpRNA_generate.py', '-o', self.path('moves_%i' % (cage,)), '--moves', *inputs)
+            connectivity = read_connectivity(open(example(cage, 'connectivity.txt')))
+            movefile = self.path('moves_%i' % (cage,), 'moves_out.bin')
+            decoded = [line.strip() for line in read_paths(open(movefile, 'rb'), connectivity)]
+            self.assertPaths(sorted(decoded), sorted(plain))
+            if compact:
+                # On the MS2 cage the maps hold, so words stand for classes.
+                self.assertTrue(len(list(read_moves(open(movefile, 'rb'))[1])) < len(plain) / 3)
+
+
+class QueueTest(ModeTest):
+    '''
+    hpRNA_generate.py --coordinator and --worker, and the leases of
+    hpRNA_queue.
+
+    '''
+
+    def test_workers(self):
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt'), '-l', self.write('length.txt', '8\n20\n')]
+        plain = self.generate('plain', *inputs)
+        queue = ['--queue', self.path('queue'), '--unit', '3']
+        command = [sys.executable, os.path.join(ROOT, 'hpRNA_generate.py')] + inputs
+        coordinator = subprocess.Popen(command + ['-o', self.path('coordinator'), '--coordinator', '5'] + queue,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        workers = [subprocess.Popen(command + ['-o', self.path('worker%i' % (k,)), '--worker'] + queue,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT) for k in range(2)]
+        for process in workers + [coordinator]:
+            output = process.communicate()[0]
+            self.assertEqual(process.returncode, 0, output)
+        self.assertPaths(sorted(read_lines(self.path('coordinator', 'paths_out.txt'))), sorted(plain))
+
+    def test_leases(self):
+        import hpRNA_queue
+        hpRNA_queue.write_units(self.path('queue'), ['ab'], 1)
+        worker_id = hpRNA_queue.worker_id
+        try:
+            hpRNA_queue.worker_id = lambda: 'one'
+            self.assertTrue(hpRNA_queue.lease(self.path('queue'), 0, 60))
+            shardfile = hpRNA_queue.shard(self.path('queue'), 0)
+            hpRNA_queue.worker_id = lambda: 'two'
+            self.assertFalse(hpRNA_queue.lease(self.path('queue'), 0, 60))
+            # Once expired, the lease passes to another worker.
+            name = hpRNA_queue.unit_name(self.path('queue'), 0, 'lease')
+            os.utime(name, (time.time() - 120, time.time() - 120))
+            self.assertTrue(hpRNA_queue.lease(self.path('queue'), 0, 60))
+            hpRNA_queue.worker_id = lambda: 'one'
+            self.assertFalse(hpRNA_queue.renew(self.path('queue'), 0))
+            self.assertFalse(hpRNA_queue.finish(self.path('queue'), 0, shardfile))
+            self.assertEqual(hpRNA_queue.pending(self.path('queue')), [0])
+            hpRNA_queue.release(self.path('queue'), 0)
+            self.assertEqual(hpRNA_queue.holder(name), 'two')
+        finally:
+            hpRNA_queue.worker_id = worker_id
+
+    def test_renewal(self):
+        # A lease is kept alive while no paths are being written.
+        import hpRNA_queue
+        hpRNA_queue.write_units(self.path('queue'), ['ab'], 1)
+        self.assertTrue(hpRNA_queue.lease(self.path('queue'), 0, 60))
+        name = hpRNA_queue.unit_name(self.path('queue'), 0, 'lease')
+        os.utime(name, (time.time() - 120, time.time() - 120))
+        renewal = hpRNA_queue.Renewal(self.path('queue'), 0, 0.05)
+        time.sleep(0.3)
+        renewal.stop()
+        self.assertLess(time.time() - os.path.getmtime(name), 60)
+        self.assertFalse(renewal.lost)
+
+
+class CacheTest(ModeTest):
+    '''
+    hpRNA_constrain.py --cache.
+
+    '''
+
+    def constrain(self, output, *options):
+        self.run_script('hpRNA_constrain.py', '-p', self.path('paths.txt'), '-x', example(6, 'constrain.txt'),
+                        '-o', self.path(output), *options)
+        return read_lines(self.path(output, 'paths_constrained.txt'))
+
+    def test_rewritten_library(self):
+        lines = open(example(6, 'paths_out_realized.txt')).readlines()
+        self.write('paths.txt', ''.join(lines))
+        plain = self.constrain('plain')
+        cache = ['--cache', self.path('cache')]
+        self.assertPaths(self.constrain('first', *cache), plain)
+        self.assertPaths(self.constrain('second', *cache), plain)
+        # The same size, rewritten at once: the cached result no longer holds.
+        self.write('paths.txt', ''.join(reversed(lines)))
+        plain = self.constrain('reversed')
+        self.assertPaths(self.constrain('third', *cache), plain)
+
+
+class StoreTest(ModeTest):
+    '''
+    hpRNA_generate.py and hpRNA_constrain.py --store.
+
+    '''
+
+    def test_generate(self):
+        inputs = ['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt'),
+                  '-r', example(2, 'require.txt')]
+        plain = self.generate('plain', *inputs)
+        store = ['--store', self.path('store')]
+        self.assertPaths(self.generate('first', *(inputs + store)), plain)
+        self.assertIn('taken from', self.run_script('hpRNA_generate.py', '-o', self.path('second'), *(inputs + store)))
+        self.assertPaths(read_lines(self.path('second', 'paths_out.txt')), plain)
+
+    def test_realize_rewritten(self):
+        # A plain run into the same OUTPUT must not change the kept run.
+        frames = open(example(5, 'realize.txt')).read().split()
+        one = self.write('one.txt', '\n'.join(frames[:20]) + '\n')
+        two = self.write('two.txt', '\n'.join(frames[-20:]) + '\n')
+        def realize(realize, output, *options):
+            self.run_script('hpRNA_constrain.py', '-p', example(5, 'paths_out.txt'), '-d', example(5, 'degeneracy.txt'),
+                            '-r', realize, '-o', self.path(output), *options)
+            return read_lines(self.path(output, 'paths_out_realized.txt'))
+        plain = realize(one, 'plain')
+        self.assertPaths(realize(one, 'shared', '--store', self.path('store')), plain)
+        self.assertNotEqual(realize(two, 'shared'), plain)
+        self.assertPaths(realize(one, 'again', '--store', self.path('store')), plain)
+        # A kept file changed in place, at the same size, is not served.
+        for name in os.listdir(self.path('store')):
+            if os.path.isdir(self.path('store', name)):
+                kept = open(self.path('store', name, 'paths_out_realized.txt'), 'r+b')
+                kept.write('z')
+                kept.close()
+        self.assertPaths(realize(one, 'last', '--store', self.path('store')), plain)
+
+
+class SymmetryTest(ModeTest):
+    '''
+    hpRNA_symmetry.py, from generators against the whole group of --all.
+
+    '''
+
+    def symmetries(self, connectivity, output, *options):
+        printed = self.run_script('hpRNA_symmetry.py', '-c', connectivity, '-o', self.path(output), *options)
+        return printed, read_lines(self.path(output, 'degeneracy.txt'))
+
+    def test_rows(self):
+        cube = self.write('cube.txt', ''.join('v%i %s\n' % (v, ' '.join('v%i' % (v ^ 1 << k,) for k in range(5)))
+                                              for v in range(32)))
+        for connectivity in [example(2, 'connectivity.txt'), example(3, 'connectivity.txt'), cube]:
+            printed, every = self.symmetries(connectivity, 'all', '--all')
+            self.assertIn('Automorphism group of order %i' % (len(every),), printed)
+            for options in [(), ('--ordered',)]:
+                printed, rows = self.symmetries(connectivity, 'some', *options)
+                self.assertIn('Automorphism group of order %i' % (len(every),), printed)
+                self.assertTrue(set(rows) <= set(every))
+                self.assertEqual(len(set(row.split()[0] for row in rows)), len(rows))
+            self.assertEqual(len(rows), len(self.symmetries(connectivity, 'ordered', '--all', '--ordered')[1]))
+        self.assertEqual(len(every), 3840)
+
+
+class CountTest(ModeTest):
+    '''
+    hpRNA_generate.py --count.
+
+    '''
+
+    def counts(self, output, plain, *inputs):
+        self.run_script('hpRNA_generate.py', '-o', self.path(output), '--count', *inputs)
+        counted = {}
+        for line in open(self.path(output, 'counts_out.txt')):
+            start, end, length, count = line.split()
+            counted[start, end, int(length)] = int(count)
+        expected = {}
+        for p in plain:
+            key = (p[:len(start)], p[-1], len(p))
+            expected[key] = expected.get(key, 0) + 1
+        self.assertEqual(counted, expected)
+
+    def test_counts(self):
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt')]
+        self.counts('hamiltonian', self.generate('plain', *inputs), *inputs)
+        inputs = ['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt'),
+                  '-r', example(2, 'require.txt')]
+        self.counts('rules', self.generate('rules', *inputs), *inputs)
+
+
+class ZddTest(ModeTest):
+    '''
+    hpRNA_generate.py --zdd, and hpRNA_constrain.py on its diagram.
+
+    '''
+
+    def expand(self, name):
+        import hpRNA_zdd
+        zdd = hpRNA_zdd.load(open(name))
+        return sorted(zdd.to_path(chosen, start) for start, end, n in zdd.roots for chosen in zdd.iter_sets(n))
+
+    def test_paths(self):
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt')]
+        plain = self.generate('plain', *inputs)
+        self.run_script('hpRNA_generate.py', '-o', self.path('zdd'), '--zdd', *inputs)
+        self.assertPaths(self.expand(self.path('zdd', 'paths_out.zdd')), sorted(plain))
+
+        constraints = self.write('constrain.txt', 'bc 1\ncd 0\n')
+        self.run_script('hpRNA_constrain.py', '-p', self.path('plain', 'paths_out.txt'), '-x', constraints, '-o', self.path('plain'))
+        constrained = sorted(read_lines(self.path('plain', 'paths_out_constrained.txt')))
+        self.assertTrue(0 < len(constrained) < len(plain))
+        self.run_script('hpRNA_constrain.py', '-p', self.path('zdd', 'paths_out.zdd'), '-x', constraints, '-o', self.path('zdd'),
+                        '-n', '20', '--seed', '1')
+        self.assertPaths(self.expand(self.path('zdd', 'paths_out_constrained.zdd')), constrained)
+        self.assertTrue(set(read_lines(self.path('zdd', 'paths_out_constrained_sample.txt'))) <= set(constrained))
+
+
+class MeetTest(ModeTest):
+    '''
+    hpRNA_generate.py --meet.
+
+    '''
+
+    def test_ends(self):
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt')]
+        ends = sorted(set(p[-2:] for p in self.generate('all', *inputs)))[:6]
+        inputs += ['-e', self.write('end.txt', '\n'.join(ends) + '\n')]
+        plain = self.generate('plain', *inputs)
+        self.assertTrue(len(plain) > len(ends))
+        self.assertPaths(self.generate('meet', '--meet', *inputs), plain)
+
+    def test_empty_end(self):
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt'), '-e', self.write('end.txt', '')]
+        self.assertEqual(self.generate('plain', *inputs), [])
+        self.assertEqual(self.generate('meet', '--meet', *inputs), [])
+
+
+class UpdateTest(ModeTest):
+    '''
+    hpRNA_generate.py --update.
+
+    '''
+
+    def test_rules(self):
+        inputs = ['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt')]
+        require = ['-r', example(2, 'require.txt')]
+        # Entering f is precluded once a and d are visited, so always.
+        positions = [line.split()[0] for line in open(example(2, 'connectivity.txt')) if line.strip()]
+        preclude = ['-p', self.write('preclude.txt', ''.join('f ad\n' if p == 'f' else p + '\n' for p in positions))]
+        self.generate('updated', *(inputs + require))
+        for n, rules in enumerate([require + preclude, [], require]):
+            plain = self.generate('plain_%i' % (n,), *(inputs + rules))
+            self.assertPaths(self.generate('updated', '-u', *(inputs + rules)), plain)
+
+
+class WorkersTest(ModeTest):
+    '''
+    hpRNA_constrain.py --workers.
+
+    '''
+
+    def test_constraints(self):
+        inputs = ['-p', example(6, 'paths_out_realized.txt'), '-x', example(6, 'constrain.txt')]
+        self.run_script('hpRNA_constrain.py', '-o', self.path('plain'), *inputs)
+        plain = read_lines(self.path('plain', 'paths_out_realized_constrained.txt'))
+        self.assertTrue(plain)
+        for workers in ['2', '3']:
+            self.run_script('hpRNA_constrain.py', '-o', self.path(workers), '--workers', workers, *inputs)
+            self.assertPaths(read_lines(self.path(workers, 'paths_out_realized_constrained.txt')), plain)
+
+
+class ServerTest(ModeTest):
+    '''
+    hpRNA_server.py and hpRNA_query.py.
+
+    '''
+
+    def test_queries(self):
+        paths = example(6, 'paths_out_realized.txt')
+        constraints = example(6, 'constrain.txt')
+        self.run_script('hpRNA_constrain.py', '-p', paths, '-x', constraints, '-o', self.path('plain'))
+        plain = read_lines(self.path('plain', 'paths_out_realized_constrained.txt'))
+
+        socket = self.path('hpRNA.sock')
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'hpRNA_server.py'), '-p', paths, '-s', socket],
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.scratch)
+        self.addCleanup(lambda: server.poll() is None and server.kill())
+        waited = 0
+        while not os.path.exists(socket) and waited < 100 and server.poll() is None:
+            time.sleep(0.1)
+            waited += 1
+        self.assertTrue(os.path.exists(socket), server.poll() is not None and server.communicate()[0])
+
+        for n in range(2):
+            self.run_script('hpRNA_query.py', '-s', socket, '-x', constraints, '-o', self.path('query'))
+            self.assertPaths(read_lines(self.path('query', 'paths_out_realized_constrained.txt')), plain)
+        counted = self.run_script('hpRNA_query.py', '-s', socket, '-x', constraints, '--count')
+        self.assertIn('%i of 5280 paths pass' % (len(plain),), counted)
+        self.run_script('hpRNA_query.py', '-s', socket, '--stop')
+        self.assertEqual(server.wait(), 0)
+
+
+class BlankLineTest(ModeTest):
+    '''
+    hpRNA_constrain.py on weighted PATHS holding blank lines, as a file of
+    the same paths without them.
+
+    '''
+
+    def run_modes(self, paths, output):
+        results = []
+        for n, options in enumerate([[], ['--workers', '2'], ['--cache', self.path(output + '_cache')],
+                                     ['--cluster', '0.5']]):
+            self.run_script('hpRNA_constrain.py', '-p', paths, '-x', example(6, 'constrain.txt'),
+                            '-o', self.path('%s_%i' % (output, n)), *options)
+            results.append(sorted(os.listdir(self.path('%s_%i' % (output, n)))))
+            results.extend(open(self.path('%s_%i' % (output, n), name)).read() for name in results[-1])
+        self.run_script('hpRNA_constrain.py', '-p', paths, '--recommend', '3', '-o', self.path(output + '_recommend'))
+        results.append(open(self.path(output + '_recommend', 'paths_recommend.txt')).read())
+        return results
+
+    def test_blank_lines(self):
+        lines = ['%s\t%i\n' % (p, k % 3 + 1) for k, p in enumerate(read_lines(example(6, 'paths_out_realized.txt')))]
+        os.makedirs(self.path('plain'))
+        os.makedirs(self.path('blank'))
+        plain = self.write(os.path.join('plain', 'paths.txt'), ''.join(lines))
+        blank = self.write(os.path.join('blank', 'paths.txt'), ''.join(lines[:100]) + '\n' + ''.join(lines[100:]) + '\n')
+        self.assertEqual(self.run_modes(blank, 'blank'), self.run_modes(plain, 'plain'))
+
+
+class EngineTest(ModeTest):
+    '''
+    hpRNA_generate.py --engine numpy.
+
+    '''
+
+    def test_levels(self):
+        # Small chunks split every level across several blocks.
+        cases = [['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt'),
+                  '-r', example(2, 'require.txt')],
+                 ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt'), '-l', self.write('length.txt', '8\n20\n')]]
+        for n, inputs in enumerate(cases):
+            plain = self.generate('plain_%i' % (n,), *inputs)
+            self.assertPaths(self.generate('numpy_%i' % (n,), '--engine', 'numpy', '--chunk', '7', *inputs), plain)
+            levels = sorted(name for name in os.listdir(self.path('plain_%i' % (n,))) if name.startswith('paths_') and name[6:8].isdigit())
+            self.assertTrue(levels)
+            for name in levels:
+                self.assertPaths(read_lines(self.path('numpy_%i' % (n,), name)), read_lines(self.path('plain_%i' % (n,), name)))
+
+
+class WriterTest(ModeTest):
+    '''
+    The buffered writers of hpRNA_io, and --background.
+
+    '''
+
+    def test_writers(self):
+        from hpRNA_io import BLOCK, open_paths
+        lines = ['%08i\n' % (k,) for k in range(BLOCK * 2 + 3)]
+        for background in [False, True]:
+            name = self.path('%s.txt' % (background,))
+            outfile = open_paths(name, 'w', background)
+            for line in lines[:BLOCK + 1]:
+                outfile.write(line)
+            self.assertEqual(outfile.tell(), 9 * (BLOCK + 1))
+            outfile.writelines(lines[BLOCK + 1:])
+            outfile.close()
+            self.assertEqual(open(name).read(), ''.join(lines))
+
+    def test_background(self):
+        inputs = ['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt'),
+                  '-r', example(2, 'require.txt')]
+        self.assertPaths(self.generate('background', '--background', *inputs), self.generate('plain', *inputs))
+        inputs = ['-p', example(6, 'paths_out_realized.txt'), '-x', example(6, 'constrain.txt'), '-c', example(6, 'connectivity.txt'), '-m']
+        self.run_script('hpRNA_constrain.py', '-o', self.path('plain'), *inputs)
+        self.run_script('hpRNA_constrain.py', '-o', self.path('background'), '--background', *inputs)
+        for name in os.listdir(self.path('plain')):
+            self.assertEqual(open(self.path('background', name)).read(), open(self.path('plain', name)).read())
+
+
+class CompressTest(ModeTest):
+    '''
+    hpRNA_generate.py --compress, and hpRNA_constrain.py on its files.
+
+    '''
+
+    def test_levels(self):
+        import gzip
+        inputs = ['-c', example(3, 'connectivity.txt'), '-s', example(3, 'start.txt')]
+        self.generate('plain', *inputs)
+        self.run_script('hpRNA_generate.py', '-o', self.path('compress'), '--compress', *inputs)
+        names = [name for name in os.listdir(self.path('plain')) if name.startswith('paths_') and (name[6:8].isdigit() or name == 'paths_out.txt')]
+        self.assertTrue(len(names) > 10)
+        for name in names:
+            self.assertEqual(gzip.open(self.path('compress', name + '.gz')).read(), open(self.path('plain', name)).read())
+
+        constraints = self.write('constrain.txt', 'bc 1\ncd 0\n')
+        for output, name in [('plain', 'paths_out.txt'), ('compress', 'paths_out.txt.gz')]:
+            self.run_script('hpRNA_constrain.py', '-p', self.path(output, name), '-x', constraints, '-o', self.path(output))
+        self.assertEqual(gzip.open(self.path('compress', 'paths_out_constrained.txt.gz')).read(),
+                         open(self.path('plain', 'paths_out_constrained.txt')).read())
+
+
+class TrieTest(ModeTest):
+    '''
+    hpRNA_generate.py --trie, and reading its levels.
+
+    '''
+
+    def test_levels(self):
+        from hpRNA_constrain import read_paths
+        inputs = ['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt'),
+                  '-r', example(2, 'require.txt')]
+        plain = self.generate('plain', *inputs)
+        self.assertPaths(self.generate('trie', '--trie', *inputs), plain)
+        levels = [name for name in os.listdir(self.path('trie')) if name.endswith('.trie')]
+        self.assertTrue(len(levels) > 5)
+        for name in levels:
+            found = [line.strip() for line in read_paths(open(self.path('trie', name), 'rb'))]
+            self.assertPaths(found, read_lines(self.path('plain', name[:-5] + '.txt')))
+        # Resuming from a trie level gives the paths again.
+        self.assertPaths(self.generate('trie', '--trie', '-i', '7', *inputs), plain)
+
+
+class IndexTest(ModeTest):
+    '''
+    The offset index of hpRNA_index.py and --index.
+
+    '''
+
+    def test_index(self):
+        from hpRNA_index import PathIndex, build_index, open_index
+        inputs = ['-c', example(2, 'connectivity.txt'), '-s', example(2, 'start.txt'), '-l', example(2, 'length.txt'),
+                  '-r', example(2, 'require.txt')]
+        plain = self.generate('indexed', '--index', *inputs)
+        name = self.path('indexed', 'paths_out.txt')
+        text = open(name).read()
+        lines = text.splitlines(True)
+        for stride in [256, 7, 1]:
+            if stride != 256:
+                self.assertEqual(build_index(name, stride), len(plain))
+            index = PathIndex(name)
+            self.assertEqual(len(index), len(plain))
+            for lo, hi in [(0, 1), (6, 8), (7, 30), (len(plain) - 3, len(plain) + 5), (5, 5)]:
+                self.assertEqual(index.lines(lo, hi), ''.join(lines[lo:hi]))
+            chunks = index.chunks(4)
+            self.assertEqual(''.join(text[a:b] for a, b in chunks), text)
+            index.close()
+        printed = self.run_script('hpRNA_index.py', '-p', name, '--get', '9', '2')
+        self.assertEqual(printed, lines[9] + lines[2])
+
+        # An index left behind by a rewrite is rebuilt rather than used.
+        self.write(os.path.join('indexed', 'paths_out.txt'), ''.join(lines[:20]))
+        self.assertRaises(Exception, PathIndex, name)
+        self.assertEqual(open_index(name).lines(0, 30), ''.join(lines[:20]))
+
+
+class RecommendTest(ModeTest):
+    '''
+    hpRNA_constrain.py --recommend.
+
+    '''
+
+    def test_ranking(self):
+        import math
+        lines = ['%s\t%i\n' % (p, k % 3 + 1) for k, p in enumerate(read_lines(example(6, 'paths_out_realized.txt')))]
+        paths = self.write('paths.txt', ''.join(lines))
+        for constraints in [[], ['-x', example(6, 'constrain.txt')]]:
+            self.run_script('hpRNA_constrain.py', '-p', paths, '--recommend', '3', '-o', self.path('out'), *constraints)
+            passed = self.path('out', 'paths_constrained.txt') if constraints else paths
+            constrained = set(min(line.split()[0], line.split()[0][::-1]) for line in open(example(6, 'constrain.txt'))) if constraints else set()
+            occupied = {}
+            total = 0.0
+            for line in open(passed):
+                path, weight = (line.split() + ['1'])[:2]
+                total += float(weight)
+                for a, b in zip(path[:-1], path[1:]):
+                    edge = min(a + b, b + a)
+                    occupied[edge] = occupied.get(edge, 0.0) + float(weight)
+            name = 'paths_constrained_recommend.txt' if constraints else 'paths_recommend.txt'
+            rows = [line.split() for line in open(self.path('out', name))][1:]
+            self.assertEqual(sorted(row[0] for row in rows), sorted(set(occupied) - constrained))
+            bits = []
+            for edge, count, fraction, gain in rows:
+                p = occupied[edge] / total
+                self.assertAlmostEqual(float(count), occupied[edge])
+                self.assertAlmostEqual(float(fraction), p, 4)
+                self.assertAlmostEqual(float(gain), 0.0 if p >= 1 else -(p * math.log(p, 2) + (1 - p) * math.log(1 - p, 2)), 4)
+                bits.append(float(gain))
+            self.assertEqual(bits, sorted(bits, reverse=True))
+
+
+class ClusterTest(ModeTest):
+    '''
+    hpRNA_cluster.py, and hpRNA_constrain.py --cluster.
+
+    '''
+
+    def edges(self, path):
+        return set(min(a + b, b + a) for a, b in zip(path[:-1], path[1:]))
+
+    def far(self, a, b, hamming):
+        differ = len(a ^ b)
+        return differ if hamming else differ / float(len(a | b))
+
+    def test_clusters(self):
+        import hpRNA_cluster
+        paths = read_lines(example(6, 'paths_out_realized.txt'))
+        edges = [self.edges(p) for p in paths]
+        # Up to EXACT paths clusters are exact, beyond they come from MinHash.
+        for count, limit, hamming in [(1000, 0.4, False), (1000, 12, True), (len(paths), 0.3, False)]:
+            clusters = hpRNA_cluster.cluster(paths[:count], limit, hamming)
+            members = sorted(m for k, found in clusters for m in found)
+            self.assertEqual(members, range(count))
+            for k, found in clusters:
+                self.assertIn(k, found)
+                self.assertTrue(all(self.far(edges[k], edges[m], hamming) <= limit for m in found))
+            if count <= hpRNA_cluster.EXACT:
+                # Each representative is the first path left by the ones before.
+                representatives = [k for k, found in clusters]
+                self.assertEqual(representatives, sorted(representatives))
+                for n, k in enumerate(representatives):
+                    self.assertTrue(all(self.far(edges[j], edges[k], hamming) > limit for j in representatives[:n]))
+
+        lines = ['%s\t%i\n' % (p, k % 3 + 1) for k, p in enumerate(paths)]
+        self.run_script('hpRNA_constrain.py', '-p', self.write('paths.txt', ''.join(lines)), '--cluster', '0.3', '-o', self.path('out'))
+        rows = [(line.split() + ['1'])[:2] for line in open(self.path('out', 'paths_clusters.txt'))]
+        self.assertTrue(set(row[0] for row in rows) <= set(paths))
+        weights = [float(row[1]) for row in rows]
+        self.assertEqual(sum(weights), sum(k % 3 + 1 for k in range(len(paths))))
+        self.assertEqual(weights, sorted(weights, reverse=True))
+
+### MAIN
+
+if __name__ == '__main__':
+    unittest.main()
+
+### ENDS